@@ -0,0 +1,889 @@
+"""
+Benchmarks de KMD.
+Uso: python bench.py <benchmark> [opciones]
+
+Benchmarks disponibles:
+    startup       - Mide el tiempo de arranque de los comandos baratos (version, help, ...)
+                    y falla si se pasa del presupuesto o si importan módulos pesados.
+    stress-locks  - Lanza varios procesos que registran/desregistran paquetes y compiten por
+                    el lock de un mismo paquete, y comprueba que el registro queda consistente.
+    stream-index  - Compara json.load con el parser en streaming del índice (búsqueda de un paquete
+                    con parada temprana y recorrido completo) en tiempo y memoria máxima.
+    snapshot      - Compara el tiempo de una búsqueda en frío (proceso nuevo) con el snapshot binario
+                    del índice frente a parsear index.json.
+    search        - Construye, guarda y carga el índice de búsqueda de un catálogo sintético
+                    grande y mide la latencia de las consultas.
+    memory        - Compara la memoria máxima (RSS) y el tiempo de recolección de basura de un catálogo
+                    sintético grande guardado como diccionarios del JSON o como registros compactos.
+    hashing       - Mide el rendimiento del hash de archivos instalados: lecturas de 4 KiB en un hilo
+                    frente al servicio de hash (bloques grandes en paralelo) y las huellas rápidas.
+    pipeline      - Instala, actualiza y desinstala paquetes en paralelo desde un servidor HTTP local,
+                    inyectando fallos (descargas cortadas, hash incorrecto, manifest roto, script que
+                    se cuelga, disco lleno), y comprueba que no quedan instalaciones a medias.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(ROOT, "source.py")
+ENTRY = os.path.join(ROOT, "kmd.py") # Punto de entrada: importa source.py, así se usa su bytecode en caché
+
+# -- startup --
+STARTUP_COMMANDS = ["version", "help", "config"] # Comandos baratos a medir
+HEAVY_MODULES = ["requests", "tqdm", "zipfile", "hashlib", "subprocess", "tempfile"] # No deben importarse al arrancar
+# (salvo los que ya importe el intérprete vacío, p. ej. por hooks de site-packages)
+STARTUP_BUDGET_MS = 100 # Presupuesto por defecto (tiempo total del proceso, mejor de N ejecuciones)
+
+def parse_importtime(stderr):
+    """
+    Parsea la salida de "python -X importtime".
+    Devuelve un diccionario {módulo: (tiempo acumulado en microsegundos, es_de_primer_nivel)}.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(cumulative_us), not name[1:].startswith(" "))
+    return modules
+
+def run_startup(args):
+    """
+    Ejecuta cada comando barato varias veces con "-X importtime" a través de kmd.py y compara el mejor
+    tiempo contra el presupuesto. Devuelve el código de salida (0 si todo está dentro del presupuesto).
+    """
+    # Compilar antes para no medir la compilación a bytecode
+    subprocess.run([sys.executable, "-m", "compileall", "-q", SOURCE], check=True)
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.update({
+            "KMD_INSTALL_PATH": os.path.join(tmp, "packages"),
+            "KMD_LOG_PATH": os.path.join(tmp, "log"),
+            "KMD_CACHE_PATH": os.path.join(tmp, "cache"),
+            "KMD_CONFIG": os.path.join(tmp, "config.json"),
+        })
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+
+        # Módulos que ya importa el intérprete sin KMD: no cuentan como importados por KMD
+        baseline = subprocess.run([sys.executable, "-X", "importtime", "-c", "pass"],
+                                  env=env, capture_output=True, text=True)
+        preloaded = set(parse_importtime(baseline.stderr))
+        if preloaded & set(HEAVY_MODULES):
+            print(f"Nota: el intérprete ya importa {', '.join(sorted(preloaded & set(HEAVY_MODULES)))} al arrancar (no se cuentan)")
+
+        print(f"{'Comando':<12} {'Mejor (ms)':>10} {'Media (ms)':>10} {'Imports (ms)':>12}  Módulos pesados")
+        for command in STARTUP_COMMANDS:
+            times = []
+            modules = {}
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                result = subprocess.run(
+                    [sys.executable, "-X", "importtime", ENTRY, command],
+                    env=env, capture_output=True, text=True
+                )
+                times.append((time.perf_counter() - start) * 1000)
+                if result.returncode != 0:
+                    print(f"Error: 'kmd {command}' terminó con código {result.returncode}")
+                    print(result.stderr)
+                    return 1
+                modules = parse_importtime(result.stderr)
+
+            heavy = [m for m in HEAVY_MODULES if m in modules and m not in preloaded]
+            top_level = sum(us for us, first_level in modules.values() if first_level) / 1000
+            best = min(times)
+            print(f"{command:<12} {best:>10.1f} {sum(times) / len(times):>10.1f} {top_level:>12.1f}  {', '.join(heavy) or '-'}")
+            if heavy or best > args.budget_ms:
+                failed = True
+
+    if failed:
+        print(f"\nFALLO: algún comando superó el presupuesto de {args.budget_ms} ms o importó módulos pesados.")
+        return 1
+    print(f"\nOK: todos los comandos dentro del presupuesto de {args.budget_ms} ms.")
+    return 0
+
+# -- stress-locks --
+def _stress_worker(root, worker_id, iterations, shared_id):
+    """
+    Proceso de prueba: registra paquetes propios (desregistrando la mitad) y, en cada iteración,
+    incrementa un contador protegido por el lock de un paquete compartido.
+    """
+    sys.path.insert(0, ROOT)
+    import source
+    source.configure({
+        "installPath": os.path.join(root, "packages"),
+        "logPath": os.path.join(root, "log"),
+        "cachePath": os.path.join(root, "cache"),
+    })
+    counter_file = os.path.join(root, "counter.txt")
+    for i in range(iterations):
+        package_id = f"Stress@w{worker_id}-{i}"
+        with source.package_lock(package_id):
+            folder = os.path.join(source.INSTALL_PATH, f"w{worker_id}-{i}")
+            os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(folder, "file.txt"), "w") as f:
+                f.write(package_id)
+            source.register_package({"author": "Stress", "name": f"w{worker_id}-{i}", "version": "1.0.0", "dependencies": []})
+        if i % 2 == 1:
+            with source.package_lock(f"Stress@w{worker_id}-{i - 1}"):
+                source.unregister_package(f"Stress@w{worker_id}-{i - 1}")
+
+        # Sección crítica compartida: leer, esperar y escribir (se pierden incrementos sin lock)
+        with source.package_lock(shared_id):
+            with open(counter_file, "r") as f:
+                value = int(f.read() or 0)
+            time.sleep(0.001)
+            with open(counter_file, "w") as f:
+                f.write(str(value + 1))
+
+def run_stress_locks(args):
+    """
+    Ejecuta el stress test de locks entre procesos y valida el resultado.
+    Devuelve el código de salida (0 si el registro y el contador quedaron consistentes).
+    """
+    import json
+    import multiprocessing
+
+    with tempfile.TemporaryDirectory() as root:
+        with open(os.path.join(root, "counter.txt"), "w") as f:
+            f.write("0")
+        ctx = multiprocessing.get_context("spawn")
+        processes = [
+            ctx.Process(target=_stress_worker, args=(root, w, args.iterations, "Stress@shared"))
+            for w in range(args.workers)
+        ]
+        start = time.perf_counter()
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        elapsed = time.perf_counter() - start
+
+        errors = []
+        if any(p.exitcode != 0 for p in processes):
+            errors.append("algún proceso terminó con error")
+
+        with open(os.path.join(root, "packages", "installed.json"), "r") as f:
+            registry = json.load(f)
+        registered = {f"{p['author']}@{p['name']}" for p in registry["installed"]}
+        expected = {
+            f"Stress@w{w}-{i}" for w in range(args.workers) for i in range(args.iterations)
+            if i % 2 == 1 or i == args.iterations - 1
+        }
+        if registered != expected:
+            errors.append(f"registro inconsistente: faltan {len(expected - registered)}, sobran {len(registered - expected)}")
+
+        with open(os.path.join(root, "counter.txt"), "r") as f:
+            counter = int(f.read())
+        if counter != args.workers * args.iterations:
+            errors.append(f"contador compartido = {counter}, se esperaba {args.workers * args.iterations}")
+
+        leftovers = [n for n in os.listdir(os.path.join(root, "packages")) if n.endswith(".tmp")]
+        if leftovers:
+            errors.append(f"quedaron archivos temporales: {', '.join(leftovers)}")
+
+    operations = args.workers * args.iterations
+    print(f"{args.workers} procesos x {args.iterations} iteraciones en {elapsed:.2f} s ({operations / elapsed:.0f} iteraciones/s)")
+    print(f"Paquetes registrados: {len(registered)} (esperados: {len(expected)}), contador: {counter}")
+    if errors:
+        print("FALLO: " + "; ".join(errors))
+        return 1
+    print("OK: el registro y el contador compartido son consistentes.")
+    return 0
+
+# -- Catálogo sintético --
+SYNTHETIC_WORDS = [
+    "json", "http", "image", "audio", "video", "parser", "server", "client", "crypto", "math",
+    "string", "date", "time", "file", "path", "net", "socket", "thread", "pool", "cache",
+    "log", "config", "yaml", "xml", "csv", "zip", "tar", "shell", "term", "color",
+    "font", "render", "graph", "plot", "table", "grid", "query", "sql", "store", "queue",
+]
+
+def make_synthetic_index(n, seed=0):
+    """
+    Genera un índice de paquetes sintético con n paquetes, con el mismo formato que index.json.
+    """
+    import random
+    rng = random.Random(seed)
+    authors = [f"Author{i}" for i in range(max(1, n // 50))]
+    packages = []
+    for i in range(n):
+        words = rng.sample(SYNTHETIC_WORDS, 3)
+        name = words[0] + words[1].capitalize() + str(i)
+        versions = [
+            {
+                "versionName": f"1.{v}.0",
+                "latest": v == 2,
+                "downloadURL": f"https://example.com/{name}/1.{v}.0.zip",
+                "hash": f"{i:032x}{v:032x}",
+            }
+            for v in range(3)
+        ]
+        packages.append({
+            "author": rng.choice(authors),
+            "name": name,
+            "description": f"Librería de {words[0]} y {words[1]} con soporte para {words[2]}",
+            "versions": versions,
+        })
+    return packages
+
+# -- stream-index --
+def _measure(func):
+    """
+    Ejecuta func dos veces: una para medir el tiempo y otra con tracemalloc para medir la memoria.
+    Devuelve (resultado, milisegundos, memoria máxima reservada en MB).
+    """
+    import gc
+    import tracemalloc
+    gc.collect()
+    start = time.perf_counter()
+    result = func()
+    elapsed = (time.perf_counter() - start) * 1000
+    gc.collect()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def run_stream_index(args):
+    """
+    Genera un index.json sintético y mide el tiempo y la memoria máxima de json.load frente al
+    parser en streaming (iter_json_array).
+    Devuelve el código de salida (0 si el streaming usa menos memoria que json.load en todos los casos).
+    """
+    import json
+    sys.path.insert(0, ROOT)
+    import source
+
+    packages = make_synthetic_index(args.packages)
+    ids = [f"{p['author']}@{p['name']}" for p in packages]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(packages, f, indent=2)
+        del packages
+        size_mb = os.path.getsize(path) / 1024 / 1024
+
+        def load_all():
+            with open(path, "rb") as f:
+                return len(json.loads(f.read()))
+
+        def stream_find(package_id):
+            with open(path, "rb") as f:
+                return next((p for p in source.iter_json_array(f) if f"{p['author']}@{p['name']}" == package_id), None)
+
+        def stream_all():
+            with open(path, "rb") as f:
+                return sum(1 for _ in source.iter_json_array(f))
+
+        cases = [
+            ("json.load (todo)", load_all),
+            ("streaming: primero", lambda: stream_find(ids[0])),
+            ("streaming: mitad", lambda: stream_find(ids[len(ids) // 2])),
+            ("streaming: último", lambda: stream_find(ids[-1])),
+            ("streaming: no existe", lambda: stream_find("Nadie@nada")),
+            ("streaming (todo)", stream_all),
+        ]
+        print(f"index.json sintético: {args.packages} paquetes, {size_mb:.1f} MB\n")
+        print(f"{'Caso':<22} {'Tiempo (ms)':>12} {'Memoria máx. (MB)':>18}")
+        results = {}
+        for name, func in cases:
+            _, elapsed, peak = _measure(func)
+            results[name] = peak
+            print(f"{name:<22} {elapsed:>12.1f} {peak:>18.2f}")
+
+    baseline = results["json.load (todo)"]
+    worst = max(peak for name, peak in results.items() if name.startswith("streaming"))
+    if worst >= baseline:
+        print("\nFALLO: el streaming no reduce la memoria máxima respecto a json.load.")
+        return 1
+    print(f"\nOK: el streaming usa como mucho {worst:.2f} MB (json.load: {baseline:.2f} MB).")
+    return 0
+
+# -- snapshot --
+SNAPSHOT_LOOKUP = """
+import sys, time, json
+sys.path.insert(0, {root!r})
+import source
+start = time.perf_counter()
+mode, path, package_id = sys.argv[1:4]
+if mode == "json":
+    with open(path, "rb") as f:
+        entry = next((p for p in json.loads(f.read()) if p["author"] + "@" + p["name"] == package_id), None)
+elif mode == "stream":
+    with open(path, "rb") as f:
+        entry = next((p for p in source.iter_json_array(f) if p["author"] + "@" + p["name"] == package_id), None)
+else:
+    entry = source.CatalogSnapshot.open(path).get(package_id)
+print((time.perf_counter() - start) * 1000, entry is not None)
+"""
+
+def run_snapshot(args):
+    """
+    Genera un index.json sintético y su snapshot, y mide en procesos nuevos el tiempo de buscar un paquete
+    parseando el JSON, leyéndolo en streaming o con el snapshot.
+    Devuelve el código de salida (0 si el snapshot es más rápido que el JSON en todos los casos).
+    """
+    import json
+    sys.path.insert(0, ROOT)
+    import source
+
+    packages = make_synthetic_index(args.packages)
+    ids = [f"{p['author']}@{p['name']}" for p in packages]
+    lookups = [("primero", ids[0]), ("mitad", ids[len(ids) // 2]), ("último", ids[-1]), ("no existe", "Nadie@nada")]
+    code = SNAPSHOT_LOOKUP.format(root=ROOT)
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        index_path = os.path.join(tmp, "index.json")
+        snapshot_path = os.path.join(tmp, "index.snapshot")
+        with open(index_path, "w", encoding="utf-8") as f:
+            json.dump(packages, f, indent=2)
+        del packages
+
+        start = time.perf_counter()
+        with open(index_path, "rb") as f:
+            source.CatalogSnapshot.build(snapshot_path, source.iter_json_array(f), "bench")
+        build_ms = (time.perf_counter() - start) * 1000
+        print(f"{args.packages} paquetes: index.json {os.path.getsize(index_path) / 1024 / 1024:.1f} MB, "
+              f"snapshot {os.path.getsize(snapshot_path) / 1024 / 1024:.1f} MB (construido en {build_ms:.0f} ms)\n")
+
+        print(f"{'Búsqueda':<10} {'JSON (ms)':>10} {'Streaming (ms)':>15} {'Snapshot (ms)':>14}")
+        for name, package_id in lookups:
+            row = {}
+            for mode, path in (("json", index_path), ("stream", index_path), ("snapshot", snapshot_path)):
+                times = []
+                for _ in range(args.runs):
+                    result = subprocess.run([sys.executable, "-c", code, mode, path, package_id],
+                                            capture_output=True, text=True, check=True)
+                    elapsed, found = result.stdout.split()
+                    times.append(float(elapsed))
+                    if (found == "True") != (name != "no existe"):
+                        print(f"FALLO: resultado incorrecto en modo {mode} para {package_id}")
+                        return 1
+                row[mode] = min(times)
+            print(f"{name:<10} {row['json']:>10.1f} {row['stream']:>15.1f} {row['snapshot']:>14.2f}")
+            if row["snapshot"] >= row["json"]:
+                failed = True
+
+    if failed:
+        print("\nFALLO: el snapshot no fue más rápido que parsear el JSON.")
+        return 1
+    print("\nOK: las búsquedas con el snapshot son más rápidas que parsear el JSON.")
+    return 0
+
+# -- search --
+SEARCH_QUERIES = ["json", "httpServer", "audio parser", "Author3", "imag", "crytpo", "pool cache thread", "zzz"]
+SEARCH_BUDGET_MS = 50 # Presupuesto por consulta (percentil 95)
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def run_search(args):
+    """
+    Mide la construcción, el guardado, la carga y las consultas del índice de búsqueda.
+    Devuelve el código de salida (0 si el percentil 95 de las consultas está dentro del presupuesto).
+    """
+    sys.path.insert(0, ROOT)
+    import source
+
+    packages = make_synthetic_index(args.packages)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "search-index.bin")
+        start = time.perf_counter()
+        index = source.SearchIndex.build(packages, "bench")
+        build_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        index.save(path)
+        save_ms = (time.perf_counter() - start) * 1000
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        start = time.perf_counter()
+        index = source.SearchIndex.load(path, "bench")
+        load_ms = (time.perf_counter() - start) * 1000
+
+    print(f"{args.packages} paquetes, {len(index.terms)} términos")
+    print(f"Construcción: {build_ms:.1f} ms, guardado: {save_ms:.1f} ms ({size_mb:.1f} MB), carga: {load_ms:.1f} ms\n")
+    print(f"{'Modo':<8} {'Mediana (ms)':>12} {'p95 (ms)':>10} {'Resultados':>10}")
+    failed = False
+    for mode in source.SEARCH_MODES:
+        times = []
+        results = 0
+        for _ in range(args.runs):
+            for query in SEARCH_QUERIES:
+                start = time.perf_counter()
+                results += len(index.query(query, mode, args.limit))
+                times.append((time.perf_counter() - start) * 1000)
+        p95 = _percentile(times, 0.95)
+        print(f"{mode:<8} {_percentile(times, 0.5):>12.2f} {p95:>10.2f} {results // args.runs:>10}")
+        if p95 > args.budget_ms:
+            failed = True
+
+    if failed:
+        print(f"\nFALLO: el percentil 95 de algún modo superó el presupuesto de {args.budget_ms} ms.")
+        return 1
+    print(f"\nOK: todas las consultas dentro del presupuesto de {args.budget_ms} ms.")
+    return 0
+
+# -- memory --
+MEMORY_WRITE = """
+import json, sys
+sys.path.insert(0, {root!r})
+import bench
+with open(sys.argv[2], "w", encoding="utf-8") as f:
+    json.dump(bench.make_synthetic_index(int(sys.argv[1])), f)
+"""
+
+MEMORY_LOAD = """
+import gc, sys, time
+sys.path.insert(0, {root!r})
+import source
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024 # macOS: bytes; Linux: KB
+
+mode, path = sys.argv[1:3]
+base = peak_rss_mb()
+start = time.perf_counter()
+with open(path, "rb") as f:
+    if mode == "dicts":
+        packages = list(source.iter_json_array(f))
+        by_id = {{p["author"] + "@" + p["name"]: p for p in packages}}
+    else:
+        catalog = source.Catalog(source.iter_json_array(f))
+load_ms = (time.perf_counter() - start) * 1000
+start = time.perf_counter()
+gc.collect()
+gc_ms = (time.perf_counter() - start) * 1000
+print(base, peak_rss_mb(), load_ms, gc_ms)
+"""
+
+def run_memory(args):
+    """
+    Genera un index.json sintético y lo carga en procesos nuevos como lista de diccionarios (el formato
+    del JSON) y como Catalog (registros compactos), midiendo la memoria máxima del proceso (RSS),
+    el tiempo de carga y lo que tarda una recolección de basura completa con el catálogo en memoria.
+    Devuelve el código de salida (0 si los registros compactos usan menos memoria).
+    """
+    import importlib.util
+    if importlib.util.find_spec("resource") is None:
+        print("Este benchmark necesita el módulo resource (Linux/macOS).")
+        return 1
+
+    code = MEMORY_LOAD.format(root=ROOT)
+    with tempfile.TemporaryDirectory() as tmp:
+        # El índice se genera en otro proceso: en Linux el RSS máximo del padre se hereda al lanzar los hijos
+        path = os.path.join(tmp, "index.json")
+        subprocess.run([sys.executable, "-c", MEMORY_WRITE.format(root=ROOT), str(args.packages), path], check=True)
+        print(f"Catálogo sintético: {args.packages} paquetes, {os.path.getsize(path) / 1024 / 1024:.1f} MB\n")
+        print(f"{'Formato':<22} {'RSS máx. (MB)':>14} {'Catálogo (MB)':>14} {'Carga (ms)':>11} {'GC (ms)':>9}")
+        results = {}
+        for mode, label in (("dicts", "diccionarios (JSON)"), ("compact", "registros compactos")):
+            result = subprocess.run([sys.executable, "-c", code, mode, path], capture_output=True, text=True, check=True)
+            base, peak, load_ms, gc_ms = (float(value) for value in result.stdout.split())
+            results[mode] = peak
+            print(f"{label:<22} {peak:>14.1f} {peak - base:>14.1f} {load_ms:>11.0f} {gc_ms:>9.1f}")
+
+    if results["compact"] >= results["dicts"]:
+        print("\nFALLO: los registros compactos no reducen la memoria máxima.")
+        return 1
+    print(f"\nOK: los registros compactos usan {results['dicts'] - results['compact']:.1f} MB menos "
+          f"({100 * (1 - results['compact'] / results['dicts']):.0f}%).")
+    return 0
+
+# -- hashing --
+def _hash_small_reads(path):
+    import hashlib
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(4096), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def run_hashing(args):
+    """
+    Escribe archivos aleatorios en una carpeta temporal (quedan en la caché del sistema, así que se mide
+    el hash y no el disco) y los hashea con lecturas de 4 KiB en un hilo, con hash_file en un hilo y con
+    hash_files en paralelo, más las huellas rápidas disponibles (ver LOCAL_DIGESTS).
+    Devuelve el código de salida (0 si hash_files con SHA-256 es más rápido que las lecturas de 4 KiB).
+    """
+    sys.path.insert(0, ROOT)
+    import source
+
+    size = args.size_mb * 1024 * 1024
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(args.files):
+            path = os.path.join(tmp, f"{i}.bin")
+            with open(path, "wb") as f:
+                f.write(os.urandom(size))
+            paths.append(path)
+        total_mb = args.files * args.size_mb
+
+        cases = [
+            ("sha256, 4 KiB, 1 hilo", lambda: [_hash_small_reads(p) for p in paths]),
+            ("sha256, hash_file, 1 hilo", lambda: [source.hash_file(p) for p in paths]),
+            (f"sha256, hash_files, {args.jobs} hilos", lambda: source.hash_files(paths, "sha256", args.jobs)),
+        ]
+        for algorithm in source.LOCAL_DIGESTS[1:]:
+            try:
+                source.new_hasher(algorithm)
+            except ImportError:
+                print(f"{algorithm}: no disponible (falta su paquete)")
+                continue
+            cases.append((f"{algorithm}, hash_files, {args.jobs} hilos",
+                          lambda algorithm=algorithm: source.hash_files(paths, algorithm, args.jobs)))
+
+        print(f"{args.files} archivos de {args.size_mb} MB ({total_mb} MB)\n")
+        print(f"{'Caso':<32} {'Tiempo (s)':>10} {'MB/s':>8}")
+        speeds = {}
+        for label, func in cases:
+            best = None
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            speeds[label] = total_mb / best
+            print(f"{label:<32} {best:>10.2f} {speeds[label]:>8.0f}")
+
+    baseline, parallel = speeds[cases[0][0]], speeds[cases[2][0]]
+    if parallel <= baseline:
+        print("\nFALLO: hash_files no es más rápido que las lecturas de 4 KiB.")
+        return 1
+    print(f"\nOK: hash_files es {parallel / baseline:.1f}x más rápido que las lecturas de 4 KiB en un hilo.")
+    return 0
+
+# -- pipeline --
+PIPELINE_FAULTS = {
+    # Paquete: (fallo, versiones que se publican; la última es la que falla)
+    "Fault@truncated": ("truncated", ["1.0.0"]),
+    "Fault@badhash": ("bad-hash", ["1.0.0"]),
+    "Fault@badmanifest": ("bad-manifest", ["1.0.0"]),
+    "Fault@hang": ("hang", ["1.0.0"]),
+    "Fault@diskfull": ("disk-full", ["1.0.0"]),
+    "Fault@brokendep": ("broken-dependency", ["1.0.0"]),
+    "Fault@updatecut": ("truncated", ["1.0.0", "1.1.0"]),
+    "Fault@updatefull": ("disk-full", ["1.0.0", "1.1.0"]),
+}
+PIPELINE_SCRIPT_TIMEOUT = 2 # Segundos que se deja correr al script que se cuelga
+PIPELINE_DISK_FULL_AFTER = 2 # Objetos del almacén que se escriben antes de simular el disco lleno
+
+def _pipeline_zip(path, manifest, files, raw_manifest=None):
+    import json
+    import zipfile
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("manifest.json", raw_manifest if raw_manifest is not None else json.dumps(manifest))
+        for name, data in files.items():
+            z.writestr(name, data)
+
+def make_pipeline_fixture(root, base_url, packages, files, file_kb):
+    """
+    Genera en root un index.json y los ZIP de los paquetes de prueba: packages paquetes sanos
+    (Load@pkgN, versiones 1.0.0 y 1.1.0, con files archivos de file_kb KB, uno de ellos igual en todos
+    y la mitad con script de post-instalación) y los de PIPELINE_FAULTS.
+    Las descargas bajo /truncated/ las corta el servidor (ver _pipeline_server).
+    """
+    import json
+    import random
+    import hashlib
+    rng = random.Random(0)
+    shared = rng.randbytes(file_kb * 1024)
+    os.makedirs(os.path.join(root, "pkgs"), exist_ok=True)
+    os.makedirs(os.path.join(root, "truncated"), exist_ok=True)
+    index = []
+
+    def publish(package_id, versions, fault=None, dependencies=None, script=None):
+        author, name = package_id.split("@")
+        entry = {"author": author, "name": name, "description": f"pipeline {name}", "versions": []}
+        for i, version in enumerate(versions):
+            failing = fault and i == len(versions) - 1
+            manifest = {"author": author, "name": name, "version": version,
+                        "description": entry["description"], "dependencies": dependencies or []}
+            content = {"shared.bin": shared}
+            for n in range(files - 1):
+                content[f"data/{n}.bin"] = rng.randbytes(file_kb * 1024)
+            if fault == "hang":
+                script = "import time\ntime.sleep(3600)\n"
+            if script:
+                manifest["postInstallScript"] = "post.py"
+                content["post.py"] = script
+            folder = "truncated" if failing and fault == "truncated" else "pkgs"
+            path = os.path.join(root, folder, f"{package_id}-{version}.zip")
+            _pipeline_zip(path, manifest, content, "{ roto" if failing and fault == "bad-manifest" else None)
+            with open(path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            if failing and fault == "bad-hash":
+                digest = "0" * 64
+            entry["versions"].append({"versionName": version, "downloadURL": f"{base_url}/{folder}/{package_id}-{version}.zip",
+                                      "hash": digest, "latest": i == len(versions) - 1})
+        index.append(entry)
+
+    for n in range(packages):
+        publish(f"Load@pkg{n}", ["1.0.0", "1.1.0"], script="print('ok')\n" if n % 2 else None)
+    for package_id, (fault, versions) in PIPELINE_FAULTS.items():
+        if fault == "broken-dependency":
+            publish(package_id, versions, dependencies=[{"id": "Fault@badhash", "version": None}])
+        else:
+            publish(package_id, versions, fault)
+    with open(os.path.join(root, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f)
+
+def _pipeline_server(root):
+    """
+    Arranca un servidor HTTP en un puerto libre que sirve root. Las descargas bajo /truncated/
+    anuncian el tamaño completo pero se cortan a la mitad.
+    Devuelve el servidor (ya atendiendo en otro hilo).
+    """
+    import threading
+    from functools import partial
+    from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+    class Handler(SimpleHTTPRequestHandler):
+        def do_GET(self):
+            if not self.path.startswith("/truncated/"):
+                return super().do_GET()
+            with open(self.translate_path(self.path), "rb") as f:
+                data = f.read()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/zip")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data[:len(data) // 2])
+            self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(Handler, directory=root))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def _pipeline_init(root, index_url):
+    """
+    Inicializa un proceso del pool: configura KMD contra la raíz de prueba y deja sus temporales en root/tmp.
+    """
+    sys.path.insert(0, ROOT)
+    import source
+    tempfile.tempdir = os.path.join(root, "tmp")
+    source.configure({
+        "installPath": os.path.join(root, "packages"),
+        "logPath": os.path.join(root, "log"),
+        "cachePath": os.path.join(root, "cache"),
+        "indexURL": index_url,
+        "scriptTimeout": PIPELINE_SCRIPT_TIMEOUT,
+        "scriptErrors": "abort",
+        "jobs": 1,
+    })
+
+def _pipeline_op(operation, package_id, version=None, fault=None):
+    """
+    Ejecuta una operación (install, update o uninstall) en un proceso del pool, simulando el disco
+    lleno si fault es "disk-full".
+    Devuelve (operación, ID, "ok" o el nombre de la excepción, segundos, mensaje de error).
+    """
+    import errno
+    import source
+    original = source._write_store_object
+    if fault == "disk-full":
+        writes = [0]
+
+        def write_store_object(object_path, tmp_path):
+            writes[0] += 1
+            if writes[0] > PIPELINE_DISK_FULL_AFTER:
+                raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC), object_path)
+            return original(object_path, tmp_path)
+        source._write_store_object = write_store_object
+
+    start = time.perf_counter()
+    try:
+        if operation == "install":
+            source.install(package_id, version)
+        elif operation == "update":
+            source.update(package_id)
+        else:
+            source.uninstall(package_id)
+        outcome, message = "ok", None
+    except Exception as e:
+        outcome, message = type(e).__name__, str(e)
+    finally:
+        source._write_store_object = original
+    return operation, package_id, outcome, time.perf_counter() - start, message
+
+def check_pipeline_state(source, expected):
+    """
+    Comprueba que la instalación en INSTALL_PATH es coherente tras la prueba.
+    expected: {ID: versión activa esperada} de los paquetes que deben quedar instalados.
+    Devuelve una lista de errores (vacía si todo está bien).
+    """
+    errors = []
+    installed = source._installed_by_id()
+    actual = {package_id: pkg.get("version") for package_id, pkg in installed.items()}
+    if actual != expected:
+        wrong = sorted(set(actual.items()) ^ set(expected.items()))
+        errors.append(f"registro inesperado: {', '.join(f'{p} {v}' for p, v in wrong)}")
+
+    # Carpetas que no son de ningún paquete registrado o versiones que no están en el registro
+    folders = {pkg["name"]: pkg for pkg in installed.values()}
+    for name in sorted(os.listdir(source.INSTALL_PATH)):
+        path = os.path.join(source.INSTALL_PATH, name)
+        if name.startswith(".") or not os.path.isdir(path):
+            continue
+        if name not in folders:
+            errors.append(f"carpeta huérfana: {name}")
+            continue
+        versions = {source._version_folder_name(v) for v in folders[name].get("installedVersions", {})}
+        for child in sorted(os.listdir(path)):
+            if child not in versions and child not in (source.ACTIVE_LINK, source.ACTIVE_FILE):
+                errors.append(f"versión huérfana: {name}/{child}")
+
+    for result in source.verify():
+        if result.status != "ok":
+            errors.append(f"{result.id} {result.version}: {result.status} {result.missing + result.modified}")
+
+    stats = source.cache_stats()
+    if stats.orphaned_objects:
+        errors.append(f"{stats.orphaned_objects} objetos del almacén sin usar")
+    for folder in (os.path.join(source.get_store_path(), "tmp"), tempfile.gettempdir()):
+        leftovers = os.listdir(folder) if os.path.isdir(folder) else []
+        if leftovers:
+            errors.append(f"quedaron temporales en {folder}: {', '.join(leftovers[:5])}")
+    return errors
+
+def run_pipeline(args):
+    """
+    Instala (a la versión 1.0.0), actualiza y desinstala en paralelo los paquetes del fixture
+    (ver make_pipeline_fixture) con args.workers procesos, y después comprueba el estado (ver
+    check_pipeline_state) y que cada fallo inyectado terminó en un KMDError.
+    Devuelve el código de salida (0 si todo es coherente).
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    sys.path.insert(0, ROOT)
+    import source
+
+    with tempfile.TemporaryDirectory() as root:
+        fixture = os.path.join(root, "fixture")
+        server = _pipeline_server(fixture)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        make_pipeline_fixture(fixture, base_url, args.packages, args.files, args.file_kb)
+        os.makedirs(os.path.join(root, "tmp"))
+
+        load = [f"Load@pkg{n}" for n in range(args.packages)]
+        removed = set(load[::2])
+        faults = {package_id: fault for package_id, (fault, _) in PIPELINE_FAULTS.items()}
+        updates = [p for p, (_, versions) in PIPELINE_FAULTS.items() if len(versions) > 1]
+        phases = [
+            ("install", [("install", p, "1.0.0", None) for p in load + updates]
+                        + [("install", p, None, f) for p, f in faults.items() if p not in updates]),
+            ("update", [("update", p, None, None) for p in load] + [("update", p, None, faults[p]) for p in updates]),
+            ("uninstall", [("uninstall", p, None, None) for p in sorted(removed)]),
+        ]
+        # Lo que debe fallar: las instalaciones con fallo y las actualizaciones a una versión con fallo
+        must_fail = {("install", p) for p in faults if p not in updates} | {("update", p) for p in updates}
+
+        errors = []
+        injected = []
+        print(f"{args.packages} paquetes sanos ({args.files} archivos de {args.file_kb} KB), "
+              f"{len(faults)} con fallos, {args.workers} procesos\n")
+        print(f"{'Fase':<10} {'Ops':>5} {'Fallos':>7} {'Tiempo (s)':>11} {'Ops/s':>7} {'Mediana (ms)':>13} {'p95 (ms)':>9}")
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(args.workers, mp_context=ctx, initializer=_pipeline_init,
+                                 initargs=(root, f"{base_url}/index.json")) as pool:
+            for phase, operations in phases:
+                start = time.perf_counter()
+                results = list(pool.map(_pipeline_op, *zip(*operations)))
+                elapsed = time.perf_counter() - start
+                times = [seconds * 1000 for _, _, outcome, seconds, _ in results if outcome == "ok"] or [0]
+                failed = 0
+                for operation, package_id, outcome, _, message in results:
+                    expected_failure = (operation, package_id) in must_fail
+                    if outcome != "ok":
+                        failed += 1
+                    if expected_failure:
+                        injected.append(f"{operation:<8} {package_id:<20} {faults[package_id]:<18} -> {outcome}")
+                    if expected_failure and outcome == "ok":
+                        errors.append(f"{operation} {package_id} no falló (fallo inyectado: {faults[package_id]})")
+                    elif not expected_failure and outcome != "ok":
+                        errors.append(f"{operation} {package_id} falló: {outcome}: {message}")
+                    elif outcome != "ok" and not issubclass(getattr(source, outcome, Exception), source.KMDError):
+                        errors.append(f"{operation} {package_id} lanzó {outcome} en vez de un KMDError: {message}")
+                print(f"{phase:<10} {len(results):>5} {failed:>7} {elapsed:>11.2f} {len(results) / elapsed:>7.1f} "
+                      f"{_percentile(times, 0.5):>13.0f} {_percentile(times, 0.95):>9.0f}")
+        server.shutdown()
+        print("\nFallos inyectados:\n  " + "\n  ".join(injected))
+
+        _pipeline_init(root, f"{base_url}/index.json")
+        expected = {p: "1.1.0" for p in load if p not in removed}
+        expected.update({p: "1.0.0" for p in updates})
+        errors += check_pipeline_state(source, expected)
+
+    if errors:
+        print("\nFALLO:\n- " + "\n- ".join(errors))
+        return 1
+    print(f"\nOK: los {len(must_fail)} fallos inyectados terminaron en KMDError y no dejaron instalaciones a medias.")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de KMD")
+    sub = parser.add_subparsers(dest="benchmark", required=True)
+
+    startup = sub.add_parser("startup", help="Tiempo de arranque de los comandos baratos")
+    startup.add_argument("--runs", type=int, default=10, help="Ejecuciones por comando")
+    startup.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS, help="Presupuesto en milisegundos")
+    startup.set_defaults(func=run_startup)
+
+    stress = sub.add_parser("stress-locks", help="Stress test de locks entre procesos")
+    stress.add_argument("--workers", type=int, default=8, help="Procesos concurrentes")
+    stress.add_argument("--iterations", type=int, default=25, help="Iteraciones por proceso")
+    stress.set_defaults(func=run_stress_locks)
+
+    stream = sub.add_parser("stream-index", help="Parser en streaming del índice frente a json.load")
+    stream.add_argument("--packages", type=int, default=100000, help="Paquetes del índice sintético")
+    stream.set_defaults(func=run_stream_index)
+
+    snapshot = sub.add_parser("snapshot", help="Búsqueda en frío con el snapshot binario frente a index.json")
+    snapshot.add_argument("--packages", type=int, default=100000, help="Paquetes del índice sintético")
+    snapshot.add_argument("--runs", type=int, default=3, help="Ejecuciones por caso (se toma la mejor)")
+    snapshot.set_defaults(func=run_snapshot)
+
+    search = sub.add_parser("search", help="Índice de búsqueda sobre un catálogo sintético")
+    search.add_argument("--packages", type=int, default=50000, help="Paquetes del catálogo sintético")
+    search.add_argument("--runs", type=int, default=5, help="Repeticiones de cada consulta")
+    search.add_argument("--limit", type=int, default=20, help="Resultados por consulta")
+    search.add_argument("--budget-ms", type=float, default=SEARCH_BUDGET_MS, help="Presupuesto por consulta en milisegundos")
+    search.set_defaults(func=run_search)
+
+    memory = sub.add_parser("memory", help="Memoria de un catálogo grande: diccionarios frente a registros compactos")
+    memory.add_argument("--packages", type=int, default=100000, help="Paquetes del catálogo sintético")
+    memory.set_defaults(func=run_memory)
+
+    hashing = sub.add_parser("hashing", help="Hash de archivos: lecturas de 4 KiB frente a hash_files en paralelo")
+    hashing.add_argument("--files", type=int, default=32, help="Archivos a hashear")
+    hashing.add_argument("--size-mb", type=int, default=8, help="Tamaño de cada archivo en MB")
+    hashing.add_argument("--jobs", type=int, default=4, help="Hilos de hash_files")
+    hashing.add_argument("--runs", type=int, default=3, help="Ejecuciones por caso (se toma la mejor)")
+    hashing.set_defaults(func=run_hashing)
+
+    pipeline = sub.add_parser("pipeline", help="Instalaciones en paralelo con fallos inyectados")
+    pipeline.add_argument("--packages", type=int, default=24, help="Paquetes sanos")
+    pipeline.add_argument("--files", type=int, default=20, help="Archivos por paquete")
+    pipeline.add_argument("--file-kb", type=int, default=16, help="Tamaño de cada archivo en KB")
+    pipeline.add_argument("--workers", type=int, default=8, help="Procesos concurrentes")
+    pipeline.set_defaults(func=run_pipeline)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+"""
+Punto de entrada de KMD.
+Importa source.py en vez de ejecutarlo como __main__, así Python guarda su bytecode en __pycache__
+y no lo vuelve a compilar en cada arranque.
+Uso: python kmd.py <comando> [opciones]
+"""
+import source
+
+if __name__ == '__main__':
+    source.run()
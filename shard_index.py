@@ -0,0 +1,88 @@
+"""
+Genera un índice fragmentado de KMD a partir de un index.json clásico.
+Uso: python shard_index.py <index.json> <carpeta de salida> [--prune]
+
+Escribe en la carpeta de salida:
+    index.json                  - La raíz: para cada paquete, su descripción, su última versión,
+                                  la ruta de su fragmento y el hash SHA-256 del fragmento.
+    shards/<Autor>/<Nombre>.json - Un fragmento por paquete con su entrada completa del índice.
+
+Los fragmentos que no cambian no se reescriben, así que un servidor de archivos estáticos
+los sigue sirviendo con la misma fecha y KMD solo descarga los que cambiaron.
+Para publicarlo, basta con subir la carpeta y apuntar la URL del índice (--index-url) a su index.json.
+"""
+import os
+import sys
+import json
+import hashlib
+import argparse
+from urllib.parse import quote
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+import source
+
+def shard_path(author, name):
+    """
+    Devuelve la ruta relativa (con "/") del fragmento de un paquete.
+    """
+    return f"shards/{quote(author, safe='')}/{quote(name, safe='')}.json"
+
+def write_if_changed(path, data):
+    """
+    Escribe data en path solo si el contenido cambió. Devuelve True si se escribió.
+    """
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    except OSError:
+        pass
+    source.write_file_atomic(path, data)
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera un índice fragmentado de KMD")
+    parser.add_argument("index", help="index.json clásico (un array con todos los paquetes)")
+    parser.add_argument("output", help="Carpeta de salida")
+    parser.add_argument("--prune", action="store_true", help="Borra los fragmentos de paquetes que ya no están en el índice")
+    args = parser.parse_args()
+
+    packages = {}
+    written = 0
+    with open(args.index, "rb") as f:
+        for entry in source.iter_json_array(f):
+            package_id = f"{entry['author']}@{entry['name']}"
+            relative = shard_path(entry["author"], entry["name"])
+            data = json.dumps(entry, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+            if write_if_changed(os.path.join(args.output, *relative.split("/")), data):
+                written += 1
+            packages[package_id] = {
+                "description": entry.get("description"),
+                "latest": next((v.get("versionName") for v in entry.get("versions", []) if v.get("latest")), None),
+                "shard": relative,
+                "hash": hashlib.sha256(data).hexdigest(),
+            }
+
+    root = {
+        "format": source.SHARDED_INDEX_FORMAT,
+        "version": source.SHARDED_INDEX_VERSION,
+        "packages": packages,
+    }
+    write_if_changed(os.path.join(args.output, "index.json"),
+                     json.dumps(root, ensure_ascii=False, indent=1).encode("utf-8"))
+
+    removed = 0
+    if args.prune:
+        keep = {os.path.normpath(os.path.join(args.output, *p["shard"].split("/"))) for p in packages.values()}
+        for folder, _, files in os.walk(os.path.join(args.output, "shards")):
+            for file in files:
+                path = os.path.normpath(os.path.join(folder, file))
+                if path not in keep:
+                    os.remove(path)
+                    removed += 1
+
+    print(f"{len(packages)} paquetes, {written} fragmentos escritos, {removed} borrados")
+
+if __name__ == "__main__":
+    main()
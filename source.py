@@ -1,103 +1,592 @@
 import os
-import hashlib
-import zipfile
 import json
-import tempfile
-import subprocess
-import shutil
-import argparse
-import time
-import requests
-import ctypes
 import sys
+import time
+import threading
+import functools
+from collections.abc import Mapping
 from datetime import datetime
-from tqdm import tqdm
-import random
+
+# Los módulos pesados (requests, tqdm, zipfile, hashlib, subprocess, etc.) se importan
+# dentro de las funciones que los usan para que comandos como "kmd version" arranquen rápido.
 
 # -- Configuración inicial --
-username = os.getlogin() # Obtener el nombre de usuario actual
 MY_GITHUB = "https://github.com/CeccPro" # Mi usuario de GitHub (Si ves esto, sigueme en GitHub! :D)
 
 # -- Configuración de KMD -- 
-GITHUB_INDEX_URL = f"https://ceccpro.github.io/kmd-db/index.json?cb={int(time.time())}" # URL del índice de paquetes en GitHub
-INSTALL_PATH = r'C:\Program Files\KMD\packages' # Ruta de instalación de paquetes
+DEFAULT_INDEX_URL = "https://ceccpro.github.io/kmd-db/index.json" # URL del índice de paquetes en GitHub
 KMD_VERSION = "1.1.5" # Versión de KMD
-LOG_PATH = rf'C:\users\{username}\appdata\local\kmd' # Ruta del log
+
+# Comandos que no tocan la red ni el registro. No deben importar módulos pesados
+# (ver bench.py startup) ni buscar actualizaciones al terminar.
+CHEAP_COMMANDS = ["help", "usage", "version", "-v", "--version", "config", "whoami", "meaning-of-life", "metrics"]
 
 # -- Exclusiones --
 EXCLUDED_PACKAGES = ["CeccPro@KMD-Win64"] # Paquetes que no deben mostrarse en búsquedas ni listados
 EXCLUDED_REGISTER_PACKAGES = ["CeccPro@KMD-Win64"] # Paquetes que no deben registrarse para exitar que pueda desinstalarse de forma insegura
 
-if not os.path.exists(INSTALL_PATH):
-    os.makedirs(INSTALL_PATH)  # Crear la carpeta si no existe
+# -- Plataforma --
+class Platform:
+    """
+    Interfaz con las operaciones que dependen del sistema operativo.
+    Para soportar otro sistema basta con heredar de esta clase y registrarla con set_platform().
+    """
+    name = "generic"
+
+    def default_paths(self) -> dict:
+        """
+        Devuelve las rutas por defecto (installPath, logPath, cachePath) para esta plataforma.
+        """
+        base = os.path.join(os.path.expanduser("~"), ".kmd")
+        return {
+            "installPath": os.path.join(base, "packages"),
+            "logPath": base,
+            "cachePath": os.path.join(base, "cache"),
+        }
+
+    def is_admin(self) -> bool:
+        """
+        Devuelve True si el proceso actual tiene permisos de administrador.
+        """
+        return False
 
-def is_newer_version(latest: str, current: str) -> bool:
-    latest_major, latest_minor, latest_patch = map(int, latest.split('.'))
-    current_major, current_minor, current_patch = map(int, current.split('.'))
-    return (
-        (latest_major > current_major) or
-        (latest_major == current_major and latest_minor > current_minor) or
-        (latest_major == current_major and latest_minor == current_minor and latest_patch > current_patch)
-    )
+    def run_as_admin(self) -> bool:
+        """
+        Intenta relanzar KMD con permisos de administrador.
+        Devuelve False si no es posible (en caso de éxito el proceso actual termina).
+        """
+        print("Se necesitan permisos de administrador. Ejecuta KMD con un usuario con permisos de escritura sobre la ruta de instalación.")
+        return False
 
-def check_for_updates(silent=True):
+    def try_lock_file(self, fd) -> bool:
+        """
+        Intenta bloquear en exclusiva un archivo abierto (sin esperar).
+        Devuelve True si se consiguió el lock.
+        """
+        native = WindowsPlatform if os.name == "nt" else PosixPlatform
+        return native.try_lock_file(self, fd)
+
+    def unlock_file(self, fd):
+        """
+        Libera un lock tomado con try_lock_file.
+        """
+        native = WindowsPlatform if os.name == "nt" else PosixPlatform
+        native.unlock_file(self, fd)
+
+    def ipc_transport(self, cache_path):
+        """
+        Devuelve el transporte IPC que usan la CLI y el daemon (ver IPCTransport).
+        """
+        return LoopbackTransport(cache_path)
+
+    def script_command(self, script_path) -> list:
+        """
+        Devuelve el comando con el que se ejecuta un script de un paquete.
+        """
+        native = WindowsPlatform if os.name == "nt" else PosixPlatform
+        return native.script_command(self, script_path)
+
+    def script_popen_kwargs(self) -> dict:
+        """
+        Devuelve los argumentos extra de subprocess.Popen para que el script y sus hijos
+        queden en un grupo de procesos propio (para poder matarlos juntos, ver kill_process_tree).
+        """
+        native = WindowsPlatform if os.name == "nt" else PosixPlatform
+        return native.script_popen_kwargs(self)
+
+    def background_popen_kwargs(self) -> dict:
+        """
+        Devuelve los argumentos extra de subprocess.Popen para lanzar un proceso de KMD en segundo plano:
+        separado de la terminal y con prioridad baja.
+        """
+        native = WindowsPlatform if os.name == "nt" else PosixPlatform
+        return native.background_popen_kwargs(self)
+
+    def kill_process_tree(self, process):
+        """
+        Mata un proceso lanzado con script_popen_kwargs() junto con todos sus hijos.
+        """
+        native = WindowsPlatform if os.name == "nt" else PosixPlatform
+        native.kill_process_tree(self, process)
+
+    def set_active_link(self, link_path, target) -> bool:
+        """
+        Hace que link_path sea un enlace a la carpeta target (un nombre relativo dentro de la misma carpeta),
+        reemplazando el enlace anterior. Devuelve False si no se pudo crear el enlace.
+        """
+        native = WindowsPlatform if os.name == "nt" else PosixPlatform
+        return native.set_active_link(self, link_path, target)
+
+    def remove_file(self, path):
+        """
+        Borra un archivo aunque sea de solo lectura (como los objetos del almacén, ver _seal_store_object).
+        """
+        native = WindowsPlatform if os.name == "nt" else PosixPlatform
+        native.remove_file(self, path)
+
+class WindowsPlatform(Platform):
+    name = "windows"
+
+    def try_lock_file(self, fd) -> bool:
+        import msvcrt
+        os.lseek(fd, 0, os.SEEK_SET)
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def unlock_file(self, fd):
+        import msvcrt
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+    def script_command(self, script_path) -> list:
+        extension = os.path.splitext(script_path)[1].lower()
+        if extension == ".py":
+            return [sys.executable, script_path]
+        if extension == ".ps1":
+            return ["powershell.exe", "-NoProfile", "-ExecutionPolicy", "Bypass", "-File", script_path]
+        return ["cmd.exe", "/c", script_path]
+
+    def script_popen_kwargs(self) -> dict:
+        import subprocess
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+
+    def background_popen_kwargs(self) -> dict:
+        import subprocess
+        return {"creationflags": subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.BELOW_NORMAL_PRIORITY_CLASS}
+
+    def kill_process_tree(self, process):
+        import subprocess
+        result = subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], capture_output=True)
+        if result.returncode != 0:
+            process.kill()
+
+    def set_active_link(self, link_path, target) -> bool:
+        import subprocess
+        if os.path.lexists(link_path):
+            try:
+                os.rmdir(link_path) # Quita el enlace o la unión, no el contenido
+            except OSError:
+                return False
+        try:
+            os.symlink(target, link_path, target_is_directory=True)
+            return True
+        except OSError:
+            pass
+        # Sin modo desarrollador no se pueden crear symlinks, pero sí uniones (junctions)
+        absolute = os.path.join(os.path.dirname(link_path), target)
+        result = subprocess.run(["cmd.exe", "/c", "mklink", "/J", link_path, absolute], capture_output=True)
+        return result.returncode == 0
+
+    def remove_file(self, path):
+        import stat
+        try:
+            os.remove(path)
+        except PermissionError:
+            # Windows no borra archivos de solo lectura. El atributo es del archivo, así que sus otros
+            # enlaces también dejan de ser de solo lectura (store_member lo vuelve a poner al enlazarlo)
+            os.chmod(path, stat.S_IWRITE)
+            os.remove(path)
+
+    def default_paths(self) -> dict:
+        local_appdata = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), "AppData", "Local")
+        return {
+            "installPath": r'C:\Program Files\KMD\packages',
+            "logPath": os.path.join(local_appdata, "kmd"),
+            "cachePath": os.path.join(local_appdata, "kmd", "cache"),
+        }
+
+    def is_admin(self) -> bool:
+        import ctypes
+        try:
+            return ctypes.windll.shell32.IsUserAnAdmin() == 1
+        except Exception:
+            return False
+
+    def run_as_admin(self) -> bool:
+        """
+        Intenta relanzar el script actual con permisos de administrador.
+        (No toques esto a menos que sepas lo que haces. Estuve horas intentando que funcionara)
+        """
+        import ctypes
+        # Vuelve a ejecutar el script como admin
+        print("Se necesitan permisos de administrador. Relanzando KMD...")
+        args = sys.argv[1:]
+        if len(args) > 0 and os.path.basename(sys.argv[0]).split('.')[0].lower() == args[0].lower():
+            args = args[1:]
+        script = os.path.abspath(sys.argv[0])
+        params = " ".join([f'"{arg}"' for arg in args])
+        try:
+            ctypes.windll.shell32.ShellExecuteW(
+                None, "runas", "cmd.exe", f'/k ""{script}" {params}" & pause & exit', None, 1
+            )
+            sys.exit(0)
+        except Exception as e:
+            writeLog("ERROR", f"No se pudo ejecutar como admin: {e}")
+            print(f"No se pudo ejecutar como admin: {e}")
+            return False
+
+class PosixPlatform(Platform):
+    name = "posix"
+
+    def try_lock_file(self, fd) -> bool:
+        import fcntl
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def unlock_file(self, fd):
+        import fcntl
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def script_command(self, script_path) -> list:
+        if script_path.lower().endswith(".py"):
+            return [sys.executable, script_path]
+        if os.access(script_path, os.X_OK):
+            return [script_path]
+        return ["/bin/sh", script_path]
+
+    def script_popen_kwargs(self) -> dict:
+        return {"start_new_session": True}
+
+    def background_popen_kwargs(self) -> dict:
+        return {"start_new_session": True, "preexec_fn": lambda: os.nice(10)}
+
+    def kill_process_tree(self, process):
+        import signal
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            process.kill()
+
+    def set_active_link(self, link_path, target) -> bool:
+        tmp_path = f"{link_path}.{os.getpid()}.tmp"
+        try:
+            if os.path.lexists(tmp_path):
+                os.remove(tmp_path)
+            os.symlink(target, tmp_path, target_is_directory=True)
+            os.replace(tmp_path, link_path) # Cambio atómico del enlace
+            return True
+        except OSError:
+            return False
+
+    def remove_file(self, path):
+        os.remove(path) # Borrar solo depende de los permisos de la carpeta
+
+    def default_paths(self) -> dict:
+        home = os.path.expanduser("~")
+        data_home = os.environ.get("XDG_DATA_HOME") or os.path.join(home, ".local", "share")
+        state_home = os.environ.get("XDG_STATE_HOME") or os.path.join(home, ".local", "state")
+        cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(home, ".cache")
+        return {
+            "installPath": os.path.join(data_home, "kmd", "packages"),
+            "logPath": os.path.join(state_home, "kmd"),
+            "cachePath": os.path.join(cache_home, "kmd"),
+        }
+
+    def is_admin(self) -> bool:
+        return hasattr(os, "geteuid") and os.geteuid() == 0
+
+    def ipc_transport(self, cache_path):
+        import socket
+        # La ruta de un socket Unix tiene un límite de ~100 caracteres
+        if hasattr(socket, "AF_UNIX") and len(os.path.join(cache_path, "kmd.sock")) < 100:
+            return UnixSocketTransport(cache_path)
+        return LoopbackTransport(cache_path)
+
+PLATFORMS = {
+    "windows": WindowsPlatform,
+    "posix": PosixPlatform,
+    "generic": Platform,
+}
+
+def detect_platform() -> Platform:
     """
-    Busca si hay una versión más reciente de KMD en el índice.
-    Si silent=False, muestra mensajes al usuario.
-    Devuelve: (hay_update: bool, latest_version: str, download_url: str)
+    Devuelve la implementación de Platform adecuada para el sistema actual.
+    """
+    return WindowsPlatform() if os.name == "nt" else PosixPlatform()
+
+PLATFORM = detect_platform() # Plataforma activa
+
+def set_platform(platform):
+    """
+    Cambia la plataforma activa.
+    platform: Una instancia de Platform o el nombre de una plataforma registrada en PLATFORMS.
+    """
+    global PLATFORM
+    if isinstance(platform, str):
+        if platform not in PLATFORMS:
+            raise Exception(f"Plataforma desconocida: {platform} (disponibles: {', '.join(PLATFORMS)})")
+        platform = PLATFORMS[platform]()
+    PLATFORM = platform
+
+# -- Rutas --
+_defaults = PLATFORM.default_paths()
+INSTALL_PATH = _defaults["installPath"] # Ruta de instalación de paquetes
+LOG_PATH = _defaults["logPath"] # Ruta del log
+CACHE_PATH = _defaults["cachePath"] # Ruta de la caché
+INDEX_URL = DEFAULT_INDEX_URL # URL del índice configurada
+GITHUB_INDEX_URL = f"{INDEX_URL}?cb={int(time.time())}" # URL del índice que se usa al descargar (con cache-buster)
+DEFAULT_LOCK_TIMEOUT = 600 # Segundos máximos de espera por el lock de un paquete
+LOCK_TIMEOUT = DEFAULT_LOCK_TIMEOUT
+DEFAULT_SCRIPT_TIMEOUT = 300 # Segundos máximos que puede tardar un script de un paquete
+SCRIPT_TIMEOUT = DEFAULT_SCRIPT_TIMEOUT
+SCRIPT_ERROR_POLICIES = ["continue", "abort"] # Qué hacer si un script falla: seguir (y registrarlo) o abortar
+SCRIPT_ERRORS = "continue"
+DEFAULT_JOBS = 4 # Instalaciones/actualizaciones simultáneas de paquetes independientes
+JOBS = DEFAULT_JOBS
+DEFAULT_UPDATE_CHECK_INTERVAL = 24 * 60 * 60 # Cada cuántos segundos se busca en segundo plano una versión nueva de KMD
+UPDATE_CHECK_INTERVAL = DEFAULT_UPDATE_CHECK_INTERVAL
+LOCAL_DIGESTS = ["none", "blake2b", "xxh3"] # Huella rápida extra que se guarda de cada archivo para `kmd verify`
+LOCAL_DIGEST = "none"
+METRICS_PATH = None # Archivo .prom donde se escriben las métricas para el textfile collector de node_exporter (None = no se escribe)
+MAX_BANDWIDTH = 0 # Bytes por segundo entre todas las descargas de paquetes (0 = sin límite)
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 4 # Descargas de paquetes simultáneas contra un mismo servidor
+MAX_CONNECTIONS_PER_HOST = DEFAULT_MAX_CONNECTIONS_PER_HOST
+DEFAULT_SOURCE_PRIORITY = 10 # Prioridad de las fuentes de indexSources que no indican una (indexURL tiene 0)
+INDEX_SOURCES = [{"name": "default", "url": INDEX_URL, "priority": 0}] # Fuentes del índice, de mayor a menor prioridad
+CONFIG_FILE = None # Archivo de configuración con el que se configuró KMD (ver configure)
+
+# Variables de entorno y claves del archivo de configuración que se aceptan
+CONFIG_KEYS = {
+    "installPath": "KMD_INSTALL_PATH",
+    "logPath": "KMD_LOG_PATH",
+    "cachePath": "KMD_CACHE_PATH",
+    "indexURL": "KMD_INDEX_URL",
+    "platform": "KMD_PLATFORM",
+    "lockTimeout": "KMD_LOCK_TIMEOUT",
+    "scriptTimeout": "KMD_SCRIPT_TIMEOUT",
+    "scriptErrors": "KMD_SCRIPT_ERRORS",
+    "jobs": "KMD_JOBS",
+    "indexSources": "KMD_INDEX_SOURCES",
+    "maxBandwidth": "KMD_MAX_BANDWIDTH",
+    "maxConnectionsPerHost": "KMD_MAX_CONNECTIONS_PER_HOST",
+    "updateCheckInterval": "KMD_UPDATE_CHECK_INTERVAL",
+    "localDigest": "KMD_LOCAL_DIGEST",
+    "metricsPath": "KMD_METRICS_PATH",
+}
+
+def get_config_file():
     """
+    Devuelve la ruta del archivo de configuración.
+    Se puede cambiar con la variable de entorno KMD_CONFIG.
+    """
+    if os.environ.get("KMD_CONFIG"):
+        return os.environ["KMD_CONFIG"]
+    if os.name == "nt":
+        base = os.environ.get("APPDATA") or os.path.join(os.path.expanduser("~"), "AppData", "Roaming")
+    else:
+        base = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(base, "kmd", "config.json")
+
+def load_config(overrides=None, config_file=None):
+    """
+    Resuelve la configuración de KMD.
+    Prioridad (de mayor a menor): overrides (flags de la CLI), variables de entorno,
+    archivo de configuración y valores por defecto de la plataforma.
+    overrides: Diccionario con claves de CONFIG_KEYS. Los valores None se ignoran.
+    config_file: Ruta al archivo de configuración. Si es None, se usa get_config_file().
+    Devuelve un diccionario con la configuración final.
+    """
+    overrides = overrides or {}
+    file_config = {}
+    config_file = config_file or get_config_file()
+    if os.path.exists(config_file):
+        try:
+            with open(config_file, 'r', encoding='utf-8') as f:
+                file_config = json.load(f)
+        except json.JSONDecodeError:
+            raise Exception(f"El archivo de configuración {config_file} está corrupto o malformado")
+
+    platform_name = overrides.get("platform") or os.environ.get("KMD_PLATFORM") or file_config.get("platform")
+    platform = PLATFORMS[platform_name]() if platform_name in PLATFORMS else PLATFORM
+    if platform_name and platform_name not in PLATFORMS:
+        raise Exception(f"Plataforma desconocida: {platform_name} (disponibles: {', '.join(PLATFORMS)})")
+
+    config = dict(platform.default_paths())
+    config["indexURL"] = DEFAULT_INDEX_URL
+    config["platform"] = platform.name
+    config["lockTimeout"] = DEFAULT_LOCK_TIMEOUT
+    config["scriptTimeout"] = DEFAULT_SCRIPT_TIMEOUT
+    config["scriptErrors"] = "continue"
+    config["jobs"] = DEFAULT_JOBS
+    config["maxBandwidth"] = 0
+    config["maxConnectionsPerHost"] = DEFAULT_MAX_CONNECTIONS_PER_HOST
+    config["updateCheckInterval"] = DEFAULT_UPDATE_CHECK_INTERVAL
+    config["localDigest"] = "none"
+    config["metricsPath"] = ""
+    for key, env_var in CONFIG_KEYS.items():
+        if file_config.get(key) is not None:
+            config[key] = file_config[key]
+        if os.environ.get(env_var):
+            config[key] = os.environ[env_var]
+        if overrides.get(key) is not None:
+            config[key] = overrides[key]
+    return config
+
+def apply_config(config):
+    """
+    Aplica una configuración (ver load_config) a las variables globales de KMD.
+    No crea ninguna carpeta: las rutas se crean cuando se necesitan.
+    """
+    global INSTALL_PATH, LOG_PATH, CACHE_PATH, INDEX_URL, GITHUB_INDEX_URL, LOCK_TIMEOUT
+    global SCRIPT_TIMEOUT, SCRIPT_ERRORS, JOBS, INDEX_SOURCES, MAX_BANDWIDTH, MAX_CONNECTIONS_PER_HOST, UPDATE_CHECK_INTERVAL
+    global LOCAL_DIGEST, METRICS_PATH
+    set_platform(config.get("platform", PLATFORM.name))
+    INSTALL_PATH = os.path.abspath(os.path.expanduser(config["installPath"]))
+    LOG_PATH = os.path.abspath(os.path.expanduser(config["logPath"]))
+    CACHE_PATH = os.path.abspath(os.path.expanduser(config["cachePath"]))
+    INDEX_URL = normalize_index_url(config["indexURL"])
+    INDEX_SOURCES = parse_index_sources(config.get("indexSources"), INDEX_URL)
+    try:
+        LOCK_TIMEOUT = float(config.get("lockTimeout", DEFAULT_LOCK_TIMEOUT))
+    except (TypeError, ValueError):
+        raise Exception(f"lockTimeout debe ser un número de segundos (recibido: {config.get('lockTimeout')!r})")
+    try:
+        SCRIPT_TIMEOUT = float(config.get("scriptTimeout", DEFAULT_SCRIPT_TIMEOUT))
+    except (TypeError, ValueError):
+        raise Exception(f"scriptTimeout debe ser un número de segundos (recibido: {config.get('scriptTimeout')!r})")
+    SCRIPT_ERRORS = config.get("scriptErrors", "continue")
+    if SCRIPT_ERRORS not in SCRIPT_ERROR_POLICIES:
+        raise Exception(f"scriptErrors debe ser {' o '.join(SCRIPT_ERROR_POLICIES)} (recibido: {SCRIPT_ERRORS!r})")
+    try:
+        JOBS = max(1, int(config.get("jobs", DEFAULT_JOBS)))
+    except (TypeError, ValueError):
+        raise Exception(f"jobs debe ser un número entero (recibido: {config.get('jobs')!r})")
     try:
-        index = get_index()
-        # Buscar el paquete especial de KMD
-        kmd_pkg = next((p for p in index 
-                       if f"{p['author']}@{p['name']}" in EXCLUDED_PACKAGES 
-                       and p['name'].lower() == 'kmd-win64'), None)
-        
-        if not kmd_pkg:
-            writeLog("WARNING", "No se encontró la información de actualización de KMD en el índice.")
-            if not silent:
-                print("No se encontró la información de actualización de KMD en el índice.")
-            return False, None, None
+        MAX_BANDWIDTH = parse_size(config.get("maxBandwidth", 0))
+    except ValueError:
+        raise Exception(f"maxBandwidth debe ser un número de bytes por segundo, p. ej. 500K o 2M (recibido: {config.get('maxBandwidth')!r})")
+    try:
+        MAX_CONNECTIONS_PER_HOST = max(1, int(config.get("maxConnectionsPerHost", DEFAULT_MAX_CONNECTIONS_PER_HOST)))
+    except (TypeError, ValueError):
+        raise Exception(f"maxConnectionsPerHost debe ser un número entero (recibido: {config.get('maxConnectionsPerHost')!r})")
+    try:
+        UPDATE_CHECK_INTERVAL = max(0.0, float(config.get("updateCheckInterval", DEFAULT_UPDATE_CHECK_INTERVAL)))
+    except (TypeError, ValueError):
+        raise Exception(f"updateCheckInterval debe ser un número de segundos (recibido: {config.get('updateCheckInterval')!r})")
+    LOCAL_DIGEST = config.get("localDigest", "none")
+    if LOCAL_DIGEST not in LOCAL_DIGESTS:
+        raise Exception(f"localDigest debe ser {', '.join(LOCAL_DIGESTS)} (recibido: {LOCAL_DIGEST!r})")
+    if LOCAL_DIGEST == "xxh3":
+        import importlib.util
+        if importlib.util.find_spec("xxhash") is None:
+            raise Exception("localDigest xxh3 necesita el paquete xxhash (pip install xxhash)")
+    METRICS_PATH = os.path.abspath(os.path.expanduser(config["metricsPath"])) if config.get("metricsPath") else None
+    GITHUB_INDEX_URL = _cache_busted(INDEX_URL)
+
+def parse_size(value):
+    """
+    Convierte un tamaño como 500K, 2M o 1.5G (múltiplos de 1024, con "B" y "/s" opcionales) en bytes.
+    Lanza ValueError si no es válido.
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip().upper().removesuffix("/S").removesuffix("B")
+    factor = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}.get(text[-1:], 1)
+    number = float(text[:-1] if factor > 1 else text)
+    if number < 0:
+        raise ValueError(value)
+    return int(number * factor)
+
+def normalize_index_url(url):
+    """
+    Devuelve la URL de un índice. Las rutas locales (p. ej. un mirror creado con "kmd mirror")
+    se convierten en URLs file://, y una carpeta apunta a su index.json.
+    """
+    if "://" in url:
+        return url
+    import pathlib
+    index_path = os.path.abspath(os.path.expanduser(url))
+    if os.path.isdir(index_path):
+        index_path = os.path.join(index_path, "index.json")
+    return pathlib.Path(index_path).as_uri()
+
+def parse_index_sources(value, index_url):
+    """
+    Normaliza la lista de fuentes del índice.
+    value: Lista (del archivo de configuración) de URLs o de objetos {"url", "name", "priority"},
+           o un texto (variable de entorno o flag de la CLI) con URLs separadas por comas o con esa
+           misma lista en JSON (así se pasan las fuentes a los procesos que lanza KMD).
+    index_url: La fuente principal (indexURL). Se añade con prioridad 0 si no está en la lista.
+    Devuelve la lista de fuentes ({"name", "url", "priority"}) de mayor a menor prioridad;
+    a igual prioridad, en el orden en que se dieron.
+    """
+    if isinstance(value, str) and value.lstrip().startswith("["):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            raise Exception(f"Lista de fuentes del índice inválida: {value!r}")
+    elif isinstance(value, str):
+        value = [url.strip() for url in value.split(",") if url.strip()]
+    sources = []
+    for item in value or []:
+        if isinstance(item, str):
+            item = {"url": item}
+        if not isinstance(item, dict) or not item.get("url"):
+            raise Exception(f"Fuente del índice inválida: {item!r} (se esperaba una URL o un objeto con 'url')")
+        try:
+            priority = int(item.get("priority", DEFAULT_SOURCE_PRIORITY))
+        except (TypeError, ValueError):
+            raise Exception(f"La prioridad de la fuente {item['url']} debe ser un número entero (recibido: {item.get('priority')!r})")
+        url = normalize_index_url(item["url"])
+        sources.append({"name": item.get("name") or url, "url": url, "priority": priority})
+    if all(source["url"] != index_url for source in sources):
+        sources.append({"name": "default", "url": index_url, "priority": 0})
+    sources.sort(key=lambda source: -source["priority"])
+    return sources
+
+def configure(overrides=None, config_file=None):
+    """
+    Carga y aplica la configuración de KMD en un solo paso.
+    Devuelve el diccionario de configuración aplicado.
+    """
+    global CONFIG_FILE
+    config = load_config(overrides, config_file)
+    apply_config(config)
+    CONFIG_FILE = os.path.abspath(config_file or get_config_file())
+    return config
+
+@functools.lru_cache(maxsize=65536)
+def version_key(version):
+    """
+    Devuelve una clave para ordenar versiones al estilo de SemVer, sin lanzar errores con versiones raras:
+    - Cualquier número de segmentos ("1.2" == "1.2.0" < "1.2.0.1"), con o sin "v" delante.
+    - Las pre-releases van antes que la versión final ("1.0.0-beta.2" < "1.0.0-beta.10" < "1.0.0").
+    - Los metadatos de build ("+...") se ignoran.
+    Los segmentos no numéricos se comparan como texto, después de los numéricos.
+    Las claves se guardan en caché: cada versión se parsea una sola vez.
+    """
+    def segment(part):
+        return (0, int(part), "") if part.isdigit() else (1, 0, part)
+
+    version = (version or "").strip().lower()
+    if version.startswith("v"):
+        version = version[1:]
+    version = version.split("+", 1)[0]
+    release, _, prerelease = version.partition("-")
+    release = [segment(part) for part in release.split(".")]
+    while release and release[-1] == (0, 0, ""):
+        release.pop()
+    if prerelease:
+        return (tuple(release), 0, tuple(segment(part) for part in prerelease.split(".")))
+    return (tuple(release), 1, ())
 
-        # Buscar la versión latest
-        latest_version = next((v for v in kmd_pkg['versions'] if v.get('latest', False)), None)
-        if not latest_version:
-            writeLog("WARNING", "No se encontró versión marcada como 'latest' para KMD.")
-            if not silent:
-                print("No se encontró versión marcada como 'latest' para KMD.")
-            return False, None, None
-
-        latest_version_name = latest_version.get('versionName')
-        download_url = latest_version.get('downloadURL')
-
-        if not latest_version_name or not download_url:
-            writeLog("ERROR", "Información de versión incompleta en el índice.")
-            if not silent:
-                print("Información de versión incompleta en el índice.")
-            return False, None, None
-        
-        writeLog("INFO", f"Última versión de KMD encontrada en el index: {latest_version_name}")
-
-        # Comparar versiones
-        if is_newer_version(latest_version_name, KMD_VERSION) and KMD_VERSION != latest_version_name:
-            writeLog("INFO", f"Nueva versión de KMD disponible: {latest_version_name} (actual: {KMD_VERSION})")
-            if not silent:
-                print(f"¡Nueva versión de KMD disponible ({latest_version_name})! (actual: {KMD_VERSION})")
-            return True, latest_version_name, download_url
-        else:
-            writeLog("OK", "KMD está actualizado a la última versión.")
-            return False, latest_version_name, download_url
+def is_newer_version(latest: str, current: str) -> bool:
+    """
+    Devuelve True si la versión latest es posterior a current (ver version_key).
+    """
+    return version_key(latest) > version_key(current)
 
-    except Exception as e:
-        writeLog("ERROR", f"Error al buscar actualizaciones: {e}")
-        if not silent:
-            print(f"Error al buscar actualizaciones: {e}")
-        return False, None, None
-    
 def get_existential_message():
     """
     Retorna un mensaje existencial aleatorio como easter egg
     """
+    import random
     messages = [
         "¿Si instalas un paquete y nadie lo usa, realmente está instalado? 🤔",
         "En el gran esquema del universo, ¿qué son realmente las dependencias?",
@@ -120,9 +609,10 @@ def get_existential_message():
 
 def compressLog():
     """
-    Comprime el archivo de log en un archivo ZIP con un timestamp.
+    Comprime el archivo de log en un archivo ZIP con un timestamp y lo vacía.
     El archivo ZIP se guarda en la misma carpeta que el log.
     """
+    import zipfile
     writeLog("INFO", "Comprimiendo log...")
     logFile = os.path.join(LOG_PATH, "debug.log")
     if not os.path.exists(logFile):
@@ -132,33 +622,33 @@ def compressLog():
     timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
 
     # Nombre del zip
-    zipName = fr"{LOG_PATH}\log-{timestamp}.zip"
+    zipName = os.path.join(LOG_PATH, f"log-{timestamp}.zip")
 
     # Crear archivo zip y agregar el logFile dentro
     with zipfile.ZipFile(zipName, 'w', zipfile.ZIP_DEFLATED) as zipf:
         zipf.write(logFile, arcname=os.path.basename(logFile))
 
+    # Vaciar el log para que no se vuelva a comprimir en la siguiente ejecución
+    open(logFile, 'w').close()
+    writeLog("INFO", f"Log comprimido en {zipName}")
+
 def check_log_size():
     """
     Verifica el tamaño del archivo de log y lo comprime si excede un tamaño máximo.
     Si el log no existe, no hace nada. El tamaño máximo es de 20 MB.
+    Solo hace un stat del archivo; únicamente escribe en el log si hay que comprimirlo.
     """
     logFile = os.path.join(LOG_PATH, "debug.log")
-    writeLog("INFO", "Verificando el tamaño del log...")
     maxLogSize = 20
-    if os.path.exists(logFile):
-        size_mb = int((os.path.getsize(logFile) / (1024*1024)) * 100) / 100  # Tamaño en MB
-        size_kb = int((os.path.getsize(logFile) / (1024)) * 100) / 100  # Tamaño en KB
-        
-        if not size_mb == 0:
-            writeLog("INFO", f"Tamaño del log: {size_mb} MB")
-        else:
-            writeLog("INFO", f"Tamaño del log: {size_kb} KB")
-        if size_mb >= maxLogSize:
-            writeLog("WARNING", f"El tamaño del log excede los {maxLogSize} MB")
-            compressLog()
-        else:
-            writeLog("OK", "El log tiene un tamaño dentro de los límites")
+    try:
+        size = os.stat(logFile).st_size
+    except OSError:
+        return
+    if size >= maxLogSize * 1024 * 1024:
+        writeLog("WARNING", f"El tamaño del log excede los {maxLogSize} MB ({int(size / (1024*1024) * 100) / 100} MB)")
+        compressLog()
+
+_log_dir_ready = None # Carpeta de log que ya se creó en esta ejecución
 
 def writeLog(status, text, newInstance=False):
     """
@@ -167,863 +657,4820 @@ def writeLog(status, text, newInstance=False):
     text: El mensaje a registrar
     newInstance: Si es True, indica que es una nueva instancia de KMD
     """
+    global _log_dir_ready
     log_path = os.path.join(LOG_PATH, "debug.log")
 
-    # Crear carpeta si no existe
-    os.makedirs(LOG_PATH, exist_ok=True)
+    # Crear carpeta si no existe (solo la primera vez)
+    if _log_dir_ready != LOG_PATH:
+        os.makedirs(LOG_PATH, exist_ok=True)
+        _log_dir_ready = LOG_PATH
 
     timestamp = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-    if not newInstance:
-        log_entry = f"[{timestamp}]: [{status}] {text}\n"
-    else:
-        if os.path.exists(log_path):
+    with open(log_path, "a", encoding="utf-8") as f:
+        if not newInstance:
+            log_entry = f"[{timestamp}]: [{status}] {text}\n"
+        elif f.tell() > 0:
             log_entry = f"\n---- Nueva instancia iniciada -----\n[{timestamp}]: [{status}] {text}\n"
         else:
             log_entry = f"---- Nueva instancia iniciada -----\n[{timestamp}]: [{status}] {text}\n"
-
-    with open(log_path, "a", encoding="utf-8") as f:
         f.write(log_entry)
 
 def run_as_admin():
     """
     Intenta relanzar el script actual con permisos de administrador.
-    (No toques esto a menos que sepas lo que haces. Estuve horas intentando que funcionara)
+    Delega en la plataforma activa (ver Platform.run_as_admin).
     """
-    # Vuelve a ejecutar el script como admin
-    print("Se necesitan permisos de administrador. Relanzando KMD...")
-    args = sys.argv[1:]
-    if len(args) > 0 and os.path.basename(sys.argv[0]).split('.')[0].lower() == args[0].lower():
-        args = args[1:]
-    script = os.path.abspath(sys.argv[0])
-    params = " ".join([f'"{arg}"' for arg in args])
-    try:
-        ctypes.windll.shell32.ShellExecuteW(
-            None, "runas", "cmd.exe", f'/k ""{script}" {params}" & pause & exit', None, 1
-        )
-        sys.exit(0)
-    except Exception as e:
-        writeLog("ERROR", f"No se pudo ejecutar como admin: {e}")
-        print(f"No se pudo ejecutar como admin: {e}")
-        return False
-
-def get_index():
+    return PLATFORM.run_as_admin()
+
+# -- Métricas --
+# Cada proceso cuenta en METRICS lo que hace (descargas, cachés, operaciones, scripts...). Al terminar
+# cada comando, flush_metrics() lo suma a los totales acumulados en CACHE_PATH/metrics.json y, si se
+# configuró metricsPath, los escribe en formato de texto de Prometheus para el textfile collector de
+# node_exporter. `kmd metrics` muestra los totales.
+METRIC_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300) # Límites (en segundos) de los histogramas
+METRIC_DEFINITIONS = {
+    "kmd_commands_total": ("counter", "Comandos de KMD ejecutados, por comando y resultado"),
+    "kmd_command_duration_seconds": ("histogram", "Duración de los comandos de KMD"),
+    "kmd_index_fetch_duration_seconds": ("histogram", "Tiempo de descarga o revalidación de cada fuente del índice, por resultado"),
+    "kmd_cache_requests_total": ("counter", "Consultas a las cachés (index, shard, archive, store), por resultado (hit o miss)"),
+    "kmd_download_bytes_total": ("counter", "Bytes de paquetes descargados, por servidor"),
+    "kmd_download_duration_seconds": ("histogram", "Duración de las descargas de paquetes, por servidor"),
+    "kmd_operation_duration_seconds": ("histogram", "Duración de install, update, uninstall y repair, dependencias y scripts incluidos"),
+    "kmd_operations_total": ("counter", "Operaciones sobre paquetes, por operación y resultado"),
+    "kmd_package_failures_total": ("counter", "Operaciones fallidas, por paquete y operación"),
+    "kmd_script_duration_seconds": ("histogram", "Duración de los scripts de los paquetes, por script y resultado"),
+    "kmd_last_run_timestamp_seconds": ("gauge", "Momento (Unix) en que se guardaron las métricas por última vez"),
+}
+
+def _metric_labels(labels):
     """
-    Obtiene el índice de paquetes desde GitHub.
-    Devuelve un objeto JSON con la lista de paquetes.
-    Si no se puede obtener, lanza una excepción.
+    Convierte un diccionario de etiquetas en el texto que va entre llaves en el formato de Prometheus.
     """
-    r = requests.get(GITHUB_INDEX_URL, timeout=30)
-    if r.status_code != 200:
-        writeLog("ERROR", "No se pudo obtener el índice de paquetes")
-        raise Exception("No se pudo obtener el índice de paquetes")
-    return r.json()
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{key}="{escape(value)}"' for key, value in sorted(labels.items()))
 
-def download_package(package_id, version=None):
+class Metrics:
     """
-    Descarga un paquete dado su ID (formato: Author@PackageName)
-    y opcionalmente una versión específica.
-    Muestra el progreso de descarga.
+    Contadores e histogramas de lo que hace este proceso (ver METRIC_DEFINITIONS), seguros entre hilos.
+    Se guardan por nombre y etiquetas; los histogramas como [cuenta de cada bucket..., suma, cuenta].
     """
-    parts = package_id.split('@')
-    if len(parts) != 2:
-        writeLog("ERROR", f"ID de paquete inválido: {package_id} (se esperaba 'Autor@Paquete')")
-        raise Exception(f"ID de paquete inválido: {package_id} (se esperaba 'Autor@Paquete')")
-    author, name = parts
-
-    index = get_index()
-
-    # Buscar el paquete con ese autor y nombre
-    entry = next((p for p in index if p['author'] == author and p['name'] == name), None)
-    if not entry:
-        writeLog("ERROR", f"Paquete {package_id} no encontrado en el índice")
-        raise Exception(f"Paquete {package_id} no encontrado en el índice")
-
-    # Buscar la versión correcta
-    version_entry = None
-    if version:
-        version_entry = next((v for v in entry['versions'] if v['versionName'] == version), None)
-        if not version_entry:
-            writeLog("ERROR", "Versión '{version}' de {package_id} no encontrada")
-            raise Exception(f"Versión '{version}' de {package_id} no encontrada")
-    else:
-        version_entry = next((v for v in entry['versions'] if v.get('latest')), None)
-        if not version_entry:
-            writeLog("ERROR", f"No se encontró una versión marcada como 'latest' para {package_id}")
-            raise Exception(f"No se encontró una versión marcada como 'latest' para {package_id}")
-
-    url = version_entry['downloadURL']
-    writeLog("INFO", f"Descargando {package_id} ({version_entry['versionName']}) desde: {url}")
-    print(f"Descargando {package_id} ({version_entry['versionName']}) desde:\n{url}")
-
-    response = requests.get(url, stream=True)
-    if response.status_code != 200:
-        writeLog("ERROR", "Error al descargar el paquete")
-        raise Exception("Error al descargar el paquete")
-
-    total_size = int(response.headers.get('content-length', 0))
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
-
-    # Descargando con barra de progreso
-    with tqdm(
-        total=total_size, unit='B', unit_scale=True,
-        desc=f"{name}-{version_entry['versionName']}",
-        ncols=70
-    ) as barra:
-        for chunk in response.iter_content(chunk_size=1024):
-            if chunk:
-                temp_file.write(chunk)
-                barra.update(len(chunk))
-
-    temp_file.close()
-    return temp_file.name, entry
-
-def search_packages(query):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, name, value=1, **labels):
+        key = _metric_labels(labels)
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _metric_labels(labels)
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            data = series.get(key)
+            if data is None:
+                data = series[key] = [0] * (len(METRIC_BUCKETS) + 2)
+            for i, bound in enumerate(METRIC_BUCKETS):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def take(self):
+        """
+        Devuelve lo acumulado hasta ahora y vacía los contadores.
+        """
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+METRICS = Metrics()
+
+def get_metrics_state_path():
+    return os.path.join(CACHE_PATH, "metrics.json")
+
+def read_metrics():
     """
-    Busca paquetes en el índice por nombre o autor.
-    Muestra los resultados encontrados.
-    Devuelve una lista de paquetes que coinciden con la búsqueda.
+    Devuelve los totales acumulados en disco ({nombre: {etiquetas: valor}}), o {} si todavía no hay.
     """
-    index = get_index()
-    query_lower = query.lower()
-    matches = [
-        p for p in index
-        if (query_lower in p['name'].lower() or 
-            query_lower in f"{p['author']}@{p['name']}".lower())
-        and f"{p['author']}@{p['name']}" not in EXCLUDED_PACKAGES
-    ]
-    if not matches:
-        print(f"No se encontraron paquetes que coincidan con '{query}'")
-        return []
+    try:
+        with open(get_metrics_state_path(), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return state if isinstance(state, dict) else {}
 
-    print(f"Coincidencias encontradas para '{query}':\n")
-    for p in matches:
-        desc = p.get('description', 'Sin descripción')
-        pkg_id = f"{p['author']}@{p['name']}"
-        print(f"{pkg_id}: {desc}")
+def flush_metrics():
+    """
+    Suma las métricas de este proceso a los totales de CACHE_PATH/metrics.json y, si METRICS_PATH
+    está configurado, escribe los totales en él (de forma atómica, así node_exporter nunca lee un
+    archivo a medias). Si no se pueden guardar solo se avisa en el log.
+    """
+    values = METRICS.take()
+    if not values:
+        return
+    try:
+        with metrics_lock():
+            state = read_metrics()
+            for name, series in values.items():
+                saved = state.setdefault(name, {})
+                for key, value in series.items():
+                    old = saved.get(key)
+                    if isinstance(value, list):
+                        saved[key] = [a + b for a, b in zip(old, value)] if isinstance(old, list) and len(old) == len(value) else value
+                    else:
+                        saved[key] = (old if isinstance(old, (int, float)) else 0) + value
+            state["kmd_last_run_timestamp_seconds"] = {"": time.time()}
+            write_file_atomic(get_metrics_state_path(), json.dumps(state))
+            if METRICS_PATH:
+                write_file_atomic(METRICS_PATH, render_metrics(state))
+    except (OSError, KMDError) as e:
+        writeLog("WARNING", f"No se pudieron guardar las métricas: {e}")
+
+def render_metrics(state):
+    """
+    Devuelve unas métricas ({nombre: {etiquetas: valor}}, ver read_metrics) en el formato de texto de Prometheus.
+    """
+    def braces(key):
+        return f"{{{key}}}" if key else ""
 
-    return matches
+    lines = []
+    for name, (kind, help_text) in METRIC_DEFINITIONS.items():
+        series = state.get(name)
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for key, value in sorted(series.items()):
+            if kind != "histogram":
+                lines.append(f"{name}{braces(key)} {value}")
+                continue
+            prefix = f"{key}," if key else ""
+            for bound, count in zip(METRIC_BUCKETS, value):
+                lines.append(f'{name}_bucket{{{prefix}le="{bound:g}"}} {count}')
+            lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {value[-1]}')
+            lines.append(f"{name}_sum{braces(key)} {value[-2]}")
+            lines.append(f"{name}_count{braces(key)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+# -- Índice, catálogo y registro --
+CATALOG_MAX_AGE = None # Segundos que el catálogo en memoria se considera fresco (None = toda la ejecución)
+
+_http_session = None # Sesión HTTP compartida (pool de conexiones)
+_catalog = None # Catálogo en memoria
+_catalog_lock = threading.Lock()
+_index_revision = None # Revisión del índice revalidada por última vez
+_index_checked_at = 0 # Momento de la última revalidación
+_index_body = None # Último índice descargado (por si no se pudo guardar en caché)
+INDEX_CHUNK_SIZE = 64 * 1024 # Tamaño de bloque al descargar y parsear el índice
+INDEX_SOURCE_WAIT = 5 # Segundos que se espera a una fuente del índice lenta antes de usar su copia en caché
+_index_lock = threading.Lock()
+_search_index = None # Índice de búsqueda cargado en memoria
+_search_lock = threading.Lock()
+_snapshot = None # Snapshot binario del índice abierto (ver CatalogSnapshot)
+_snapshot_lock = threading.Lock()
+_index_root = None # (revisión, raíz del índice fragmentado o None si el índice es clásico)
+_index_root_lock = threading.Lock()
+_shard_cache = {} # Fragmentos del índice ya cargados, por hash
+SHARDED_INDEX_FORMAT = "kmd-sharded-index" # Valor de "format" en la raíz de un índice fragmentado
+SHARDED_INDEX_VERSION = 1
+SHARD_FETCH_WORKERS = 8 # Descargas de fragmentos en paralelo
+CATALOG_DIFF_HISTORY = 20 # Diferencias entre revisiones del índice que se guardan (ver update_catalog_diff)
+_catalog_diff_revision = None # Última revisión del índice con la que se actualizó el historial de diferencias
+_catalog_diff_lock = threading.Lock()
+_registry_cache = None # (firma del archivo, datos) del último installed.json leído
+
+def get_http_session():
+    """
+    Devuelve una sesión de requests compartida, para reutilizar conexiones entre descargas.
+    """
+    global _http_session
+    if _http_session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.mount("file://", _local_file_adapter())
+        _http_session = session
+    return _http_session
+
+class TransferScheduler:
+    """
+    Reparte la red entre las descargas de paquetes de todos los hilos:
+    - Como mucho MAX_CONNECTIONS_PER_HOST descargas a la vez contra un mismo servidor. Las que esperan
+      entran por prioridad (menor número, antes) y, a igual prioridad, por orden de llegada.
+    - Entre todas, como mucho MAX_BANDWIDTH bytes por segundo (si no es 0).
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._active = {}
+        self._waiting = {}
+        self._counter = 0
+        self._rate_lock = threading.Lock()
+        self._next_free = 0.0
+
+    def acquire(self, host, priority=0):
+        import heapq
+        with self._condition:
+            self._counter += 1
+            ticket = (priority, self._counter)
+            queue = self._waiting.setdefault(host, [])
+            heapq.heappush(queue, ticket)
+            while queue[0] != ticket or self._active.get(host, 0) >= MAX_CONNECTIONS_PER_HOST:
+                self._condition.wait()
+            heapq.heappop(queue)
+            self._active[host] = self._active.get(host, 0) + 1
+
+    def release(self, host):
+        with self._condition:
+            self._active[host] -= 1
+            self._condition.notify_all()
+
+    def throttle(self, size):
+        """
+        Espera lo necesario para que size bytes más no superen MAX_BANDWIDTH (cada bloque reserva
+        su turno en una línea de tiempo compartida por todas las descargas).
+        """
+        if not MAX_BANDWIDTH:
+            return
+        with self._rate_lock:
+            now = time.monotonic()
+            self._next_free = max(self._next_free, now) + size / MAX_BANDWIDTH
+            delay = self._next_free - now
+        if delay > 0:
+            time.sleep(delay)
+
+_transfer_scheduler = TransferScheduler()
+PREFETCH_PRIORITY = 100 # Las descargas de prefetch ceden el turno a las de instalaciones y actualizaciones
+_transfer_context = threading.local() # priority: prioridad de las descargas del hilo actual (ver install_dependencies)
+
+class Transfer:
+    """
+    Una descarga de un paquete gestionada por el TransferScheduler. Uso:
+        with Transfer(url, "Autor@Nombre 1.0.0") as transfer:
+            for chunk in ...:
+                transfer.add(len(chunk))
+    Al terminar registra en el log los bytes, el tiempo y la velocidad conseguida.
+    Las URLs file:// no pasan por el scheduler.
+    """
+    def __init__(self, url, label, priority=None):
+        from urllib.parse import urlparse
+        parsed = urlparse(url)
+        self.host = parsed.netloc if parsed.scheme in ("http", "https") else None
+        self.label = label
+        self.priority = getattr(_transfer_context, "priority", 0) if priority is None else priority
+        self.size = 0
+        self.start = None
+
+    def __enter__(self):
+        if self.host:
+            _transfer_scheduler.acquire(self.host, self.priority)
+        self.start = time.monotonic()
+        return self
+
+    def add(self, size):
+        self.size += size
+        if self.host:
+            _transfer_scheduler.throttle(size)
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.host:
+            _transfer_scheduler.release(self.host)
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        host = self.host or "local"
+        METRICS.inc("kmd_download_bytes_total", self.size, host=host)
+        METRICS.observe("kmd_download_duration_seconds", elapsed, host=host)
+        status = "ERROR" if exc_type else "INFO"
+        writeLog(status, f"Descarga de {self.label}{' interrumpida' if exc_type else ''}: "
+                         f"{self.size} bytes en {elapsed:.2f} s ({self.size / elapsed / 1024:.1f} KB/s)")
+        return False
 
-def verify_hash(file_path, expected_hash) -> bool:
+def file_url_to_path(url):
     """
-    Verifica el hash SHA-256 de un archivo contra un hash esperado.
-    Devuelve True si el hash coincide, False en caso contrario.
+    Convierte una URL file:// en una ruta local.
     """
-    sha256 = hashlib.sha256()
-    with open(file_path, 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b''):
-            sha256.update(chunk)
-    computed = sha256.hexdigest()
-    writeLog("INFO", f"Hash del paquete en el index: {expected_hash}")
-    writeLog("INFO", f"Hash calculado: {computed}")
-    return computed == expected_hash
+    from urllib.parse import urlparse
+    from urllib.request import url2pathname
+    parsed = urlparse(url)
+    path = url2pathname(parsed.path)
+    if parsed.netloc and parsed.netloc != "localhost":
+        path = f"//{parsed.netloc}{path}" # Ruta de red (UNC) en Windows
+    return path
+
+def _local_file_adapter():
+    """
+    Devuelve un adaptador de requests que sirve URLs file:// desde el disco con las mismas respuestas
+    que un servidor HTTP (200, 404, y 304 si coincide el ETag), para que el índice, sus fragmentos
+    y los paquetes de un mirror local se lean con el mismo código que por HTTP.
+    """
+    import io
+    import requests
+    from requests.structures import CaseInsensitiveDict
+    from email.utils import formatdate
+
+    class ClosingFile(io.FileIO):
+        # Cierra el archivo al llegar al final, sin esperar a que se libere la respuesta
+        def read(self, size=-1):
+            data = super().read(size)
+            if not data:
+                self.close()
+            return data
+
+    class LocalFileAdapter(requests.adapters.BaseAdapter):
+        def send(self, request, **kwargs):
+            response = requests.Response()
+            response.request = request
+            response.url = request.url
+            response.headers = CaseInsensitiveDict()
+            response.raw = io.BytesIO(b"")
+            path = file_url_to_path(request.url)
+            try:
+                st = os.stat(path)
+                etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+                if request.headers.get("If-None-Match") == etag:
+                    response.status_code, response.reason = 304, "Not Modified"
+                else:
+                    response.raw = ClosingFile(path, "rb")
+                    response.status_code, response.reason = 200, "OK"
+                    response.headers["Content-Length"] = str(st.st_size)
+                response.headers["ETag"] = etag
+                response.headers["Last-Modified"] = formatdate(st.st_mtime, usegmt=True)
+            except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+                response.status_code, response.reason = 404, "Not Found"
+            except PermissionError:
+                response.status_code, response.reason = 403, "Forbidden"
+            return response
+
+        def close(self):
+            pass
+
+    return LocalFileAdapter()
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+class _CompactEntry(Mapping):
+    """
+    Base de las entradas compactas del catálogo: cada campo conocido del índice va en un slot
+    (_fields: clave del JSON -> atributo) y los desconocidos en extra (None si no hay).
+    Se leen igual que el diccionario del índice (entry['name'], entry.get(...), dict(entry)),
+    y to_dict() las vuelve a convertir para escribirlas en JSON. Un campo a None cuenta como ausente.
+    """
+    __slots__ = ()
+    _fields = {}
 
-def extract_and_validate_manifest(zip_path):
+    def _split(self, data, known):
+        # known: Cuántos campos conocidos tiene data (si son todos, no hace falta recorrerlo)
+        if len(data) == known:
+            self.extra = None
+        else:
+            self.extra = {key: value for key, value in data.items() if key not in self._fields} or None
+
+    def __getitem__(self, key):
+        attr = self._fields.get(key)
+        if attr is not None:
+            value = getattr(self, attr)
+            if value is not None:
+                return value
+        elif self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        for key, attr in self._fields.items():
+            if getattr(self, attr) is not None:
+                yield key
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def to_dict(self):
+        return dict(self)
+
+class CatalogVersion(_CompactEntry):
     """
-    Extrae el manifest.json de un paquete ZIP y lo valida contra el índice.
-    Devuelve el manifest como un diccionario si es válido, o "ERROR" en caso de fallo.
+    Una versión de un paquete del catálogo (ver _CompactEntry). El nombre de la versión se interna
+    (se repite en muchos paquetes) y su clave de orden (key) se calcula una sola vez.
     """
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+    __slots__ = ("name", "latest", "download_url", "hash", "extra", "_key")
+    _fields = {"versionName": "name", "latest": "latest", "downloadURL": "download_url", "hash": "hash"}
+
+    def __init__(self, data):
+        get = data.get
+        name = self.name = get("versionName")
+        if name.__class__ is str:
+            self.name = sys.intern(name)
+        self.latest = get("latest")
+        self.download_url = get("downloadURL")
+        self.hash = get("hash")
+        self._split(data, (name is not None) + (self.latest is not None) + (self.download_url is not None) + (self.hash is not None))
+        self._key = None
+
+    @property
+    def key(self):
+        """Clave de orden de la versión (ver version_key)."""
+        if self._key is None:
+            self._key = version_key(self.name)
+        return self._key
+
+class CatalogEntry(_CompactEntry):
+    """
+    Un paquete del catálogo (ver _CompactEntry). Autor y nombre se internan; versions es una tupla de CatalogVersion.
+    """
+    __slots__ = ("author", "name", "description", "versions", "extra")
+    _fields = {"author": "author", "name": "name", "description": "description", "versions": "versions"}
+
+    def __init__(self, data):
+        self.author = _intern(data.get("author"))
+        self.name = _intern(data.get("name"))
+        self.description = data.get("description")
+        versions = data.get("versions")
+        self.versions = tuple(map(CatalogVersion, versions)) if versions else ()
+        self._split(data, (self.author is not None) + (self.name is not None) + (self.description is not None) + (versions is not None))
+
+    @property
+    def id(self):
+        return f"{self.author}@{self.name}"
+
+    def to_dict(self):
+        data = dict(self)
+        data["versions"] = [v.to_dict() for v in self.versions]
+        return data
+
+class Catalog:
+    """
+    Catálogo de paquetes en memoria construido a partir del índice.
+    packages: Los paquetes tal y como vienen en index.json (cualquier iterable, p. ej. iter_index()).
+              Se guardan como CatalogEntry, que ocupan bastante menos que los diccionarios del JSON.
+    revision: Identificador de la revisión del índice (cambia cuando cambia su contenido).
+    Permite buscar paquetes por ID ("Autor@Nombre") sin recorrer toda la lista.
+    """
+    def __init__(self, packages, revision=None):
+        self.packages = [p if isinstance(p, CatalogEntry) else CatalogEntry(p) for p in packages]
+        self.revision = revision
+        self._by_id = {p.id: p for p in self.packages}
+
+    def get(self, package_id):
+        """
+        Devuelve la entrada del índice para un ID, o None si no existe.
+        """
+        return self._by_id.get(package_id)
+
+    def __contains__(self, package_id):
+        return package_id in self._by_id
+
+    def __iter__(self):
+        return iter(self.packages)
+
+    def __len__(self):
+        return len(self.packages)
+
+SEARCH_INDEX_FORMAT = 1 # Versión del formato de search-index.bin
+SEARCH_FIELD_WEIGHTS = (("name", 3), ("author", 2), ("description", 1)) # Peso de cada campo en el ranking
+SEARCH_MODES = ("ranked", "prefix", "fuzzy")
+SEARCH_PREFIX_FACTOR = 0.6 # Peso de una coincidencia por prefijo respecto a una exacta
+SEARCH_FUZZY_FACTOR = 0.4 # Peso de una coincidencia aproximada respecto a una exacta
+SEARCH_FUZZY_THRESHOLD = 0.3 # Similitud mínima (Jaccard de trigramas) para una coincidencia aproximada
+SEARCH_FUZZY_MAX_TERMS = 20 # Máximo de términos aproximados por palabra de la consulta (los más parecidos)
+SEARCH_FUZZY_MAX_DF = 0.05 # Los términos presentes en más de esta fracción de paquetes no se usan como coincidencia aproximada
+
+def tokenize(text, split_words=True):
+    """
+    Divide un texto en términos de búsqueda en minúsculas, separando por cualquier carácter no alfanumérico.
+    split_words: Si es True, además separa cada palabra por camelCase y dígitos
+                 ("testLib2" -> "testlib2", "test", "lib", "2").
+    """
+    import re
+    terms = []
+    for word in re.split(r"[\W_]+", text or ""):
+        if not word:
+            continue
+        terms.append(word.lower())
+        if split_words:
+            parts = re.findall(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+|[^\W\d_]+", word)
+            if len(parts) > 1:
+                terms.extend(part.lower() for part in parts)
+    return terms
+
+def _trigrams(term):
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class SearchIndex:
+    """
+    Índice invertido de términos sobre el autor, el nombre y la descripción de los paquetes.
+    Se construye una vez por revisión del índice y se guarda junto a la caché del índice.
+    revision: Revisión del índice a partir de la que se construyó.
+    docs: Para cada paquete indexado (ordenados por ID), "ID\\x1fdescripción\\x1fúltima versión".
+    terms: Lista ordenada de términos (permite buscar por prefijo con bisect).
+    offsets, postings: Arrays de enteros. Los postings del término i son
+                       postings[offsets[i]:offsets[i + 1]], como [doc, peso, doc, peso, ...].
+    """
+    def __init__(self, revision, docs, terms, offsets, postings):
+        self.revision = revision
+        self.docs = docs
+        self.terms = terms
+        self.offsets = offsets
+        self.postings = postings
+
+    @classmethod
+    def build(cls, packages, revision=None):
+        """
+        Construye el índice a partir de los paquetes (una lista o cualquier iterable, p. ej. iter_index()),
+        excepto EXCLUDED_PACKAGES.
+        """
+        from array import array
+        docs = []
+        weights = {} # término -> {doc: peso}
+        for p in packages:
+            package_id = f"{p['author']}@{p['name']}"
+            if package_id in EXCLUDED_PACKAGES:
+                continue
+            doc = len(docs)
+            latest = next((v.get('versionName') for v in p.get('versions', []) if v.get('latest')), None)
+            description = (p.get('description') or "").replace("\x1f", " ").replace("\n", " ")
+            docs.append(f"{package_id}\x1f{description}\x1f{latest or ''}")
+            seen = {}
+            for field, weight in SEARCH_FIELD_WEIGHTS:
+                for term in tokenize(p.get(field)):
+                    if seen.get(term, 0) < weight:
+                        seen[term] = weight
+            for term, weight in seen.items():
+                weights.setdefault(term, {})[doc] = weight
+
+        # Renumerar los documentos por orden de ID
+        order = sorted(range(len(docs)), key=docs.__getitem__)
+        renumber = [0] * len(docs)
+        for new_doc, old_doc in enumerate(order):
+            renumber[old_doc] = new_doc
+        docs = [docs[old_doc] for old_doc in order]
+
+        terms = sorted(weights)
+        offsets = array('I', [0])
+        postings = array('I')
+        for term in terms:
+            for doc, weight in sorted((renumber[doc], weight) for doc, weight in weights[term].items()):
+                postings.append(doc)
+                postings.append(weight)
+            offsets.append(len(postings))
+        return cls(revision, docs, terms, offsets, postings)
+
+    @classmethod
+    def load(cls, path, revision):
+        """
+        Carga el índice guardado en path si corresponde a la revisión indicada.
+        Devuelve None si no existe, está corrupto o es de otra revisión.
+        """
+        from array import array
         try:
-            with zip_ref.open('manifest.json') as manifest_file:
-                manifest = json.load(manifest_file)
-        except json.JSONDecodeError:
-            writeLog("ERROR", "El archivo manifest.json está corrupto o malformado. Abortando instalación...")
-            print(f"Error: Ha ocurrido un error mientras se abría manifest.json")
-            return "ERROR"
-
-    index = get_index()
-    # Buscar paquete por author y name
-    index_entry = next((p for p in index if p['author'] == manifest['author'] and p['name'] == manifest['name']), None)
-    if not index_entry:
-        writeLog("ERROR", "Paquete no encontrado en el índice al validar manifest")
-        raise Exception("Paquete no encontrado en el índice al validar manifest")
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline())
+                if (not isinstance(header, dict) or header.get("format") != SEARCH_INDEX_FORMAT
+                        or header.get("revision") != revision or header.get("byteorder") != sys.byteorder):
+                    return None
+                terms = f.read(header["termsBytes"]).decode("utf-8").split("\n")
+                docs = f.read(header["docsBytes"]).decode("utf-8").split("\n")
+                offsets = array('I')
+                offsets.frombytes(f.read(header["offsets"] * offsets.itemsize))
+                postings = array('I')
+                postings.frombytes(f.read(header["postings"] * postings.itemsize))
+        except (OSError, ValueError, KeyError):
+            return None
+        if len(offsets) != header["offsets"] or len(postings) != header["postings"] or len(offsets) != len(terms) + 1:
+            return None
+        return cls(revision, docs, terms, offsets, postings)
+
+    def save(self, path):
+        """
+        Guarda el índice en path (escritura atómica).
+        Formato: una línea JSON de cabecera, los términos y los documentos separados por saltos de línea
+        y los arrays de offsets y postings en binario.
+        """
+        terms = "\n".join(self.terms).encode("utf-8")
+        docs = "\n".join(self.docs).encode("utf-8")
+        header = json.dumps({
+            "format": SEARCH_INDEX_FORMAT,
+            "revision": self.revision,
+            "byteorder": sys.byteorder,
+            "termsBytes": len(terms),
+            "docsBytes": len(docs),
+            "offsets": len(self.offsets),
+            "postings": len(self.postings),
+        }).encode("utf-8")
+        write_file_atomic(path, b"".join([header, b"\n", terms, docs, self.offsets.tobytes(), self.postings.tobytes()]))
+
+    def get_doc(self, doc):
+        """
+        Devuelve (ID, descripción, última versión) de un documento.
+        """
+        package_id, description, latest = self.docs[doc].split("\x1f")
+        return package_id, description or None, latest or None
+
+    def _expand(self, token, mode):
+        """
+        Devuelve los términos del índice que casan con un término de la consulta,
+        como lista de (posición del término, factor).
+        """
+        import bisect
+        terms = self.terms
+        start = bisect.bisect_left(terms, token)
+        matches = []
+        if start < len(terms) and terms[start] == token:
+            matches.append((start, 1.0))
+            start += 1
+        if mode != "ranked" or len(token) >= 2:
+            end = bisect.bisect_left(terms, token + "\U0010ffff", start)
+            matches.extend((i, SEARCH_PREFIX_FACTOR) for i in range(start, end))
+        if mode == "fuzzy" or (mode == "ranked" and not matches):
+            matches.extend(self._fuzzy(token))
+        return matches
+
+    def _fuzzy(self, token):
+        """
+        Busca términos parecidos (similitud de Jaccard entre trigramas) que empiecen por la misma letra
+        y tengan una longitud parecida. Los términos muy comunes ("de", "para", ...) se ignoran.
+        Devuelve como mucho SEARCH_FUZZY_MAX_TERMS términos, los más parecidos.
+        """
+        import bisect
+        import heapq
+        if len(token) < 3:
+            return []
+        terms, offsets = self.terms, self.offsets
+        max_postings = 2 * max(1, int(len(self.docs) * SEARCH_FUZZY_MAX_DF))
+        grams = _trigrams(token)
+        start = bisect.bisect_left(terms, token[0])
+        end = bisect.bisect_left(terms, token[0] + "\U0010ffff", start)
+        length = len(token)
+        matches = []
+        for i in range(start, end):
+            term = terms[i]
+            if abs(len(term) - length) > 2 or term.startswith(token) or offsets[i + 1] - offsets[i] > max_postings:
+                continue
+            other = _trigrams(term)
+            similarity = len(grams & other) / len(grams | other)
+            if similarity >= SEARCH_FUZZY_THRESHOLD:
+                matches.append((similarity, i))
+        matches = heapq.nlargest(SEARCH_FUZZY_MAX_TERMS, matches)
+        return [(i, SEARCH_FUZZY_FACTOR * similarity) for similarity, i in matches]
+
+    def query(self, text, mode="ranked", limit=None):
+        """
+        Busca paquetes. Cada palabra de la consulta se compara con los términos del índice:
+        mode: "ranked" (términos exactos y prefijos; aproximados si una palabra no casa con nada),
+              "prefix" (todas las palabras deben casar como prefijo) o
+              "fuzzy" (además, términos aproximados).
+        Devuelve una lista de (ID, descripción, última versión), de más a menos relevante.
+        """
+        import heapq
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Modo de búsqueda no válido: {mode}")
+        tokens = list(dict.fromkeys(tokenize(text, split_words=False)))
+        if not tokens:
+            return []
 
-    # Buscar la versión dentro de las versiones del índice que coincida con manifest['version']
-    version_entry = next((v for v in index_entry['versions'] if v.get('versionName', v.get('vName')) == manifest['version']), None)
-    if not version_entry:
-        writeLog("ERROR", "Versión no encontrada en el índice para este paquete")
-        raise Exception("Versión no encontrada en el índice para este paquete")
+        offsets, postings = self.offsets, self.postings
+        scores = {}
+        hits = {}
+        for token in tokens:
+            best = {} # doc -> mejor puntuación para esta palabra de la consulta
+            for position, factor in self._expand(token, mode):
+                posting = postings[offsets[position]:offsets[position + 1]]
+                for doc, weight in zip(posting[::2], posting[1::2]):
+                    score = weight * factor
+                    if score > best.get(doc, 0):
+                        best[doc] = score
+            for doc, score in best.items():
+                scores[doc] = scores.get(doc, 0) + score
+                hits[doc] = hits.get(doc, 0) + 1
+
+        if mode == "prefix":
+            scores = {doc: score for doc, score in scores.items() if hits[doc] == len(tokens)}
+
+        # Bonificación si la consulta es el ID o el nombre completo del paquete
+        text_lower = text.strip().lower()
+        exact = tokenize(text_lower, split_words=False)
+        if len(exact) <= 2:
+            for doc in scores:
+                package_id = self.docs[doc].split("\x1f", 1)[0].lower()
+                if package_id == text_lower or package_id.split("@", 1)[1] == text_lower:
+                    scores[doc] += 10
+
+        key = lambda doc: (-hits[doc], -scores[doc], doc) # Los documentos están ordenados por ID
+        if limit is None:
+            ranked = sorted(scores, key=key)
+        else:
+            ranked = heapq.nsmallest(limit, scores, key=key)
+        return [self.get_doc(doc) for doc in ranked]
 
-    # Validaciones básicas
-    if manifest['description'] != index_entry.get('description', ''):
-        writeLog("ERROR", "La descripción del manifest y el índice no coinciden")
-        raise Exception("La descripción del manifest y el índice no coinciden")
+SNAPSHOT_MAGIC = b"KMDSNAP1" # Identifica el formato (y su versión) de index.snapshot
+SNAPSHOT_FOOTER = "<8s16sQQ" # Al final del archivo: magic, revisión, nº de paquetes, offset de la tabla de IDs
+SNAPSHOT_ENTRY = "<QIQI" # Cada entrada de la tabla: offset y longitud del ID, offset y longitud del registro
 
-    return manifest
+class CatalogSnapshot:
+    """
+    Copia binaria compacta del índice (index.snapshot) para buscar paquetes sin parsear index.json.
+    Se abre con mmap y las búsquedas son O(log n) sobre una tabla de IDs ordenada: solo se
+    decodifica el registro del paquete pedido.
+    Formato: los registros (cada entrada del índice en JSON compacto), los IDs en UTF-8, la tabla
+    de IDs ordenada (SNAPSHOT_ENTRY) y un pie (SNAPSHOT_FOOTER).
+    """
+    def __init__(self, f, mm, revision, count, table_offset):
+        self._file = f
+        self._mm = mm
+        self.revision = revision
+        self._count = count
+        self._table_offset = table_offset
+
+    @staticmethod
+    def build(path, packages, revision):
+        """
+        Escribe el snapshot de los paquetes (cualquier iterable, p. ej. iter_index()) en path.
+        Los registros se escriben según se leen; en memoria solo se guarda la tabla de IDs.
+        """
+        import struct
+        entries = {} # ID -> (offset, longitud) del registro
+
+        def chunks():
+            offset = 0
+            for p in packages:
+                record = json.dumps(p, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+                entries[f"{p['author']}@{p['name']}".encode("utf-8")] = (offset, len(record))
+                offset += len(record)
+                yield record
+
+            ids = []
+            table = []
+            for package_id, (record_offset, record_length) in sorted(entries.items()):
+                table.append(struct.pack(SNAPSHOT_ENTRY, offset, len(package_id), record_offset, record_length))
+                ids.append(package_id)
+                offset += len(package_id)
+            yield b"".join(ids)
+            yield b"".join(table)
+            yield struct.pack(SNAPSHOT_FOOTER, SNAPSHOT_MAGIC, revision.encode("ascii"), len(table), offset)
+
+        write_file_atomic(path, chunks())
+
+    @classmethod
+    def open(cls, path, revision=None):
+        """
+        Abre el snapshot de path. Si se indica revision, solo se abre si corresponde a esa revisión.
+        Devuelve None si no existe, está corrupto o es de otra revisión.
+        """
+        import mmap
+        import struct
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return None
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            f.close()
+            return None
+
+        footer_size = struct.calcsize(SNAPSHOT_FOOTER)
+        valid = len(mm) >= footer_size
+        if valid:
+            magic, file_revision, count, table_offset = struct.unpack_from(SNAPSHOT_FOOTER, mm, len(mm) - footer_size)
+            file_revision = file_revision.decode("ascii", "replace")
+            valid = (magic == SNAPSHOT_MAGIC
+                     and table_offset + count * struct.calcsize(SNAPSHOT_ENTRY) == len(mm) - footer_size
+                     and (revision is None or file_revision == revision))
+        if not valid:
+            mm.close()
+            f.close()
+            return None
+        return cls(f, mm, file_revision, count, table_offset)
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def _entry(self, i):
+        import struct
+        return struct.unpack_from(SNAPSHOT_ENTRY, self._mm, self._table_offset + i * struct.calcsize(SNAPSHOT_ENTRY))
+
+    def _find(self, package_id):
+        # Búsqueda binaria en la tabla de IDs. Devuelve la entrada o None
+        key = package_id.encode("utf-8")
+        mm = self._mm
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = self._entry(mid)
+            current = mm[entry[0]:entry[0] + entry[1]]
+            if current == key:
+                return entry
+            if current < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def get(self, package_id):
+        """
+        Devuelve la entrada del índice para un ID, o None si no existe.
+        """
+        entry = self._find(package_id)
+        if entry is None:
+            return None
+        return json.loads(self._mm[entry[2]:entry[2] + entry[3]])
+
+    def ids(self):
+        """
+        Devuelve los IDs de los paquetes, en orden.
+        """
+        mm = self._mm
+        for i in range(self._count):
+            entry = self._entry(i)
+            yield mm[entry[0]:entry[0] + entry[1]].decode("utf-8")
+
+    def items(self):
+        """
+        Devuelve (ID, registro en JSON sin decodificar) de cada paquete, en orden de ID.
+        """
+        mm = self._mm
+        for i in range(self._count):
+            id_offset, id_length, record_offset, record_length = self._entry(i)
+            yield mm[id_offset:id_offset + id_length].decode("utf-8"), mm[record_offset:record_offset + record_length]
+
+    def __contains__(self, package_id):
+        return self._find(package_id) is not None
+
+    def __len__(self):
+        return self._count
+
+def get_index_cache_paths():
+    """
+    Devuelve las rutas (índice, metadatos) de la copia en caché del índice.
+    """
+    return os.path.join(CACHE_PATH, "index.json"), os.path.join(CACHE_PATH, "index.meta.json")
 
-def who_depends(package_id, silent=False):
+def write_file_atomic(path, data):
     """
-    Busca y muestra los paquetes que dependen de un paquete dado por su ID.
-    package_id: ID del paquete en formato "autor@nombre"
-    silent: Si es True, no muestra mensajes al usuario, solo registra en el log.
-    Devuelve una lista de paquetes que dependen del paquete dado.
+    Escribe un archivo de forma atómica (archivo temporal + os.replace), para que
+    ningún otro proceso vea nunca un archivo a medio escribir.
+    data: bytes, str o un iterable de bloques de bytes (se escriben según llegan).
     """
-    writeLog("INFO", f"Buscando paquetes que dependen de {package_id}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    mode = 'w' if isinstance(data, str) else 'wb'
     try:
-        if not isinstance(package_id, str) or "@" not in package_id:
-            writeLog("ERROR", f"ID de paquete inválido: {package_id}")
-            print("Error: El ID del paquete debe ser una cadena válida en formato 'autor@nombre'.")
-            return []
+        with open(tmp_path, mode, **({} if mode == 'wb' else {"encoding": "utf-8"})) as f:
+            if isinstance(data, (bytes, str)):
+                f.write(data)
+            else:
+                for chunk in data:
+                    f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
 
-        installed_file = os.path.join(INSTALL_PATH, 'installed.json')
-        if not os.path.exists(installed_file):
-            writeLog("WARNING", "No se encontró el archivo del registro")
-            if not silent:
-                print("No hay paquetes instalados.")
-            return []
+def _download_source(url, cache_file, meta_file):
+    """
+    Descarga un índice, revalidándolo contra su copia en caché (ETag / Last-Modified).
+    Si el servidor responde 304, se usa la caché sin volver a descargar el índice.
+    Si la red falla y hay una copia en caché, se usa la caché.
+    Devuelve (revisión, contenido descargado si no se pudo guardar en la caché, o None).
+    """
+    import hashlib
+    fetch_url = GITHUB_INDEX_URL if url == INDEX_URL else _cache_busted(url)
+    start = time.monotonic()
 
+    def record(result):
+        METRICS.observe("kmd_index_fetch_duration_seconds", time.monotonic() - start, result=result)
+        if result != "error":
+            METRICS.inc("kmd_cache_requests_total", cache="index", result="miss" if result == "downloaded" else "hit")
+
+    meta = {}
+    if os.path.exists(cache_file) and os.path.exists(meta_file):
         try:
-            with open(installed_file, 'r') as f:
-                installed_data = json.load(f)
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
         except json.JSONDecodeError:
-            writeLog("ERROR", "El archivo installed.json está corrupto o malformado")
-            if not silent:
-                print("Error: El archivo de registro está corrupto. No se puede continuar.")
-            return []
-
-        installed = installed_data.get('installed', [])
-        if not isinstance(installed, list):
-            writeLog("ERROR", "El campo 'installed' no es una lista")
-            if not silent:
-                print("Error: Formato incorrecto en el archivo de registro.")
-            return []
-
-        dependents = []
-        for p in installed:
-            deps = p.get('dependencies', [])
-            if not isinstance(deps, list):
-                continue  # Ignora paquetes con dependencias mal formateadas
+            meta = {}
+        if meta.get("url") != url:
+            meta = {}
 
-            for dep in deps:
-                if not isinstance(dep, dict):
-                    continue
-                if dep.get('id') == package_id:
-                    dependents.append(f"{p.get('author', 'desconocido')}@{p.get('name', 'desconocido')}")
-                    break  # Si ya depende, no hace falta seguir revisando
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("lastModified"):
+        headers["If-Modified-Since"] = meta["lastModified"]
 
-        writeLog("INFO", f"Se encontró que {len(dependents)} paquetes dependen de {package_id}")
+    try:
+        r = get_http_session().get(fetch_url, timeout=30, headers=headers, stream=True)
+    except Exception as e:
+        if not meta:
+            writeLog("ERROR", f"No se pudo obtener el índice de paquetes: {e}")
+            record("error")
+            raise Exception("No se pudo obtener el índice de paquetes")
+        writeLog("WARNING", f"No se pudo revalidar el índice ({e}). Usando la copia en caché")
+        r = None
+
+    if r is None or r.status_code == 304:
+        if r is not None:
+            writeLog("INFO", "El índice no ha cambiado. Usando la copia en caché")
+        record("not_modified" if r is not None else "offline")
+        return meta["revision"], None
 
-        if dependents:
-            if not silent:
-                print(f"Los siguientes paquetes dependen de '{package_id}':")
-            for d in dependents:
-                print(f"  - {d}")
-        else:
-            if not silent:
-                print(f"Ningún paquete depende de '{package_id}'.")
-        return dependents
+    if r.status_code != 200:
+        writeLog("ERROR", "No se pudo obtener el índice de paquetes")
+        record("error")
+        raise Exception("No se pudo obtener el índice de paquetes")
 
-    except Exception as e:
-        writeLog("ERROR", f"Error inesperado en who_depends: {e}")
-        print(f"Error inesperado: {e}")
-        return []
+    # El índice se escribe en la caché según se descarga, sin tenerlo entero en memoria
+    digest = hashlib.sha256()
+    def chunks():
+        for chunk in r.iter_content(INDEX_CHUNK_SIZE):
+            digest.update(chunk)
+            yield chunk
 
-def install_dependencies(manifest):
+    content = None
+    try:
+        write_file_atomic(cache_file, chunks())
+    except OSError as e:
+        writeLog("WARNING", f"No se pudo guardar el índice en caché: {e}")
+        r = get_http_session().get(fetch_url, timeout=30)
+        if r.status_code != 200:
+            writeLog("ERROR", "No se pudo obtener el índice de paquetes")
+            raise Exception("No se pudo obtener el índice de paquetes")
+        content = r.content
+        digest = hashlib.sha256(content)
+    revision = digest.hexdigest()[:16]
+    if content is None:
+        try:
+            write_file_atomic(meta_file, json.dumps({
+                "url": url,
+                "etag": r.headers.get("ETag"),
+                "lastModified": r.headers.get("Last-Modified"),
+                "revision": revision,
+                "fetchedAt": time.time(),
+            }))
+        except OSError as e:
+            writeLog("WARNING", f"No se pudo guardar el índice en caché: {e}")
+    record("downloaded")
+    return revision, content
+
+def _cache_busted(url):
+    # Evita copias viejas en cachés HTTP intermedias (la revalidación la hace el ETag)
+    if url.startswith(("http://", "https://")):
+        return f"{url}{'&' if '?' in url else '?'}cb={int(time.time())}"
+    return url
+
+def get_source_cache_paths(url):
     """
-    Instala las dependencias de un paquete dado su manifest.
-    manifest: El manifest del paquete como un diccionario.
-    Devuelve "OK" si todas las dependencias se instalaron correctamente, o "ERROR" en caso de fallo.
+    Devuelve las rutas (índice, metadatos) de la copia en caché de una fuente del índice.
     """
-    for dep in manifest.get('dependencies', []):
-        pkg_id = dep.get("id")
-        pkg_version = dep.get("version")
-
-        if not pkg_id:
-            writeLog("ERROR", "Dependencia inválida, falta el ID.")
-            print("Dependencia inválida, falta el ID.")
-            return "ERROR"
-        
-        writeLog("INFO", f"Instalando dependencia: {pkg_id} (versión: {pkg_version or 'latest'})")
-        print(f"Instalando dependencia: {pkg_id} (versión: {pkg_version or 'latest'})")
-        install_code = install_package(pkg_id, pkg_version)
-
-        if install_code != "OK":
-            writeLog("ERROR", f"Error al instalar dependencia: {pkg_id}")
-            print(f"Error al instalar dependencia: {pkg_id}")
-            return "ERROR"
+    import hashlib
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+    folder = os.path.join(CACHE_PATH, "sources")
+    return os.path.join(folder, f"{key}.json"), os.path.join(folder, f"{key}.meta.json")
 
-    return "OK"
+def _cached_revision(meta_file, url):
+    try:
+        with open(meta_file, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    return meta.get("revision") if meta.get("url") == url else None
 
-def extract_package(zip_path, package_name):
+def _open_source(source, content):
     """
-    Extrae un paquete ZIP a una carpeta específica dentro de INSTALL_PATH.
-    zip_path: Ruta al archivo ZIP del paquete.
-    package_name: Nombre del paquete (usado para crear la carpeta de destino).
-    Devuelve la ruta de la carpeta donde se extrajo el paquete.
+    Abre una fuente del índice (su copia en caché, o content si no se pudo guardar).
     """
-    dest_path = os.path.join(INSTALL_PATH, package_name)
-    os.makedirs(dest_path, exist_ok=True)
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(dest_path)
-    return dest_path
+    import io
+    return io.BytesIO(content) if content is not None else open(get_source_cache_paths(source["url"])[0], 'rb')
 
-def run_postinstall(manifest, package_path):
+def _source_root(source, content):
     """
-    Ejecuta un script de post-instalación si está definido en el manifest.
-    manifest: El manifest del paquete como un diccionario.
-    package_path: Ruta donde se extrajo el paquete.
+    Devuelve la raíz de una fuente del índice si está fragmentada, o None si es un index.json clásico.
     """
-    script = manifest.get('postInstallScript')
-    if script:
-        script_path = os.path.join(package_path, script)
-        if os.path.exists(script_path):
-            writeLog("INFO", f"Ejecutando script de instalación: {script}")
-            print(f"Ejecutando script de instalación: '{script}'")
-            try:
-                subprocess.run([script_path], shell=True, check=True)
-            except subprocess.CalledProcessError:
-                writeLog("ERROR", f"Error al ejecutar el script de instalación '{script}'")
-                print(f"Error al ejecutar el script {script}")
-        else:
-            writeLog("ERROR", f"Script {script} no encontrado en {package_path}")
-            print(f"Script {script} no encontrado en {package_path}")
-
-def run_uninstall(manifest, package_path):
+    with _open_source(source, content) as f:
+        if not f.read(64).lstrip(b"\xef\xbb\xbf \t\r\n").startswith(b"{"):
+            return None
+        f.seek(0)
+        root = json.loads(f.read())
+    if root.get("format") != SHARDED_INDEX_FORMAT or root.get("version") != SHARDED_INDEX_VERSION:
+        writeLog("ERROR", f"Formato de índice fragmentado no soportado en {source['url']}")
+        raise KMDError("Formato de índice fragmentado no soportado. Actualiza KMD")
+    return root
+
+def _resolve_source_entry(entry, source_name, base):
     """
-    Ejecuta un script de desinstalación si está definido en el manifest.
-    manifest: El manifest del paquete como un diccionario.
-    package_path: Ruta donde se extrajo el paquete.
+    Marca una entrada del índice con su fuente y resuelve sus URLs de descarga relativas respecto a la
+    URL de esa fuente (base), no a la del índice combinado.
     """
-    script = manifest.get('uninstallScript')
-    if script:
-        script_path = os.path.join(package_path, script)
-        if os.path.exists(script_path):
-            writeLog("INFO", f"Ejecutando script de desinstalación: '{script}'")
-            print(f"Ejecutando script de desinstalación: '{script}'")
-            try:
-                subprocess.run([script_path], shell=True, check=True)
-            except subprocess.CalledProcessError:
-                writeLog("ERROR", f"Error al ejecutar el script de instalación '{script}'")
-                print(f"Error al ejecutar el script {script}")
-        else:
-            writeLog("ERROR", f"Script {script} no encontrado en {package_path}")
-            print(f"Script {script} no encontrado en {package_path}")
+    from urllib.parse import urljoin
+    return dict(entry, source=source_name, versions=[
+        dict(v, downloadURL=urljoin(base, v["downloadURL"])) if v.get("downloadURL") else v
+        for v in entry.get("versions", [])
+    ])
 
-def autoremove_unused_packages():
+def _download_index():
     """
-    Elimina paquetes huérfanos que no tienen dependientes.
-    Un paquete se considera huérfano si tiene dependencias, pero ninguna de ellas está instalada.
-    Revisa el archivo installed.json y elimina los paquetes que no son utilizados por otros.
+    Descarga el índice de paquetes (ver _download_source).
+    Si hay varias fuentes (INDEX_SOURCES), se descargan a la vez, cada una con su propia caché, y se
+    combinan en un solo índice en la caché principal: si un paquete (Autor@Nombre) está en varias,
+    se usa entero el de la fuente con más prioridad (a igual prioridad, la primera de la lista).
+    Si alguna fuente está fragmentada, el índice combinado es también una raíz fragmentada (ver
+    _merged_root): sus fragmentos no se descargan al combinar, sino cuando se necesitan.
+    Una fuente que no responde no bloquea al resto: a todas se las espera como mucho INDEX_SOURCE_WAIT
+    segundos y, si no llegan a tiempo, se usa su copia en caché o, si no la tienen, se combina sin ellas
+    (su descarga sigue en segundo plano y llena su caché para la próxima vez). Solo si no llega a tiempo
+    ninguna se espera a que termine alguna.
+    Devuelve (revisión, contenido si no se pudo guardar en la caché, o None).
     """
-    installed_file = os.path.join(INSTALL_PATH, 'installed.json')
+    import hashlib
+    sources = INDEX_SOURCES
+    if len(sources) <= 1:
+        return _download_source(INDEX_URL, *get_index_cache_paths())
 
-    if not os.path.exists(installed_file):
-        writeLog("INFO", "No se encuentra el archivo del registro.")
-        print("No hay paquetes instalados.")
-        return
+    results = {}
+    def fetch(source):
+        try:
+            results[source["url"]] = _download_source(source["url"], *get_source_cache_paths(source["url"]))
+        except Exception as e:
+            results[source["url"]] = e
+
+    # Hilos daemon: una fuente lenta sigue descargándose (y actualiza su caché) sin retener a KMD al salir
+    threads = [threading.Thread(target=fetch, args=(source,), daemon=True) for source in sources]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + INDEX_SOURCE_WAIT
+    for thread in threads:
+        thread.join(max(0, deadline - time.monotonic()))
+    if not any(isinstance(results.get(source["url"]), tuple)
+               or _cached_revision(get_source_cache_paths(source["url"])[1], source["url"]) for source in sources):
+        # Ninguna llegó a tiempo ni tiene copia en caché: no hay nada con qué combinar, así que se espera
+        # a la primera que termine
+        writeLog("WARNING", "Ninguna fuente del índice respondió a tiempo. Esperando...")
+        while (not any(isinstance(result, tuple) for result in list(results.values()))
+               and any(thread.is_alive() for thread in threads)):
+            time.sleep(0.05)
+    used = []
+    for source in sources:
+        result = results.get(source["url"])
+        cached = _cached_revision(get_source_cache_paths(source["url"])[1], source["url"])
+        if isinstance(result, tuple):
+            used.append((source, *result))
+        elif cached:
+            writeLog("WARNING", f"La fuente {source['name']} no respondió a tiempo. Usando su copia en caché")
+            used.append((source, cached, None))
+        elif result is None:
+            writeLog("WARNING", f"La fuente {source['name']} no respondió a tiempo y no tiene copia en caché. Se omite")
+        else:
+            writeLog("WARNING", f"No se pudo obtener la fuente {source['name']} ({result}). Se omite")
+    if not used:
+        writeLog("ERROR", "No se pudo obtener ninguna fuente del índice")
+        raise Exception("No se pudo obtener el índice de paquetes")
 
-    try:
-        with open(installed_file, 'r') as f:
-            installed = json.load(f)
-    except json.JSONDecodeError:
-            writeLog("ERROR", "El archivo installed.json está corrupto o malformado.")
-            raise Exception(f"Error: Ha ocurrido un error mientras se leía el registro.")
+    sources_key = "\n".join(source["url"] for source in sources)
+    revision = hashlib.sha256("\n".join(f"{s['url']} {r}" for s, r, _ in used).encode("utf-8")).hexdigest()[:16]
+    cache_file, meta_file = get_index_cache_paths()
+    if _cached_revision(meta_file, sources_key) == revision and os.path.exists(cache_file):
+        return revision, None
 
-    all_ids = [f"{p['author']}@{p['name']}" for p in installed['installed']]
-    removed_any = False
-    changes = True  # Para seguir limpiando en cascada
+    roots = [_source_root(source, content) for source, _, content in used]
 
-    while changes:
-        changes = False
-        to_remove = []
-
-        for pkg in installed['installed']:
-            pkg_id = f"{pkg['author']}@{pkg['name']}"
-            dependents = pkg.get('dependents', [])
-
-            # Si tiene dependents pero ninguno de ellos existe, marcar para borrar
-            if dependents and all(dep not in all_ids for dep in dependents):
-                to_remove.append(pkg_id)
-
-        if to_remove:
-            for pkg_id in to_remove:
-                uninstall_package(pkg_id)  # Aquí llamas a tu función de desinstalación
-                writeLog("INFO", f"Se eliminó el paquete huérfano: {pkg_id}")
-                print(f"Se eliminó el paquete huérfano: {pkg_id}")
-                removed_any = True
-            # Recargar lista después de cada tanda de desinstalaciones
+    def merged():
+        if any(root is not None for root in roots):
+            yield json.dumps(_merged_root(used, roots), ensure_ascii=False).encode("utf-8")
+            return
+        seen = set()
+        yield b"["
+        for source, _, content in used:
+            with _open_source(source, content) as f:
+                for entry in iter_json_array(f):
+                    package_id = f"{entry.get('author')}@{entry.get('name')}"
+                    if package_id in seen:
+                        continue
+                    entry = _resolve_source_entry(entry, source["name"], source["url"])
+                    yield (b",\n" if seen else b"") + json.dumps(entry, ensure_ascii=False).encode("utf-8")
+                    seen.add(package_id)
+        yield b"]"
+
+    writeLog("INFO", f"Combinando el índice de {len(used)} fuentes...")
+    try:
+        write_file_atomic(cache_file, merged())
+        write_file_atomic(meta_file, json.dumps({"url": sources_key, "revision": revision, "fetchedAt": time.time()}))
+    except OSError as e:
+        writeLog("WARNING", f"No se pudo guardar el índice combinado en caché: {e}")
+        return revision, b"".join(merged())
+    return revision, None
+
+def _merged_root(used, roots):
+    """
+    Combina varias fuentes, alguna fragmentada, en una sola raíz fragmentada sin descargar ningún fragmento.
+    used: Lista de (fuente, revisión, contenido) por prioridad. roots: La raíz de cada una (None si es clásica).
+    Los paquetes de las fuentes fragmentadas apuntan a su fragmento con una URL absoluta y llevan en "base"
+    la URL de su fuente (ver _fetch_shard); los de las clásicas llevan la entrada entera en "entry".
+    """
+    import hashlib
+    from urllib.parse import urljoin
+    packages = {}
+    for (source, _, content), root in zip(used, roots):
+        if root is not None:
+            for package_id, info in root["packages"].items():
+                if package_id not in packages:
+                    packages[package_id] = dict(info, shard=urljoin(source["url"], info["shard"]),
+                                                base=source["url"], source=source["name"])
+            continue
+        with _open_source(source, content) as f:
+            for entry in iter_json_array(f):
+                package_id = f"{entry.get('author')}@{entry.get('name')}"
+                if package_id in packages:
+                    continue
+                entry = _resolve_source_entry(entry, source["name"], source["url"])
+                packages[package_id] = {
+                    "description": entry.get("description"),
+                    "latest": next((v.get("versionName") for v in entry.get("versions", []) if v.get("latest")), None),
+                    "hash": hashlib.sha256(json.dumps(entry, sort_keys=True).encode("utf-8")).hexdigest(),
+                    "entry": entry,
+                    "source": source["name"],
+                }
+    return {"format": SHARDED_INDEX_FORMAT, "version": SHARDED_INDEX_VERSION, "packages": packages}
+
+def revalidate_index():
+    """
+    Se asegura de que la copia local del índice esté al día y devuelve su revisión, sin parsearlo.
+    Dentro de una misma ejecución el índice se revalida una sola vez; en el daemon se
+    revalida cada CATALOG_MAX_AGE segundos.
+    """
+    global _index_revision, _index_checked_at, _index_body
+    with _index_lock:
+        now = time.time()
+        if _index_revision is not None and (CATALOG_MAX_AGE is None or now - _index_checked_at < CATALOG_MAX_AGE):
+            return _index_revision
+        revision, content = _download_index()
+        if content is not None:
+            _index_body = content
+        elif revision != _index_revision:
+            _index_body = None
+        _index_revision, _index_checked_at = revision, now
+
+    # Mantener el snapshot binario y el historial de diferencias al día con la revisión revalidada
+    if content is None:
+        get_snapshot(revision)
+    update_catalog_diff(revision)
+    return revision
+
+def iter_json_array(f, chunk_size=None):
+    """
+    Parsea de forma incremental un array JSON leído de un archivo binario y devuelve sus elementos uno a uno.
+    En memoria solo están el elemento actual y el bloque que se está leyendo, y se puede dejar
+    de iterar en cualquier momento sin leer el resto del archivo.
+    Lanza json.JSONDecodeError si el contenido no es un array JSON válido.
+    """
+    import re
+    import codecs
+    chunk_size = chunk_size or INDEX_CHUNK_SIZE
+    decode = json.JSONDecoder().raw_decode
+    whitespace = re.compile(r"[ \t\n\r]*")
+    text = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def read_more(size):
+        nonlocal buffer, pos, eof
+        data = f.read(size)
+        eof = not data
+        buffer = buffer[pos:] + text.decode(data, final=eof)
+        pos = 0
+
+    def next_char():
+        # Salta los espacios y devuelve el siguiente carácter ("" al final del archivo)
+        nonlocal pos
+        while True:
+            pos = whitespace.match(buffer, pos).end()
+            if pos < len(buffer) or eof:
+                return buffer[pos:pos + 1]
+            read_more(chunk_size)
+
+    if next_char() != "[":
+        raise json.JSONDecodeError("Se esperaba un array", buffer, pos)
+    pos += 1
+    if next_char() == "]":
+        return
+    while True:
+        # Parsear el siguiente elemento, leyendo más si está incompleto
+        # (los bloques crecen para que un elemento enorme no se reparsee demasiadas veces)
+        next_char()
+        while True:
             try:
-                with open(installed_file, 'r') as f:
-                    installed = json.load(f)
+                item, end = decode(buffer, pos)
+                if end < len(buffer) or eof:
+                    break
             except json.JSONDecodeError:
-                writeLog("ERROR", "El archivo installed.json está corrupto o malformado. Abortando instalación...")
-                raise Exception(f"Error: Ha ocurrido un error mientras se leía el registro.")
-            all_ids = [f"{p['author']}@{p['name']}" for p in installed['installed']]
-            changes = True  # Repetir para limpiar en cascada
+                if eof:
+                    raise
+            read_more(max(chunk_size, len(buffer) - pos))
+        pos = end
+        yield item
+
+        separator = next_char()
+        if separator == "]":
+            return
+        if separator != ",":
+            raise json.JSONDecodeError("Se esperaba ',' o ']'", buffer, pos)
+        pos += 1
 
-    if not removed_any:
-        print("No hay paquetes huérfanos para eliminar.")
-        writeLog("INFO", "No hay paquetes huérfanos para eliminar.")
+def _open_index():
+    """
+    Abre la copia local del índice (o el último índice descargado si no se pudo guardar) como archivo binario.
+    """
+    import io
+    body = _index_body
+    if body is not None:
+        return io.BytesIO(body)
+    return open(get_index_cache_paths()[0], 'rb')
 
-def register_package(manifest):
+def get_index_root():
+    """
+    Devuelve la raíz del índice si está fragmentado (ver SHARDED_INDEX_FORMAT), o None si es un
+    index.json clásico con todos los paquetes. Revalida el índice si hace falta.
+    """
+    global _index_root
+    revision = revalidate_index()
+    with _index_root_lock:
+        if _index_root is not None and _index_root[0] == revision:
+            return _index_root[1]
+        root = None
+        with _open_index() as f:
+            start = f.read(64).lstrip(b"\xef\xbb\xbf \t\r\n")
+            if start.startswith(b"{"):
+                f.seek(0)
+                root = json.loads(f.read())
+                if root.get("format") != SHARDED_INDEX_FORMAT or root.get("version") != SHARDED_INDEX_VERSION:
+                    writeLog("ERROR", "Formato de índice fragmentado no soportado")
+                    raise KMDError("Formato de índice fragmentado no soportado. Actualiza KMD")
+        _index_root = (revision, root)
+        return root
+
+def iter_index():
+    """
+    Devuelve las entradas del índice de una en una, leyéndolo en streaming de la caché
+    (o del último índice descargado si no se pudo guardar). Revalida el índice si hace falta.
+    Si el índice está fragmentado, las entradas salen de la raíz y solo incluyen la versión 'latest'
+    (sin URL ni hash): para las entradas completas, usar find_index_entries.
+    """
+    root = get_index_root()
+    if root is not None:
+        for package_id, info in root["packages"].items():
+            author, name = package_id.split("@", 1)
+            latest = info.get("latest")
+            yield {
+                "author": author,
+                "name": name,
+                "description": info.get("description"),
+                "versions": [{"versionName": latest, "latest": True}] if latest else [],
+            }
+        return
+    with _open_index() as f:
+        yield from iter_json_array(f)
+
+def _shard_url(info, base=None):
+    # Los fragmentos se resuelven respecto a la URL del índice; el hash evita copias viejas en cachés HTTP
+    from urllib.parse import urljoin
+    url = urljoin(base or INDEX_URL, info["shard"])
+    if url.startswith(("http://", "https://")):
+        url += ("&" if "?" in url else "?") + "h=" + info["hash"][:16]
+    return url
+
+def _fetch_shard(package_id, info, base=None):
+    """
+    Devuelve la entrada de un paquete desde su fragmento, descargándolo solo si no está en la caché.
+    Los fragmentos se guardan por hash, así que solo se vuelven a descargar los que cambian.
+    En un índice combinado (ver _merged_root), los paquetes de fuentes clásicas ya traen su entrada
+    y los demás se resuelven respecto a su fuente.
+    """
+    if "entry" in info:
+        return info["entry"]
+    entry = _load_shard(package_id, info, base)
+    return _resolve_source_entry(entry, info["source"], info["base"]) if "base" in info else entry
+
+def _load_shard(package_id, info, base=None):
+    import hashlib
+    expected = info["hash"]
+    cached = _shard_cache.get(expected)
+    if cached is not None:
+        METRICS.inc("kmd_cache_requests_total", cache="shard", result="hit")
+        return cached
+
+    path = os.path.join(CACHE_PATH, "shards", f"{expected}.json")
+    try:
+        with open(path, 'rb') as f:
+            content = f.read()
+    except OSError:
+        content = None
+    hit = content is not None and hashlib.sha256(content).hexdigest() == expected
+    METRICS.inc("kmd_cache_requests_total", cache="shard", result="hit" if hit else "miss")
+    if not hit:
+        r = get_http_session().get(_shard_url(info, base), timeout=30)
+        if r.status_code != 200:
+            writeLog("ERROR", f"No se pudo obtener el fragmento del índice de {package_id} (HTTP {r.status_code})")
+            raise KMDError(f"No se pudo obtener el fragmento del índice de {package_id}")
+        content = r.content
+        if hashlib.sha256(content).hexdigest() != expected:
+            writeLog("ERROR", f"El hash del fragmento del índice de {package_id} no coincide")
+            raise KMDError(f"El fragmento del índice de {package_id} está corrupto")
+        try:
+            write_file_atomic(path, content)
+        except OSError as e:
+            writeLog("WARNING", f"No se pudo guardar el fragmento de {package_id} en caché: {e}")
+
+    entry = json.loads(content)
+    _shard_cache[expected] = entry
+    return entry
+
+def fetch_shards(package_ids, root, base=None):
+    """
+    Obtiene las entradas completas de varios paquetes de un índice fragmentado, descargando
+    en paralelo los fragmentos que no están en la caché.
+    base: URL del índice fragmentado (por defecto, INDEX_URL).
+    Devuelve un diccionario {ID: entrada} con los paquetes que existen en la raíz.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    packages = root["packages"]
+    wanted = [package_id for package_id in dict.fromkeys(package_ids) if package_id in packages]
+    if len(wanted) <= 1:
+        return {package_id: _fetch_shard(package_id, packages[package_id], base) for package_id in wanted}
+    with ThreadPoolExecutor(max_workers=min(SHARD_FETCH_WORKERS, len(wanted))) as pool:
+        entries = pool.map(lambda package_id: _fetch_shard(package_id, packages[package_id], base), wanted)
+        return dict(zip(wanted, entries))
+
+def get_catalog():
+    """
+    Devuelve el catálogo de paquetes, cargándolo si hace falta.
+    El índice solo se vuelve a parsear si su revisión cambió. Si el índice está fragmentado,
+    se descargan todos los fragmentos: para buscar pocos paquetes, usar find_index_entries.
+    """
+    global _catalog
+    revision = revalidate_index()
+    with _catalog_lock:
+        if _catalog is None or _catalog.revision != revision:
+            root = get_index_root()
+            if root is not None:
+                _catalog = Catalog(fetch_shards(root["packages"], root).values(), revision)
+            else:
+                _catalog = Catalog(iter_index(), revision)
+        return _catalog
+
+def get_snapshot(revision):
+    """
+    Devuelve el snapshot binario (CatalogSnapshot) de la revisión indicada del índice, construyéndolo
+    a partir de la caché si no existe o es de otra revisión.
+    Devuelve None si no se puede usar (si el índice no se pudo guardar en caché o está fragmentado).
+    """
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is not None and _snapshot.revision == revision:
+            return _snapshot
+        # El snapshot anterior no se cierra: puede estar en uso en otro hilo (se libera al dejar de usarse)
+        _snapshot = None
+        if _index_body is not None or revision != _index_revision or get_index_root() is not None:
+            return None
+
+        path = os.path.join(CACHE_PATH, "index.snapshot")
+        snapshot = CatalogSnapshot.open(path, revision)
+        if snapshot is None:
+            writeLog("INFO", f"Construyendo el snapshot del índice (revisión {revision})")
+            try:
+                CatalogSnapshot.build(path, iter_index(), revision)
+            except (OSError, ValueError, KeyError) as e:
+                writeLog("WARNING", f"No se pudo construir el snapshot del índice: {e}")
+                return None
+            snapshot = CatalogSnapshot.open(path, revision)
+        _snapshot = snapshot
+        return snapshot
+
+def find_index_entries(package_ids):
+    """
+    Busca varias entradas del índice por ID.
+    Si el índice está fragmentado, solo se descargan los fragmentos de esos paquetes (si no están en caché).
+    Si el catálogo de la revisión actual ya está en memoria (p. ej. en el daemon) se usa; si no,
+    se buscan en el snapshot binario y, si tampoco está disponible, el índice se lee en streaming
+    y se deja de leer en cuanto aparecen todas.
+    Devuelve un diccionario {ID: entrada} con las que se encontraron.
+    """
+    revision = revalidate_index()
+    root = get_index_root()
+    if root is not None:
+        return fetch_shards(package_ids, root)
+    catalog = _catalog
+    if catalog is not None and catalog.revision == revision:
+        return {package_id: catalog.get(package_id) for package_id in package_ids if package_id in catalog}
+    snapshot = get_snapshot(revision)
+    if snapshot is not None:
+        found = {}
+        for package_id in package_ids:
+            entry = snapshot.get(package_id)
+            if entry is not None:
+                found[package_id] = entry
+        return found
+
+    wanted = set(package_ids)
+    found = {}
+    for p in iter_index():
+        package_id = f"{p['author']}@{p['name']}"
+        if package_id in wanted:
+            found[package_id] = p
+            if len(found) == len(wanted):
+                break
+    return found
+
+def get_latest_versions(package_ids):
+    """
+    Devuelve {ID: última versión (None si no tiene versión 'latest')} de los paquetes que están en el índice.
+    Si el índice está fragmentado solo se consulta la raíz, sin descargar ningún fragmento.
+    """
+    root = get_index_root()
+    if root is not None:
+        packages = root["packages"]
+        return {package_id: packages[package_id].get("latest") for package_id in package_ids if package_id in packages}
+    return {
+        package_id: next((v.get('versionName') for v in entry['versions'] if v.get('latest')), None)
+        for package_id, entry in find_index_entries(package_ids).items()
+    }
+
+def get_catalog_diff_paths():
+    """
+    Devuelve las rutas de (copia del snapshot y de la raíz del índice en la última revisión vista,
+    historial de diferencias entre revisiones, últimas versiones consultadas de los paquetes instalados).
+    """
+    return (os.path.join(CACHE_PATH, "catalog-base.snapshot"), os.path.join(CACHE_PATH, "catalog-base.json"),
+            os.path.join(CACHE_PATH, "catalog-diff.json"), os.path.join(CACHE_PATH, "latest-versions.json"))
+
+def catalog_diff_lock():
+    """
+    Devuelve el lock (entre procesos) que protege la copia de la última revisión vista y el historial
+    de diferencias (ver update_catalog_diff). Está en CACHE_PATH, como metrics_lock.
+    """
+    return _get_lock("catalog-diff.lock", REGISTRY_LOCK_TIMEOUT, "catalog-diff.json", CACHE_PATH)
+
+def _read_cache_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def _entry_versions(entry):
+    """
+    Devuelve (versión latest, nombres de todas las versiones) de una entrada del índice.
+    """
+    versions = entry.get("versions", [])
+    return next((v.get("versionName") for v in versions if v.get("latest")), None), [v.get("versionName") for v in versions]
+
+def _diff_package(diff, package_id, old, new):
+    """
+    Añade a diff los cambios de versiones de un paquete que está en las dos revisiones.
+    old / new: (versión latest, nombres de las versiones, o None si no se conocen).
+    """
+    (old_latest, old_names), (new_latest, new_names) = old, new
+    if old_latest != new_latest:
+        diff.latest_changed[package_id] = [old_latest, new_latest]
+    if old_names is None or new_names is None:
+        return
+    added = [v for v in new_names if v not in old_names]
+    removed = [v for v in old_names if v not in new_names]
+    if added:
+        diff.new_versions[package_id] = added
+    if removed:
+        diff.removed_versions[package_id] = removed
+
+def diff_snapshots(old, new):
+    """
+    Compara dos snapshots del índice (ver CatalogSnapshot) recorriendo a la vez sus tablas de IDs, que
+    están ordenadas: no se carga ninguno en memoria y solo se decodifican los registros que cambiaron.
+    Devuelve un CatalogDiff.
+    """
+    diff = CatalogDiff(old.revision, new.revision, time.time())
+    old_items, new_items = old.items(), new.items()
+    old_item, new_item = next(old_items, None), next(new_items, None)
+    while old_item is not None or new_item is not None:
+        if new_item is None or (old_item is not None and old_item[0] < new_item[0]):
+            diff.removed.append(old_item[0])
+            old_item = next(old_items, None)
+        elif old_item is None or new_item[0] < old_item[0]:
+            diff.added.append(new_item[0])
+            new_item = next(new_items, None)
+        else:
+            if old_item[1] != new_item[1]:
+                _diff_package(diff, new_item[0], _entry_versions(json.loads(old_item[1])), _entry_versions(json.loads(new_item[1])))
+            old_item, new_item = next(old_items, None), next(new_items, None)
+    return diff
+
+def _cached_shard_entry(info):
+    """
+    Devuelve la entrada de un paquete de un índice fragmentado si ya está en la caché (sin descargar nada), o None.
+    """
+    if "entry" in info:
+        return info["entry"]
+    try:
+        with open(os.path.join(CACHE_PATH, "shards", f"{info['hash']}.json"), 'rb') as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+def diff_roots(old, new, from_revision, to_revision):
+    """
+    Compara las raíces de dos revisiones de un índice fragmentado sin descargar fragmentos: los paquetes
+    cuyo fragmento tiene el mismo hash no cambiaron, y de los demás solo se comparan todas las versiones
+    si los dos fragmentos ya están en la caché (si no, solo la versión latest).
+    Devuelve un CatalogDiff.
+    """
+    old, new = old["packages"], new["packages"]
+    diff = CatalogDiff(from_revision, to_revision, time.time())
+    diff.added = sorted(new.keys() - old.keys())
+    diff.removed = sorted(old.keys() - new.keys())
+    for package_id in sorted(old.keys() & new.keys()):
+        old_info, new_info = old[package_id], new[package_id]
+        if old_info.get("hash") == new_info.get("hash"):
+            continue
+        old_entry, new_entry = _cached_shard_entry(old_info), _cached_shard_entry(new_info)
+        if old_entry is not None and new_entry is not None:
+            _diff_package(diff, package_id, _entry_versions(old_entry), _entry_versions(new_entry))
+        else:
+            _diff_package(diff, package_id, (old_info.get("latest"), None), (new_info.get("latest"), None))
+    return diff
+
+def read_catalog_diffs():
+    """
+    Devuelve el historial de diferencias del índice (lista de CatalogDiff, de la más antigua a la más reciente).
+    """
+    history = _read_cache_json(get_catalog_diff_paths()[2]).get("history") or []
+    diffs = []
+    for data in history:
+        try:
+            diffs.append(CatalogDiff(**data))
+        except TypeError:
+            continue
+    return diffs
+
+def _keep_base(src, dst, other):
+    """
+    Guarda src (el snapshot o la raíz de la revisión actual) como la copia de la última revisión vista:
+    un enlace duro si se puede, porque src siempre se reemplaza entero (ver write_file_atomic) y no se modifica.
+    other: La copia del otro tipo de índice, que se borra.
+    """
+    tmp_path = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    _link_or_copy(src, tmp_path)
+    os.replace(tmp_path, dst)
+    try:
+        os.remove(other)
+    except FileNotFoundError:
+        pass
+
+def update_catalog_diff(revision):
+    """
+    Si la revisión del índice cambió desde la última que se vio (en este u otro proceso), la compara con la
+    anterior y añade la diferencia al historial (como mucho CATALOG_DIFF_HISTORY).
+    La revisión anterior se guarda como una copia de su snapshot binario (ver diff_snapshots) o, si el índice
+    está fragmentado, de su raíz (ver diff_roots), así que comparar no carga el índice entero en memoria.
+    Si algo falla, se avisa en el log y no se interrumpe el comando.
+    """
+    global _catalog_diff_revision
+    if _catalog_diff_revision == revision:
+        return
+    with _catalog_diff_lock:
+        if _catalog_diff_revision == revision:
+            return
+        # Se marca antes de leer el índice: leerlo vuelve a pasar por revalidate_index
+        _catalog_diff_revision = revision
+        base_snapshot, base_root, diff_path, _ = get_catalog_diff_paths()
+        if _read_cache_json(diff_path).get("revision") == revision:
+            return
+        try:
+            with catalog_diff_lock():
+                state = _read_cache_json(diff_path)
+                if state.get("revision") == revision:
+                    return
+                diff = None
+                root = get_index_root()
+                if root is not None:
+                    if _index_body is not None:
+                        writeLog("WARNING", "El índice no está en caché: no se puede guardar su revisión para compararla")
+                        return
+                    previous = _read_cache_json(base_root)
+                    if previous.get("packages") and state.get("revision") and state["revision"] != revision:
+                        diff = diff_roots(previous, root, state["revision"], revision)
+                    _keep_base(get_index_cache_paths()[0], base_root, base_snapshot)
+                else:
+                    snapshot = get_snapshot(revision)
+                    if snapshot is None:
+                        writeLog("WARNING", "No hay snapshot del índice: no se puede guardar su revisión para compararla")
+                        return
+                    previous = CatalogSnapshot.open(base_snapshot)
+                    if previous is not None:
+                        try:
+                            if previous.revision != revision:
+                                diff = diff_snapshots(previous, snapshot)
+                        finally:
+                            previous.close()
+                    _keep_base(os.path.join(CACHE_PATH, "index.snapshot"), base_snapshot, base_root)
+
+                history = state.get("history") or []
+                if diff is not None:
+                    history = (history + [diff.to_dict()])[-CATALOG_DIFF_HISTORY:]
+                    writeLog("INFO", f"El índice cambió ({diff.from_revision} -> {revision}): {len(diff.added)} paquetes nuevos, "
+                                     f"{len(diff.latest_changed)} con otra versión latest, {len(diff.removed)} retirados")
+                write_file_atomic(diff_path, json.dumps({"revision": revision, "history": history}))
+        except (OSError, ValueError, KeyError, KMDError) as e:
+            writeLog("WARNING", f"No se pudo actualizar el historial de cambios del índice: {e}")
+
+def _affected_since(from_revision, to_revision):
+    """
+    Devuelve los IDs de los paquetes cuya versión latest pudo cambiar entre dos revisiones del índice
+    según el historial de diferencias, o None si el historial no cubre ese tramo.
+    """
+    if from_revision == to_revision:
+        return set()
+    diffs = read_catalog_diffs()
+    starts = [i for i, diff in enumerate(diffs) if diff.from_revision == from_revision]
+    if not from_revision or not starts:
+        return None
+    affected = set()
+    current = from_revision
+    for diff in diffs[starts[-1]:]:
+        if diff.from_revision != current:
+            return None
+        affected |= diff.affected()
+        current = diff.to_revision
+    return affected if current == to_revision else None
+
+def installed_latest_versions(package_ids):
+    """
+    Como get_latest_versions, pero reutiliza lo consultado en la revisión anterior del índice: solo se
+    vuelven a buscar los paquetes a los que afecta el historial de diferencias (ver update_catalog_diff)
+    y los que no se habían consultado. Si el historial no llega hasta esa revisión, se consultan todos.
+    """
+    revision = revalidate_index()
+    path = get_catalog_diff_paths()[3]
+    saved = _read_cache_json(path)
+    package_ids = list(package_ids)
+    affected = _affected_since(saved.get("revision"), revision)
+    known = (saved.get("latest") or {}) if affected is not None else {}
+    missing = set(saved.get("missing") or []) if affected is not None else set()
+    lookup = [p for p in package_ids if affected is None or p in affected or (p not in known and p not in missing)]
+    found = get_latest_versions(lookup) if lookup else {}
+    METRICS.inc("kmd_cache_requests_total", len(package_ids) - len(lookup), cache="latest", result="hit")
+    METRICS.inc("kmd_cache_requests_total", len(lookup), cache="latest", result="miss")
+    writeLog("INFO", f"Versiones latest: {len(lookup)} de {len(package_ids)} paquetes consultados en el índice")
+
+    lookup_set = set(lookup)
+    latest = {p: v for p, v in known.items() if p not in lookup_set}
+    latest.update(found)
+    missing = (missing - lookup_set) | (lookup_set - found.keys())
+    try:
+        write_file_atomic(path, json.dumps({"revision": revision, "latest": latest, "missing": sorted(missing)}))
+    except OSError as e:
+        writeLog("WARNING", f"No se pudieron guardar las versiones latest consultadas: {e}")
+    return {p: latest[p] for p in package_ids if p in latest}
+
+def find_index_entry(package_id):
+    """
+    Devuelve la entrada del índice para un ID, o None si no existe (ver find_index_entries).
+    """
+    return find_index_entries([package_id]).get(package_id)
+
+def get_search_index():
+    """
+    Devuelve el índice de búsqueda de la revisión actual del índice.
+    Se carga desde la caché (search-index.bin) o, si no existe o es de otra revisión,
+    se construye a partir del catálogo y se guarda.
+    """
+    global _search_index
+    revision = revalidate_index()
+    with _search_lock:
+        if _search_index is not None and _search_index.revision == revision:
+            return _search_index
+        path = os.path.join(CACHE_PATH, "search-index.bin")
+        index = SearchIndex.load(path, revision)
+        if index is None:
+            writeLog("INFO", f"Construyendo el índice de búsqueda (revisión {revision})")
+            index = SearchIndex.build(iter_index(), revision)
+            try:
+                index.save(path)
+            except OSError as e:
+                writeLog("WARNING", f"No se pudo guardar el índice de búsqueda: {e}")
+        _search_index = index
+        return index
+
+def get_index():
+    """
+    Obtiene el índice de paquetes desde GitHub (o desde la caché si no ha cambiado).
+    Devuelve la lista de paquetes del catálogo (CatalogEntry, ver to_dict para pasarlos a JSON).
+    Si no se puede obtener, lanza una excepción.
+    """
+    return get_catalog().packages
+
+def get_registry_file():
+    """
+    Devuelve la ruta del registro de paquetes instalados (installed.json).
+    """
+    return os.path.join(INSTALL_PATH, 'installed.json')
+
+def load_registry(fresh=False):
+    """
+    Lee el registro de paquetes instalados.
+    Las lecturas se cachean mientras el archivo no cambie (mismo tamaño y fecha de modificación).
+    fresh: Si es True, devuelve una copia nueva que se puede modificar (para luego guardarla con save_registry).
+    Devuelve el diccionario del registro, o None si no existe.
+    Lanza json.JSONDecodeError si el archivo está corrupto.
+    """
+    global _registry_cache
+    installed_file = get_registry_file()
+    try:
+        st = os.stat(installed_file)
+    except OSError:
+        return None
+    signature = (installed_file, st.st_mtime_ns, st.st_size)
+    if not fresh and _registry_cache is not None and _registry_cache[0] == signature:
+        return _registry_cache[1]
+    with open(installed_file, 'r') as f:
+        data = json.load(f)
+    if not fresh:
+        _registry_cache = (signature, data)
+    return data
+
+def save_registry(data):
+    """
+    Guarda el registro de paquetes instalados de forma atómica.
+    """
+    global _registry_cache
+    write_file_atomic(get_registry_file(), json.dumps(data, indent=4))
+    _registry_cache = None
+
+def record_operation(operation):
+    """
+    Decorador que mide en METRICS una operación sobre un paquete (cuyo primer argumento es su ID):
+    su duración, su resultado y, si falla, un fallo más de ese paquete.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(package_id, *args, **kwargs):
+            start = time.monotonic()
+            result = "error"
+            try:
+                value = func(package_id, *args, **kwargs)
+                result = "ok"
+                return value
+            finally:
+                METRICS.observe("kmd_operation_duration_seconds", time.monotonic() - start, operation=operation)
+                METRICS.inc("kmd_operations_total", operation=operation, result=result)
+                if result == "error":
+                    METRICS.inc("kmd_package_failures_total", operation=operation, package=package_id)
+        return wrapper
+    return decorator
+
+def with_package_lock(func):
+    """
+    Decorador que ejecuta una operación (cuyo primer argumento es el ID del paquete)
+    mientras tiene el lock de ese paquete.
+    """
+    @functools.wraps(func)
+    def wrapper(package_id, *args, **kwargs):
+        with package_lock(package_id):
+            return func(package_id, *args, **kwargs)
+    return wrapper
+
+# -- Locks --
+# Varios procesos de KMD pueden correr a la vez (p. ej. un update-all programado y un install manual).
+# Cada paquete tiene su propio lock y el registro tiene uno global que solo se toma durante el
+# ciclo leer-modificar-escribir de installed.json. Los locks son archivos en INSTALL_PATH/.locks
+# bloqueados con el mecanismo del sistema (ver Platform.try_lock_file), así que el sistema los
+# libera solo si el proceso muere.
+REGISTRY_LOCK_TIMEOUT = 60 # Segundos máximos de espera por el lock del registro
+LOCK_POLL_INTERVAL = 0.05 # Espera inicial entre intentos (se duplica hasta 0.5 s)
+
+_locks = {} # Locks creados en este proceso, por ruta
+_locks_guard = threading.Lock()
+
+class FileLock:
+    """
+    Lock exclusivo entre procesos basado en un archivo, reentrante dentro del proceso.
+    path: Ruta del archivo de lock.
+    timeout: Segundos máximos de espera (None = esperar indefinidamente).
+    Lanza LockTimeoutError si no se consigue a tiempo.
+    """
+    def __init__(self, path, timeout=None, description=None):
+        self.path = path
+        self.timeout = timeout
+        self.description = description or os.path.basename(path)
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        if not self._thread_lock.acquire(timeout=-1 if self.timeout is None else self.timeout):
+            raise LockTimeoutError(f"Tiempo de espera agotado esperando el lock de {self.description}")
+        try:
+            if self._depth == 0:
+                self._acquire_file(deadline)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        self._depth += 1
+        return self
+
+    def _acquire_file(self, deadline):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        delay = LOCK_POLL_INTERVAL
+        waited = False
+        while not PLATFORM.try_lock_file(fd):
+            if deadline is not None and time.monotonic() >= deadline:
+                os.close(fd)
+                writeLog("ERROR", f"Tiempo de espera agotado esperando el lock de {self.description}")
+                raise LockTimeoutError(f"Tiempo de espera agotado esperando el lock de {self.description} (otro proceso de KMD lo está usando)")
+            if not waited:
+                writeLog("INFO", f"Esperando a que otro proceso de KMD libere el lock de {self.description}...")
+                waited = True
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        self._fd = fd
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            PLATFORM.unlock_file(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+def get_lock_dir():
+    """
+    Devuelve la carpeta donde se guardan los archivos de lock de la ruta de instalación activa.
+    """
+    return os.path.join(INSTALL_PATH, ".locks")
+
+def _get_lock(name, timeout, description, folder=None):
+    path = os.path.join(folder or get_lock_dir(), name)
+    with _locks_guard:
+        lock = _locks.get(path)
+        if lock is None:
+            lock = _locks[path] = FileLock(path, timeout, description)
+        lock.timeout = timeout
+        return lock
+
+def package_lock(package_id):
+    """
+    Devuelve el lock (entre procesos) que serializa las operaciones sobre un mismo paquete.
+    Es reentrante dentro de un mismo hilo, así que una operación puede volver a tomarlo (p. ej. update
+    y rollback, que activan una versión con el lock ya tomado). Las dependencias se instalan en otros hilos, así que no lo heredan
+    (ver install_dependencies).
+    Operaciones sobre paquetes distintos pueden correr a la vez.
+    """
+    safe_name = "".join(c if c.isalnum() or c in "@-_." else "_" for c in package_id)
+    return _get_lock(f"pkg-{safe_name}.lock", LOCK_TIMEOUT, package_id)
+
+def registry_lock():
+    """
+    Devuelve el lock (entre procesos) que protege los ciclos leer-modificar-escribir de installed.json.
+    """
+    return _get_lock("registry.lock", REGISTRY_LOCK_TIMEOUT, "installed.json")
+
+def metrics_lock():
+    """
+    Devuelve el lock (entre procesos) que protege el ciclo leer-sumar-escribir de las métricas (ver flush_metrics).
+    Está en CACHE_PATH, junto a las métricas, para que los comandos de consulta no creen la ruta de instalación.
+    """
+    return _get_lock("metrics.lock", REGISTRY_LOCK_TIMEOUT, "metrics.json", CACHE_PATH)
+
+# -- Almacén de archivos --
+# Los archivos de los paquetes se guardan una sola vez por contenido en INSTALL_PATH/.kmd-store
+# (objects/<2 primeros caracteres del SHA-256>/<SHA-256>) y se enlazan con enlaces duros en la carpeta
+# de cada paquete. El número de enlaces del propio objeto hace de contador de referencias:
+# borrar la carpeta de un paquete (shutil.rmtree) lo decrementa y un objeto con un solo enlace
+# (el del almacén) ya no lo usa nadie y se puede borrar.
+# Si el sistema de archivos no admite enlaces duros, los archivos se copian.
+# Los objetos son de solo lectura: un archivo enlazado es el mismo para todos los paquetes que lo
+# comparten, así que los scripts de los paquetes no deben modificar sus archivos en el sitio sino
+# reemplazarlos. Como eso no protege de todo (root ignora los permisos), antes de enlazar un objeto
+# que ya estaba se comprueba su contenido y, si cambió, se vuelve a escribir.
+STORE_FOLDER = ".kmd-store" # Dentro de INSTALL_PATH: tiene que estar en el mismo disco para poder enlazar
+STORE_BUFFER = 1024 * 1024 # Los archivos más pequeños se hashean en memoria; los demás pasan por un temporal
+REMOVE_BATCH_SIZE = 256 # Archivos por lote al borrar un paquete (los lotes se borran en paralelo)
+ACTIVE_LINK = "current" # Enlace (symlink o unión) a la versión activa dentro de la carpeta de cada paquete
+ACTIVE_FILE = "active" # Archivo con el nombre de la carpeta de la versión activa
+
+def get_store_path():
+    """
+    Devuelve la carpeta del almacén de archivos.
+    """
+    return os.path.join(INSTALL_PATH, STORE_FOLDER)
+
+def _store_object_path(digest):
+    return os.path.join(get_store_path(), "objects", digest[:2], digest)
+
+def _member_path(dest_path, filename):
+    """
+    Devuelve la ruta de un archivo del ZIP dentro de dest_path, descartando unidades, rutas absolutas
+    y componentes '..' (igual que ZipFile.extractall). Devuelve None si no queda nada.
+    """
+    name = filename.replace("/", os.sep)
+    if os.altsep:
+        name = name.replace(os.altsep, os.sep)
+    parts = [p for p in os.path.splitdrive(name)[1].split(os.sep) if p not in ("", ".", "..")]
+    return os.path.join(dest_path, *parts) if parts else None
+
+def _new_store_tmp():
+    """
+    Crea un temporal dentro del almacén (en el mismo disco que los objetos, para poder moverlo).
+    Devuelve (descriptor, ruta).
+    """
+    import tempfile
+    tmp_folder = os.path.join(get_store_path(), "tmp")
+    os.makedirs(tmp_folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_folder)
+    os.chmod(tmp_path, 0o644) # mkstemp lo crea solo para el usuario: los archivos instalados los lee cualquiera
+    return fd, tmp_path
+
+def _store_tmp_with(data):
+    """
+    Escribe data en un temporal del almacén (ver _new_store_tmp). Devuelve su ruta.
+    """
+    fd, tmp_path = _new_store_tmp()
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(data)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+def _seal_store_object(path):
+    """
+    Quita los permisos de escritura a un objeto del almacén (y con ellos a todos sus enlaces), para que
+    editar en el sitio el archivo de un paquete no cambie el de los demás paquetes que lo comparten.
+    """
+    import stat
+    writable = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+    mode = stat.S_IMODE(os.stat(path).st_mode)
+    if mode & writable:
+        os.chmod(path, mode & ~writable)
+
+def _write_store_object(object_path, tmp_path):
+    """
+    Mueve un temporal ya escrito (ver _new_store_tmp) al almacén como el objeto object_path, de solo lectura.
+    Si el objeto ya existía se reemplaza de forma atómica: los paquetes que lo enlazaban conservan el anterior.
+    """
+    _seal_store_object(tmp_path)
+    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+    try:
+        os.replace(tmp_path, object_path)
+    except PermissionError:
+        # Windows no reemplaza archivos de solo lectura
+        PLATFORM.remove_file(object_path)
+        os.replace(tmp_path, object_path)
+
+def _store_object_matches(object_path, digest, size):
+    """
+    Indica si un objeto del almacén sigue teniendo el tamaño y el hash SHA-256 con el que se guardó.
+    """
+    try:
+        return os.path.getsize(object_path) == size and hash_file(object_path) == digest
+    except FileNotFoundError:
+        return False
+
+def remove_tree(folder):
+    """
+    Borra una carpeta entera ignorando los errores, incluidos sus archivos de solo lectura (ver Platform.remove_file).
+    """
+    import shutil
+
+    def remove_read_only(func, path, _):
+        if func in (os.remove, os.unlink):
+            try:
+                PLATFORM.remove_file(path)
+            except OSError:
+                pass
+    shutil.rmtree(folder, onerror=remove_read_only)
+
+def _link_or_copy(src, dst):
+    """
+    Crea dst como enlace duro de src. Si el sistema de archivos no lo permite, copia el archivo.
+    Devuelve True si se enlazó. Lanza FileNotFoundError si src ya no existe.
+    """
+    import shutil
+    try:
+        os.link(src, dst)
+        return True
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(src, dst)
+        return False
+
+def store_member(zip_ref, member, dest, local_digest="none", fresh=False):
+    """
+    Extrae un archivo de un ZIP en dest a través del almacén: si su contenido ya está en el almacén
+    (y el objeto no cambió desde que se guardó) solo se enlaza; si no, se añade y después se enlaza.
+    local_digest: Huella rápida que se calcula además en la misma pasada ("none" para ninguna, ver LOCAL_DIGESTS).
+    fresh: Escribe el objeto de nuevo aunque ya esté en el almacén (lo usa repair).
+    Devuelve (hash SHA-256, ya estaba en el almacén, enlazado, huella rápida o None).
+    """
+    digest = new_hasher()
+    local = new_hasher(local_digest) if local_digest != "none" else None
+    data = None
+    tmp_path = None
+    try:
+        with zip_ref.open(member) as src:
+            if member.file_size <= STORE_BUFFER:
+                data = src.read()
+                digest.update(data)
+                if local:
+                    local.update(data)
+            else:
+                fd, tmp_path = _new_store_tmp()
+                with os.fdopen(fd, "wb") as tmp:
+                    for chunk in iter(lambda: src.read(HASH_BUFFER), b""):
+                        digest.update(chunk)
+                        if local:
+                            local.update(chunk)
+                        tmp.write(chunk)
+        digest = digest.hexdigest()
+        local = local.hexdigest() if local else None
+
+        object_path = _store_object_path(digest)
+        existed = os.path.exists(object_path)
+        if existed and not fresh and not _store_object_matches(object_path, digest, member.file_size):
+            writeLog("WARNING", f"El objeto {digest} del almacén cambió (se editó un archivo enlazado). Se vuelve a escribir")
+            existed = False
+        if existed and not fresh:
+            try:
+                _seal_store_object(object_path) # Los objetos de versiones anteriores de KMD no eran de solo lectura
+            except FileNotFoundError:
+                pass # Lo liberó otro proceso: se vuelve a añadir al enlazarlo
+        else:
+            existed = False
+            if tmp_path is None:
+                tmp_path = _store_tmp_with(data)
+            _write_store_object(object_path, tmp_path)
+            tmp_path = None
+
+        # Nunca se escribe sobre el archivo anterior: podría ser un enlace compartido con otro paquete
+        try:
+            PLATFORM.remove_file(dest)
+        except FileNotFoundError:
+            pass
+        try:
+            linked = _link_or_copy(object_path, dest)
+        except FileNotFoundError:
+            # Otro proceso liberó el objeto entre medias: se vuelve a añadir
+            if data is None:
+                with zip_ref.open(member) as src:
+                    data = src.read()
+            _write_store_object(object_path, _store_tmp_with(data))
+            linked = _link_or_copy(object_path, dest)
+        return digest, existed, linked, local
+    finally:
+        if tmp_path is not None:
+            PLATFORM.remove_file(tmp_path)
+
+def release_store_objects(digests):
+    """
+    Borra del almacén los objetos que ya no usa ningún paquete (los que solo tienen el enlace del almacén).
+    digests: Hashes de los objetos a revisar (p. ej. los de un paquete recién desinstalado).
+    Devuelve (objetos borrados, bytes liberados).
+    """
+    removed = freed = 0
+    for digest in digests:
+        path = _store_object_path(digest)
+        try:
+            st = os.stat(path)
+            if st.st_nlink > 1:
+                continue
+            PLATFORM.remove_file(path)
+        except OSError:
+            continue
+        removed += 1
+        freed += st.st_size
+    return removed, freed
+
+def iter_store_objects():
+    """
+    Recorre el almacén. Genera (hash, tamaño, paquetes que lo usan).
+    """
+    objects = os.path.join(get_store_path(), "objects")
+    if not os.path.isdir(objects):
+        return
+    for bucket in os.scandir(objects):
+        if not bucket.is_dir():
+            continue
+        for entry in os.scandir(bucket.path):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            yield entry.name, st.st_size, st.st_nlink - 1
+
+# -- Errores --
+class KMDError(Exception):
+    """
+    Error base de KMD. Todas las funciones de la API lanzan subclases de este error.
+    """
+
+class InvalidPackageIdError(KMDError):
+    """El ID del paquete no tiene el formato 'Autor@Nombre'."""
+
+class PackageNotFoundError(KMDError):
+    """El paquete no existe en el índice."""
+
+class VersionNotFoundError(KMDError):
+    """La versión pedida (o la versión 'latest') no existe en el índice."""
+
+class HashMismatchError(KMDError):
+    """El hash del paquete descargado no coincide con el del índice."""
+
+class ManifestError(KMDError):
+    """El manifest.json del paquete falta, está corrupto o no coincide con el índice."""
+
+class RegistryError(KMDError):
+    """El registro de paquetes instalados (installed.json) está corrupto o malformado."""
+
+class DependencyError(KMDError):
+    """No se pudo instalar una dependencia."""
+
+class NotInstalledError(KMDError):
+    """El paquete no está instalado."""
+
+class HasDependentsError(KMDError):
+    """Otros paquetes instalados dependen del paquete y la política indicó no continuar."""
+    def __init__(self, package_id, dependents):
+        super().__init__(f"Otros paquetes dependen de {package_id}: {', '.join(dependents)}")
+        self.package_id = package_id
+        self.dependents = dependents
+
+class LockTimeoutError(KMDError):
+    """Otro proceso de KMD tiene el lock de un paquete o del registro y no lo liberó a tiempo."""
+
+class ScriptError(KMDError):
+    """Un script de un paquete falló o superó el tiempo máximo (con scriptErrors = "abort")."""
+
+class PermissionDeniedError(KMDError, PermissionError):
+    """KMD no tiene permisos de escritura sobre la ruta de instalación."""
+
+# -- Resultados --
+class Record:
+    """
+    Base de los resultados que devuelve la API. Las subclases declaran sus campos en __slots__.
+    """
+    __slots__ = ()
+
+    def to_dict(self):
+        """
+        Devuelve el resultado como un diccionario (p. ej. para serializarlo a JSON).
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+class PackageSummary(Record):
+    """Un paquete del índice."""
+    __slots__ = ("id", "author", "name", "description", "latest")
+
+    def __init__(self, id, author, name, description, latest):
+        self.id = id
+        self.author = author
+        self.name = name
+        self.description = description
+        self.latest = latest
+
+class VersionInfo(Record):
+    """Una versión de un paquete del índice."""
+    __slots__ = ("name", "latest", "download_url", "hash")
+
+    def __init__(self, name, latest, download_url, hash):
+        self.name = name
+        self.latest = latest
+        self.download_url = download_url
+        self.hash = hash
+
+class InstalledPackage(Record):
+    """
+    Un paquete del registro de paquetes instalados.
+    script_durations: Segundos que tardó cada script al instalarse (p. ej. {"postInstall": 1.2}).
+    versions: Todas las versiones instaladas en paralelo (la activa es version).
+    """
+    __slots__ = ("id", "author", "name", "version", "description", "dependencies", "dependents", "script_durations", "versions")
+
+    def __init__(self, id, author, name, version, description, dependencies, dependents, script_durations=None, versions=None):
+        self.id = id
+        self.author = author
+        self.name = name
+        self.version = version
+        self.description = description
+        self.dependencies = dependencies
+        self.dependents = dependents
+        self.script_durations = script_durations or {}
+        self.versions = versions or [version]
+
+class ScriptResult(Record):
+    """
+    Resultado de ejecutar un script de un paquete.
+    exit_code: Código de salida (None si no llegó a ejecutarse).
+    duration: Segundos que tardó.
+    """
+    __slots__ = ("script", "exit_code", "duration", "timed_out")
+
+    def __init__(self, script, exit_code, duration, timed_out=False):
+        self.script = script
+        self.exit_code = exit_code
+        self.duration = duration
+        self.timed_out = timed_out
+
+    @property
+    def ok(self):
+        return self.exit_code == 0 and not self.timed_out
+
+class InstallResult(Record):
+    """
+    Resultado de install().
+    status: "installed", "switched" (se activó una versión que ya estaba instalada) o "already-installed".
+    dependencies: Resultados de las dependencias que se instalaron.
+    """
+    __slots__ = ("id", "version", "path", "status", "dependencies")
+
+    def __init__(self, id, version, path, status, dependencies=None):
+        self.id = id
+        self.version = version
+        self.path = path
+        self.status = status
+        self.dependencies = dependencies or []
+
+class UninstallResult(Record):
+    """Resultado de uninstall()."""
+    __slots__ = ("id", "version", "status")
+
+    def __init__(self, id, version, status="uninstalled"):
+        self.id = id
+        self.version = version
+        self.status = status
+
+class UpdateResult(Record):
+    """
+    Resultado de update() y de cada paquete en update_all().
+    status: "updated", "installed", "up-to-date", "skipped" o "failed".
+    """
+    __slots__ = ("id", "from_version", "to_version", "status", "error")
+
+    def __init__(self, id, from_version, to_version, status, error=None):
+        self.id = id
+        self.from_version = from_version
+        self.to_version = to_version
+        self.status = status
+        self.error = error
+
+class OutdatedPackage(Record):
+    """Un paquete instalado que tiene una versión más reciente en el índice."""
+    __slots__ = ("id", "current_version", "latest_version")
+
+    def __init__(self, id, current_version, latest_version):
+        self.id = id
+        self.current_version = current_version
+        self.latest_version = latest_version
+
+class CollectedVersion(Record):
+    """Una versión inactiva borrada por gc()."""
+    __slots__ = ("id", "version", "freed_bytes")
+
+    def __init__(self, id, version, freed_bytes):
+        self.id = id
+        self.version = version
+        self.freed_bytes = freed_bytes
+
+class PrefetchResult(Record):
+    """
+    Resultado de prefetch() para una versión de un paquete.
+    status: "downloaded", "cached" (ya estaba descargada), "installed" (no hace falta) o "failed".
+    """
+    __slots__ = ("id", "version", "status", "size", "error")
+
+    def __init__(self, id, version, status, size=0, error=None):
+        self.id = id
+        self.version = version
+        self.status = status
+        self.size = size
+        self.error = error
+
+class VerifyResult(Record):
+    """
+    Resultado de verify() para un paquete.
+    status: "ok", "modified" (faltan archivos o cambiaron) o "unverifiable" (se instaló antes de que
+    KMD guardara la lista de sus archivos; al reinstalarlo ya se puede comprobar).
+    algorithm: Hash con el que se compararon los archivos ("sha256" o la huella rápida, ver LOCAL_DIGESTS).
+    files / size: Archivos y bytes que instaló el paquete. missing / modified: Rutas relativas con "/".
+    """
+    __slots__ = ("id", "version", "status", "algorithm", "files", "size", "missing", "modified")
+
+    def __init__(self, id, version, status, algorithm=None, files=0, size=0, missing=None, modified=None):
+        self.id = id
+        self.version = version
+        self.status = status
+        self.algorithm = algorithm
+        self.files = files
+        self.size = size
+        self.missing = missing if missing is not None else []
+        self.modified = modified if modified is not None else []
+
+class CatalogDiff(Record):
+    """
+    Cambios del índice entre dos revisiones (ver update_catalog_diff y whats_new()).
+    added / removed: IDs de paquetes nuevos y retirados.
+    new_versions / removed_versions: {ID: [versiones]} (vacíos si el índice está fragmentado: la raíz no lista las versiones).
+    latest_changed: {ID: [latest anterior, latest nueva]}.
+    """
+    __slots__ = ("from_revision", "to_revision", "computed_at", "added", "removed", "new_versions", "removed_versions", "latest_changed")
+
+    def __init__(self, from_revision, to_revision, computed_at, added=None, removed=None, new_versions=None,
+                 removed_versions=None, latest_changed=None):
+        self.from_revision = from_revision
+        self.to_revision = to_revision
+        self.computed_at = computed_at
+        self.added = added if added is not None else []
+        self.removed = removed if removed is not None else []
+        self.new_versions = new_versions if new_versions is not None else {}
+        self.removed_versions = removed_versions if removed_versions is not None else {}
+        self.latest_changed = latest_changed if latest_changed is not None else {}
+
+    def affected(self):
+        """
+        Devuelve los IDs de los paquetes cuya versión latest pudo cambiar.
+        """
+        return set(self.added) | set(self.removed) | set(self.latest_changed)
+
+class MirrorResult(Record):
+    """
+    Resultado de mirror().
+    archives: Versiones de paquetes que hay en el mirror.
+    downloaded / skipped: Paquetes descargados y los que ya estaban con el hash correcto.
+    failed: Lista de (ID, versión, error) que no se pudieron copiar (no se incluyen en el índice del mirror).
+    """
+    __slots__ = ("path", "packages", "archives", "downloaded", "skipped", "downloaded_bytes", "failed")
+
+    def __init__(self, path, packages, archives, downloaded, skipped, downloaded_bytes, failed):
+        self.path = path
+        self.packages = packages
+        self.archives = archives
+        self.downloaded = downloaded
+        self.skipped = skipped
+        self.downloaded_bytes = downloaded_bytes
+        self.failed = failed
+
+class CacheStats(Record):
+    """
+    Estado de la caché de descargas y del almacén de archivos.
+    references: Enlaces de paquetes a objetos del almacén.
+    saved_bytes: Bytes que ocuparían de más los archivos repetidos sin el almacén.
+    orphaned_*: Objetos que ya no usa ningún paquete (los borra prune_store()).
+    """
+    __slots__ = ("objects", "references", "stored_bytes", "saved_bytes", "orphaned_objects", "orphaned_bytes", "cache_bytes")
+
+    def __init__(self, objects, references, stored_bytes, saved_bytes, orphaned_objects, orphaned_bytes, cache_bytes):
+        self.objects = objects
+        self.references = references
+        self.stored_bytes = stored_bytes
+        self.saved_bytes = saved_bytes
+        self.orphaned_objects = orphaned_objects
+        self.orphaned_bytes = orphaned_bytes
+        self.cache_bytes = cache_bytes
+
+class UpdateCheck(Record):
+    """Resultado de check_kmd_update()."""
+    __slots__ = ("available", "latest_version", "download_url")
+
+    def __init__(self, available, latest_version, download_url):
+        self.available = available
+        self.latest_version = latest_version
+        self.download_url = download_url
+
+# -- API --
+# Las funciones de esta sección no imprimen ni preguntan nada: devuelven resultados o lanzan
+# KMDError. Los mensajes para el usuario se pasan al callback notify (si se indica) y las
+# preguntas se resuelven con políticas:
+#   "abort"     - No continuar (por defecto)
+#   "continue"  - Continuar
+#   callable    - Se llama con los detalles y debe devolver True para continuar
+# El progreso de las descargas se informa con progress(package_id, version, descargado, total, terminado).
+
+def _notify(notify, message):
+    if notify:
+        notify(message)
+
+def _accept(policy, *details):
+    """
+    Resuelve una política ("abort", "continue" o un callable) a True/False.
+    """
+    if policy == "continue":
+        return True
+    if policy == "abort":
+        return False
+    if callable(policy):
+        return bool(policy(*details))
+    raise ValueError(f"Política desconocida: {policy!r} (se esperaba 'abort', 'continue' o un callable)")
+
+def parse_package_id(package_id):
+    """
+    Separa un ID de paquete ("Autor@Nombre") en (autor, nombre).
+    Lanza InvalidPackageIdError si el formato no es válido.
+    """
+    parts = package_id.split('@') if isinstance(package_id, str) else []
+    if len(parts) != 2 or not all(parts):
+        writeLog("ERROR", f"ID de paquete inválido: {package_id} (se esperaba 'Autor@Paquete')")
+        raise InvalidPackageIdError(f"ID de paquete inválido: {package_id} (se esperaba 'Autor@Paquete')")
+    return parts[0], parts[1]
+
+def get_package_entry(package_id, include_excluded=True):
+    """
+    Devuelve la entrada del índice de un paquete.
+    include_excluded: Si es False, los paquetes de EXCLUDED_PACKAGES se tratan como inexistentes.
+    Lanza PackageNotFoundError si no existe.
+    """
+    parse_package_id(package_id)
+    entry = find_index_entry(package_id)
+    if not entry or (not include_excluded and package_id in EXCLUDED_PACKAGES):
+        writeLog("ERROR", f"Paquete {package_id} no encontrado en el índice")
+        raise PackageNotFoundError(f"Paquete {package_id} no encontrado en el índice")
+    return entry
+
+def select_version(entry, package_id, version=None):
+    """
+    Devuelve la versión pedida de una entrada del índice, o la marcada como 'latest' si version es None.
+    Lanza VersionNotFoundError si no existe.
+    """
+    if version:
+        selected = next((v for v in entry['versions'] if v.get('versionName', v.get('vName')) == version), None)
+        if not selected:
+            writeLog("ERROR", f"La versión '{version}' de {package_id} no existe.")
+            raise VersionNotFoundError(f"La versión '{version}' de {package_id} no existe.")
+    else:
+        selected = next((v for v in entry['versions'] if v.get('latest', False)), None)
+        if not selected:
+            writeLog("ERROR", f"No se encontró una versión marcada como 'latest' para {package_id}")
+            raise VersionNotFoundError(f"No se encontró una versión marcada como 'latest' para {package_id}")
+    return selected
+
+def _installed_by_id():
+    """
+    Devuelve un diccionario {ID: entrada del registro} con los paquetes instalados.
+    Lanza RegistryError si el registro está corrupto.
+    """
+    try:
+        data = load_registry()
+    except json.JSONDecodeError:
+        writeLog("ERROR", "El archivo installed.json está corrupto o malformado")
+        raise RegistryError("El archivo installed.json está corrupto o malformado")
+    installed = (data or {}).get('installed', [])
+    if not isinstance(installed, list):
+        writeLog("ERROR", "El campo 'installed' no es una lista")
+        raise RegistryError("Formato incorrecto en el archivo de registro")
+    return {f"{p.get('author')}@{p.get('name')}": p for p in installed}
+
+def _to_installed_package(pkg):
+    author = pkg.get('author', 'Desconocido')
+    name = pkg.get('name', 'SinNombre')
+    return InstalledPackage(
+        f"{author}@{name}", author, name, pkg.get('version'), pkg.get('description'),
+        pkg.get('dependencies', []), pkg.get('dependents', []), pkg.get('scriptDurations'),
+        sorted(pkg.get('installedVersions', {}), key=version_key)
+    )
+
+def _to_summary(p):
+    latest = next((v.get('versionName') for v in p.get('versions', []) if v.get('latest')), None)
+    return PackageSummary(f"{p['author']}@{p['name']}", p['author'], p['name'], p.get('description'), latest)
+
+def resolve_download_url(url):
+    """
+    Resuelve la URL de descarga de un paquete respecto a la URL del índice (los mirrors usan rutas relativas).
+    """
+    from urllib.parse import urljoin
+    return urljoin(INDEX_URL, url)
+
+def download_package(package_id, version=None, progress=None, notify=None):
+    """
+    Descarga un paquete dado su ID (formato: Author@PackageName)
+    y opcionalmente una versión específica.
+    progress: Callback de progreso (ver la sección API).
+    Devuelve (ruta del ZIP temporal, entrada del índice).
+    """
+    import tempfile
+    author, name = parse_package_id(package_id)
+
+    # Buscar el paquete y la versión correcta
+    entry = get_package_entry(package_id)
+    version_entry = select_version(entry, package_id, version)
+    version_name = version_entry['versionName']
+
+    url = resolve_download_url(version_entry['downloadURL'])
+    writeLog("INFO", f"Descargando {package_id} ({version_name}) desde: {url}")
+    _notify(notify, f"Descargando {package_id} ({version_name}) desde:\n{url}")
+
+    with Transfer(url, f"{package_id} {version_name}") as transfer:
+        response = get_http_session().get(url, stream=True, timeout=30)
+        if response.status_code != 200:
+            writeLog("ERROR", "Error al descargar el paquete")
+            raise KMDError("Error al descargar el paquete")
+
+        total_size = int(response.headers.get('content-length', 0))
+        downloaded = 0
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
+        try:
+            if progress:
+                progress(package_id, version_name, 0, total_size, False)
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                if chunk:
+                    temp_file.write(chunk)
+                    downloaded += len(chunk)
+                    transfer.add(len(chunk))
+                    if progress:
+                        progress(package_id, version_name, downloaded, total_size, False)
+            if progress:
+                progress(package_id, version_name, downloaded, total_size, True)
+        except BaseException:
+            temp_file.close()
+            os.remove(temp_file.name)
+            raise
+        temp_file.close()
+    return temp_file.name, entry
+
+HASH_BUFFER = 1024 * 1024 # Bytes que se leen de una vez al calcular el hash de un archivo
+
+def new_hasher(algorithm="sha256"):
+    """
+    Devuelve un objeto con update()/hexdigest() para algorithm: "sha256", "blake2b" o "xxh3".
+    xxh3 necesita el paquete xxhash (ImportError si no está instalado).
+    """
+    if algorithm == "xxh3":
+        import xxhash
+        return xxhash.xxh3_128()
+    import hashlib
+    if algorithm == "blake2b":
+        return hashlib.blake2b(digest_size=16)
+    return hashlib.new(algorithm)
+
+def hash_file(path, algorithm="sha256"):
+    """
+    Calcula el hash de un archivo leyendo bloques de HASH_BUFFER sobre un mismo búfer.
+    Con bloques grandes hashlib suelta el GIL, así que varios hilos pueden hashear a la vez (ver hash_files).
+    Devuelve el hash en hexadecimal.
+    """
+    hasher = new_hasher(algorithm)
+    buffer = bytearray(HASH_BUFFER)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            hasher.update(view[:read])
+    return hasher.hexdigest()
+
+def hash_files(paths, algorithm="sha256", workers=None):
+    """
+    Calcula el hash de varios archivos en paralelo (JOBS hilos por defecto).
+    Devuelve una lista en el mismo orden que paths, con None en los que no se pudieron leer.
+    """
+    def hash_or_none(path):
+        try:
+            return hash_file(path, algorithm)
+        except OSError:
+            return None
+    return run_parallel(hash_or_none, paths, workers or JOBS)
+
+def verify_hash(file_path, expected_hash) -> bool:
+    """
+    Verifica el hash SHA-256 de un archivo contra un hash esperado.
+    Devuelve True si el hash coincide, False en caso contrario.
+    """
+    computed = hash_file(file_path)
+    writeLog("INFO", f"Hash del paquete en el index: {expected_hash}")
+    writeLog("INFO", f"Hash calculado: {computed}")
+    return computed == expected_hash
+
+def extract_and_validate_manifest(zip_path):
+    """
+    Extrae el manifest.json de un paquete ZIP y lo valida contra el índice.
+    Devuelve el manifest como un diccionario.
+    Lanza ManifestError si falta, está corrupto o no coincide con el índice.
+    """
+    import zipfile
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        try:
+            with zip_ref.open('manifest.json') as manifest_file:
+                manifest = json.load(manifest_file)
+        except KeyError:
+            writeLog("ERROR", "El paquete no contiene un manifest.json. Abortando instalación...")
+            raise ManifestError("El paquete no contiene un manifest.json")
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            writeLog("ERROR", "El archivo manifest.json está corrupto o malformado. Abortando instalación...")
+            raise ManifestError("Ha ocurrido un error mientras se abría manifest.json")
+
+    if not isinstance(manifest, dict) or not all(k in manifest for k in ('author', 'name', 'version')):
+        writeLog("ERROR", "Al manifest.json le faltan campos obligatorios (author, name, version)")
+        raise ManifestError("Al manifest.json le faltan campos obligatorios (author, name, version)")
+
+    # Buscar paquete por author y name
+    index_entry = find_index_entry(f"{manifest['author']}@{manifest['name']}")
+    if not index_entry:
+        writeLog("ERROR", "Paquete no encontrado en el índice al validar manifest")
+        raise ManifestError("Paquete no encontrado en el índice al validar manifest")
+
+    # Buscar la versión dentro de las versiones del índice que coincida con manifest['version']
+    version_entry = next((v for v in index_entry['versions'] if v.get('versionName', v.get('vName')) == manifest['version']), None)
+    if not version_entry:
+        writeLog("ERROR", "Versión no encontrada en el índice para este paquete")
+        raise ManifestError("Versión no encontrada en el índice para este paquete")
+
+    # Validaciones básicas
+    if manifest.get('description') != index_entry.get('description', ''):
+        writeLog("ERROR", "La descripción del manifest y el índice no coinciden")
+        raise ManifestError("La descripción del manifest y el índice no coinciden")
+
+    return manifest
+
+def _version_folder_name(version):
+    name = "".join(c if c.isalnum() or c in "-_.+" else "_" for c in str(version)).strip(".") or "_"
+    return f"{name}_" if name in (ACTIVE_LINK, ACTIVE_FILE) else name
+
+def get_package_folder(package_name):
+    """
+    Devuelve la carpeta de un paquete. Dentro hay una carpeta por versión instalada, el enlace
+    ACTIVE_LINK a la versión activa y el archivo ACTIVE_FILE con su nombre.
+    """
+    return os.path.join(INSTALL_PATH, package_name)
+
+def get_version_folder(package_name, version):
+    """
+    Devuelve la carpeta de una versión de un paquete (INSTALL_PATH/<nombre>/<versión>).
+    """
+    return os.path.join(get_package_folder(package_name), _version_folder_name(version))
+
+def get_active_folder(pkg):
+    """
+    Devuelve la carpeta de la versión activa de un paquete del registro.
+    Los paquetes instalados antes de las versiones en paralelo están directamente en INSTALL_PATH/<nombre>.
+    """
+    if 'installedVersions' not in pkg:
+        return get_package_folder(pkg['name'])
+    return get_version_folder(pkg['name'], pkg.get('version'))
+
+def set_active_version(package_name, version):
+    """
+    Apunta el enlace ACTIVE_LINK (y el archivo ACTIVE_FILE, para quien no pueda seguir enlaces)
+    de un paquete a una de sus versiones instaladas.
+    """
+    folder = get_package_folder(package_name)
+    target = _version_folder_name(version)
+    write_file_atomic(os.path.join(folder, ACTIVE_FILE), target + "\n")
+    if not PLATFORM.set_active_link(os.path.join(folder, ACTIVE_LINK), target):
+        writeLog("WARNING", f"No se pudo crear el enlace {ACTIVE_LINK} de {package_name}. La versión activa queda en {ACTIVE_FILE}")
+
+def _migrate_legacy_layout(pkg):
+    """
+    Mueve un paquete instalado con el formato anterior (archivos directamente en INSTALL_PATH/<nombre>)
+    a INSTALL_PATH/<nombre>/<versión> y lo marca como activo.
+    Devuelve el diccionario installedVersions del paquete.
+    """
+    version = pkg.get('version') or "unknown"
+    folder = get_package_folder(pkg['name'])
+    if os.path.isdir(folder):
+        writeLog("INFO", f"Moviendo {pkg['name']} a su carpeta de versión ({version})...")
+        tmp_folder = f"{folder}.{os.getpid()}.migrating"
+        os.rename(folder, tmp_folder)
+        os.makedirs(folder)
+        os.rename(tmp_folder, get_version_folder(pkg['name'], version))
+        set_active_version(pkg['name'], version)
+    return {version: {"storeObjects": pkg.get('storeObjects', []), "scriptDurations": pkg.get('scriptDurations', {})}}
+
+def extract_package(zip_path, package_name, version, fresh_store=False):
+    """
+    Extrae un paquete ZIP en la carpeta de su versión dentro de INSTALL_PATH, a través del almacén
+    de archivos (los archivos que ya tenga otro paquete se enlazan en vez de escribirse otra vez).
+    zip_path: Ruta al archivo ZIP del paquete.
+    package_name: Nombre del paquete (usado para crear la carpeta de destino).
+    version: Versión del paquete (cada versión va en su propia carpeta, ver get_version_folder).
+    Devuelve (ruta de la carpeta donde se extrajo el paquete, lista de lo que se extrajo).
+    Cada elemento de la lista es [ruta relativa con "/", tamaño, hash SHA-256], más la huella rápida
+    si LOCAL_DIGEST no es "none" (ver verify); las carpetas vacías del ZIP van como
+    [ruta terminada en "/", 0, None]. Se guarda en el registro (ver remove_package_files).
+    Si la extracción falla (p. ej. con el disco lleno) y la carpeta de la versión es nueva, se borra
+    lo extraído hasta entonces (ver discard_version_folder).
+    fresh_store: Escribe de nuevo en el almacén todos los archivos en vez de enlazar los que ya estaban.
+    """
+    import zipfile
+    dest_path = get_version_folder(package_name, version)
+    created = not os.path.isdir(dest_path)
+    os.makedirs(dest_path, exist_ok=True)
+    files = []
+    shared = shared_bytes = copied = 0
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            for member in zip_ref.infolist():
+                target = _member_path(dest_path, member.filename)
+                if target is None:
+                    continue
+                relative = os.path.relpath(target, dest_path).replace(os.sep, "/")
+                if member.is_dir():
+                    os.makedirs(target, exist_ok=True)
+                    files.append([relative + "/", 0, None])
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                digest, existed, linked, local = store_member(zip_ref, member, target, LOCAL_DIGEST, fresh_store)
+                files.append([relative, member.file_size, digest] + ([local] if local else []))
+                if existed:
+                    shared += 1
+                    shared_bytes += member.file_size
+                if not linked:
+                    copied += 1
+    except BaseException as e:
+        if created:
+            writeLog("ERROR", f"No se pudo extraer {package_name} {version} ({e}). Borrando lo extraído...")
+            discard_version_folder(package_name, version, {entry[2] for entry in files if entry[2]})
+        raise
+    stored = sum(1 for entry in files if entry[2])
+    METRICS.inc("kmd_cache_requests_total", shared, cache="store", result="hit")
+    METRICS.inc("kmd_cache_requests_total", stored - shared, cache="store", result="miss")
+    writeLog("INFO", f"{len(files)} archivos extraídos ({shared} ya estaban en el almacén, {shared_bytes} bytes sin duplicar)")
+    if copied:
+        writeLog("WARNING", f"{copied} archivos se copiaron porque el sistema de archivos no admite enlaces duros")
+    return dest_path, files
+
+def discard_version_folder(package_name, version, store_objects):
+    """
+    Borra entera la carpeta de una versión que no se llegó a instalar (falló la extracción o el script
+    de post-instalación) y libera del almacén sus objetos que ya no usa nadie.
+    Si el paquete no tiene otras versiones, borra también la carpeta del paquete.
+    """
+    remove_tree(get_version_folder(package_name, version))
+    release_store_objects(store_objects)
+    try:
+        os.rmdir(get_package_folder(package_name))
+    except OSError:
+        pass # Tiene otras versiones
+
+def remove_package_files(folder, files):
+    """
+    Borra de folder los archivos de un paquete (la lista que devolvió extract_package), por lotes en
+    paralelo, y después las carpetas que hayan quedado vacías. No recorre la carpeta: los archivos que
+    no son del paquete (los que crearon sus scripts o el usuario) no se tocan y sus carpetas se conservan.
+    Devuelve True si folder quedó borrada. Lanza PermissionError si no se puede borrar algún archivo.
+    """
+    paths = []
+    folders = set()
+    for relative, *_ in files:
+        path = _member_path(folder, relative)
+        if path is None:
+            continue
+        if relative.endswith("/"):
+            folders.add(path)
+        else:
+            paths.append(path)
+        parent = os.path.dirname(path)
+        while len(parent) > len(folder) and parent not in folders:
+            folders.add(parent)
+            parent = os.path.dirname(parent)
+
+    def remove_batch(batch):
+        for path in batch:
+            try:
+                PLATFORM.remove_file(path)
+            except FileNotFoundError:
+                pass
+
+    run_parallel(remove_batch, [paths[i:i + REMOVE_BATCH_SIZE] for i in range(0, len(paths), REMOVE_BATCH_SIZE)], JOBS)
+    for path in sorted(folders, key=len, reverse=True) + [folder]:
+        try:
+            os.rmdir(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            pass # Tiene archivos que no son del paquete
+    return not os.path.lexists(folder)
+
+def _remove_link(path):
+    """
+    Borra un archivo o un enlace (en Windows los enlaces a carpetas y las uniones se borran con rmdir).
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        os.rmdir(path)
+
+def remove_version_folder(package_name, version, saved):
+    """
+    Borra la carpeta de una versión instalada de un paquete.
+    saved: Su entrada de installedVersions. Si tiene la lista de archivos solo se borran esos
+    (ver remove_package_files); las versiones instaladas antes de que existiera se borran enteras.
+    Devuelve True si la carpeta quedó borrada.
+    """
+    folder = get_version_folder(package_name, version)
+    if 'files' not in saved:
+        remove_tree(folder)
+        return not os.path.lexists(folder)
+    return remove_package_files(folder, saved['files'])
+
+def run_package_script(package_id, script_path, cwd, label, timeout=None):
+    """
+    Ejecuta un script de un paquete sin entrada estándar, con la carpeta del paquete como directorio
+    de trabajo y las variables KMD_PACKAGE_ID y KMD_PACKAGE_PATH.
+    Su salida (stdout y stderr) se vuelca al log línea a línea según se produce.
+    Si tarda más de timeout segundos, se mata junto con todos sus procesos hijos.
+    Devuelve un ScriptResult.
+    """
+    import subprocess
+    env = dict(os.environ, KMD_PACKAGE_ID=package_id, KMD_PACKAGE_PATH=cwd)
+    start = time.monotonic()
+    process = subprocess.Popen(
+        PLATFORM.script_command(script_path), cwd=cwd, env=env,
+        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        **PLATFORM.script_popen_kwargs()
+    )
+
+    def pump(stream, status):
+        with stream:
+            for raw in iter(stream.readline, b""):
+                line = raw.decode("utf-8", "replace").rstrip()
+                if line:
+                    writeLog(status, f"[{package_id} {label}] {line}")
+
+    readers = [
+        threading.Thread(target=pump, args=(process.stdout, "INFO"), daemon=True),
+        threading.Thread(target=pump, args=(process.stderr, "WARNING"), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+
+    timed_out = False
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        writeLog("ERROR", f"El script de {label} de {package_id} superó el tiempo máximo ({timeout:g} s). Deteniéndolo...")
+        PLATFORM.kill_process_tree(process)
+        process.wait()
+    for reader in readers:
+        reader.join(timeout=5) # Un nieto que siga vivo puede mantener la salida abierta
+    return ScriptResult(os.path.basename(script_path), process.returncode, round(time.monotonic() - start, 3), timed_out)
+
+def _run_script(manifest, package_path, key, label, notify=None):
+    """
+    Ejecuta el script key del manifest (ver run_package_script) y aplica la política SCRIPT_ERRORS.
+    El manifest puede pedir un tiempo máximo menor con "scriptTimeout", pero nunca mayor que SCRIPT_TIMEOUT.
+    Devuelve un ScriptResult, o None si el manifest no define el script.
+    Lanza ScriptError si el script falla y SCRIPT_ERRORS es "abort".
+    """
+    script = (manifest.get(key) or "").strip()
+    if not script:
+        return None
+    package_id = f"{manifest.get('author')}@{manifest.get('name')}"
+    package_path = os.path.abspath(package_path)
+    script_path = os.path.normpath(os.path.join(package_path, script))
+
+    result = None
+    if os.path.commonpath([script_path, package_path]) != package_path:
+        error = f"El script {script} está fuera de la carpeta del paquete {package_id}"
+    elif not os.path.isfile(script_path):
+        error = f"Script {script} no encontrado en {package_path}"
+    else:
+        timeout = SCRIPT_TIMEOUT
+        try:
+            timeout = min(timeout, float(manifest.get('scriptTimeout', timeout)))
+        except (TypeError, ValueError):
+            writeLog("WARNING", f"scriptTimeout inválido en el manifest de {package_id}. Usando {timeout:g} s")
+        writeLog("INFO", f"Ejecutando script de {label}: '{script}' (tiempo máximo: {timeout:g} s)")
+        _notify(notify, f"Ejecutando script de {label}: '{script}'")
+        try:
+            result = run_package_script(package_id, script_path, package_path, label, timeout)
+        except OSError as e:
+            error = f"Error al ejecutar el script {script}: {e}"
+        else:
+            METRICS.observe("kmd_script_duration_seconds", result.duration, script=key.removesuffix("Script"),
+                            result="timeout" if result.timed_out else "ok" if result.exit_code == 0 else "error")
+            if result.timed_out:
+                error = f"El script {script} superó el tiempo máximo ({timeout:g} s) y se detuvo"
+            elif result.exit_code != 0:
+                error = f"Error al ejecutar el script {script} (código de salida {result.exit_code})"
+            else:
+                writeLog("OK", f"Script de {label} '{script}' terminado en {result.duration:.2f} s")
+                return result
+
+    writeLog("ERROR", error)
+    _notify(notify, error)
+    if SCRIPT_ERRORS == "abort":
+        raise ScriptError(error)
+    return result or ScriptResult(script, None, 0)
+
+def run_postinstall(manifest, package_path, notify=None):
+    """
+    Ejecuta un script de post-instalación si está definido en el manifest.
+    manifest: El manifest del paquete como un diccionario.
+    package_path: Ruta donde se extrajo el paquete.
+    Devuelve un ScriptResult (o None si no hay script). Lanza ScriptError según SCRIPT_ERRORS.
+    """
+    return _run_script(manifest, package_path, 'postInstallScript', "instalación", notify)
+
+def run_uninstall(manifest, package_path, notify=None):
+    """
+    Ejecuta un script de desinstalación si está definido en el manifest.
+    manifest: El manifest del paquete como un diccionario.
+    package_path: Ruta donde se extrajo el paquete.
+    Devuelve un ScriptResult (o None si no hay script). Lanza ScriptError según SCRIPT_ERRORS.
+    """
+    return _run_script(manifest, package_path, 'uninstallScript', "desinstalación", notify)
+
+def register_package(manifest, notify=None):
     """
     Registra un paquete en el archivo installed.json.
     manifest: El manifest del paquete como un diccionario.
-    Devuelve "OK" si se registró correctamente, o "ERROR" en caso de fallo.
+    Lanza RegistryError si el registro está corrupto.
+    """
+    os.makedirs(INSTALL_PATH, exist_ok=True)
+
+    # Construir el ID del paquete
+    package_id = f"{manifest['author']}@{manifest['name']}"
+
+    # Leer, modificar y guardar el registro sin que otra operación lo modifique a la vez
+    with registry_lock():
+        try:
+            installed = load_registry(fresh=True) or {"installed": []}
+        except json.JSONDecodeError:
+            writeLog("ERROR", "El archivo installed.json está corrupto o malformado")
+            raise RegistryError(f"Ha ocurrido un error mientras se registraba {package_id}: el registro está corrupto")
+
+        # Actualizar dependents en cada dependencia (si existen)
+        if 'dependencies' in manifest:
+            for dep in manifest['dependencies']:
+                dep_id = dep['id']  # El ID de la dependencia, tipo "CeccPro@testLib"
+                for pkg in installed['installed']:
+                    pkg_id = f"{pkg['author']}@{pkg['name']}"
+                    if pkg_id == dep_id:
+                        if 'dependents' not in pkg:
+                            pkg['dependents'] = []
+                        if package_id not in pkg['dependents']:
+                            pkg['dependents'].append(package_id)
+
+        # Asegurar que el paquete tenga al menos el campo dependents vacío
+        if 'dependents' not in manifest:
+            manifest['dependents'] = []
+
+        # Reemplazar si ya estaba
+        installed['installed'] = [p for p in installed['installed'] if f"{p['author']}@{p['name']}" != package_id]
+        installed['installed'].append(manifest)
+
+        # Guardar cambios
+        save_registry(installed)
+
+    writeLog("OK", f"El paquete {package_id} se registró correctamente")
+    _notify(notify, f"Paquete {package_id} registrado correctamente")
+
+def unregister_package(package_id):
+    """
+    Elimina un paquete del archivo installed.json.
+    Lanza RegistryError si el registro está corrupto.
+    """
+    with registry_lock():
+        try:
+            installed_data = load_registry(fresh=True) or {"installed": []}
+        except json.JSONDecodeError:
+            writeLog("ERROR", "El archivo installed.json está corrupto o malformado")
+            raise RegistryError("Ha ocurrido un error mientras se actualizaba el registro")
+        installed_data['installed'] = [p for p in installed_data['installed'] if f"{p['author']}@{p['name']}" != package_id]
+        save_registry(installed_data)
+
+def check_kmd_update():
+    """
+    Busca si hay una versión más reciente de KMD en el índice.
+    Devuelve un UpdateCheck. Lanza KMDError si el índice no tiene la información de KMD.
+    """
+    # Buscar el paquete especial de KMD
+    kmd_pkg = next(iter(find_index_entries([p for p in EXCLUDED_PACKAGES if p.split('@')[1].lower() == 'kmd-win64']).values()), None)
+    if not kmd_pkg:
+        writeLog("WARNING", "No se encontró la información de actualización de KMD en el índice.")
+        raise KMDError("No se encontró la información de actualización de KMD en el índice.")
+
+    # Buscar la versión latest
+    latest_version = next((v for v in kmd_pkg['versions'] if v.get('latest', False)), None)
+    if not latest_version:
+        writeLog("WARNING", "No se encontró versión marcada como 'latest' para KMD.")
+        raise KMDError("No se encontró versión marcada como 'latest' para KMD.")
+
+    latest_version_name = latest_version.get('versionName')
+    download_url = latest_version.get('downloadURL')
+    if not latest_version_name or not download_url:
+        writeLog("ERROR", "Información de versión incompleta en el índice.")
+        raise KMDError("Información de versión incompleta en el índice.")
+
+    writeLog("INFO", f"Última versión de KMD encontrada en el index: {latest_version_name}")
+    save_update_state({"checkedAt": time.time(), "latestVersion": latest_version_name, "downloadURL": download_url})
+
+    # Comparar versiones
+    if is_newer_version(latest_version_name, KMD_VERSION):
+        writeLog("INFO", f"Nueva versión de KMD disponible: {latest_version_name} (actual: {KMD_VERSION})")
+        return UpdateCheck(True, latest_version_name, download_url)
+    writeLog("OK", "KMD está actualizado a la última versión.")
+    return UpdateCheck(False, latest_version_name, download_url)
+
+def get_update_state_path():
+    """
+    Devuelve la ruta del archivo donde se guarda el resultado de la última búsqueda de actualizaciones de KMD.
+    """
+    return os.path.join(CACHE_PATH, "update-check.json")
+
+def read_update_state():
+    """
+    Lee el estado de la búsqueda de actualizaciones de KMD ({} si no hay o está dañado):
+    checkedAt / latestVersion / downloadURL: Última búsqueda que terminó bien y su resultado.
+    attemptedAt: Última vez que se lanzó una búsqueda en segundo plano (ver update_check_due).
+    """
+    try:
+        with open(get_update_state_path(), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return state if isinstance(state, dict) else {}
+
+def save_update_state(changes):
+    """
+    Actualiza el estado de la búsqueda de actualizaciones de KMD con los campos de changes.
+    """
+    state = read_update_state()
+    state.update(changes)
+    try:
+        write_file_atomic(get_update_state_path(), json.dumps(state))
+    except OSError as e:
+        writeLog("WARNING", f"No se pudo guardar el estado de la búsqueda de actualizaciones: {e}")
+
+def cached_update_check():
+    """
+    Devuelve el UpdateCheck de la última búsqueda de actualizaciones guardada, sin tocar la red,
+    o None si nunca se buscó.
+    """
+    state = read_update_state()
+    if not state.get("latestVersion"):
+        return None
+    return UpdateCheck(is_newer_version(state["latestVersion"], KMD_VERSION), state["latestVersion"], state.get("downloadURL"))
+
+def update_check_due():
+    """
+    Indica si toca buscar actualizaciones de KMD: pasaron UPDATE_CHECK_INTERVAL segundos desde la última
+    búsqueda (o desde el último intento, para no lanzar una por comando si la red falla).
+    Con UPDATE_CHECK_INTERVAL = 0 nunca toca.
+    """
+    if not UPDATE_CHECK_INTERVAL:
+        return False
+    state = read_update_state()
+    last = max(state.get("checkedAt", 0), state.get("attemptedAt", 0))
+    return time.time() - last >= UPDATE_CHECK_INTERVAL
+
+def search(query, mode="ranked", limit=None):
+    """
+    Busca paquetes en el índice por autor, nombre y descripción.
+    mode: "ranked", "prefix" o "fuzzy" (ver SearchIndex.query).
+    limit: Número máximo de resultados (None para todos).
+    Devuelve una lista de PackageSummary, de más a menos relevante.
+    """
+    results = []
+    for package_id, description, latest in get_search_index().query(query, mode, limit):
+        author, name = package_id.split("@", 1)
+        results.append(PackageSummary(package_id, author, name, description, latest))
+    return results
+
+def iter_packages():
+    """
+    Devuelve los paquetes del índice (excepto EXCLUDED_PACKAGES) como PackageSummary, de uno en uno
+    y según se van leyendo del índice.
+    """
+    for p in iter_index():
+        if f"{p['author']}@{p['name']}" not in EXCLUDED_PACKAGES:
+            yield _to_summary(p)
+
+def list_packages():
+    """
+    Devuelve todos los paquetes del índice (excepto EXCLUDED_PACKAGES) como PackageSummary.
+    """
+    return list(iter_packages())
+
+def list_installed():
+    """
+    Devuelve los paquetes instalados como InstalledPackage.
+    Lanza RegistryError si el registro está corrupto.
+    """
+    return [_to_installed_package(p) for p in _installed_by_id().values()]
+
+def list_versions(package_id):
+    """
+    Devuelve las versiones disponibles de un paquete como VersionInfo.
+    Lanza InvalidPackageIdError o PackageNotFoundError.
+    """
+    entry = get_package_entry(package_id)
+    return [
+        VersionInfo(v.get('versionName', v.get('vName')), bool(v.get('latest')), v.get('downloadURL'), v.get('hash'))
+        for v in entry['versions']
+    ]
+
+def find_dependents(package_id):
+    """
+    Devuelve los IDs de los paquetes instalados que dependen de un paquete.
+    Lanza InvalidPackageIdError o RegistryError.
+    """
+    parse_package_id(package_id)
+    writeLog("INFO", f"Buscando paquetes que dependen de {package_id}")
+    dependents = []
+    for pkg_id, p in _installed_by_id().items():
+        deps = p.get('dependencies', [])
+        if not isinstance(deps, list):
+            continue  # Ignora paquetes con dependencias mal formateadas
+        if any(isinstance(dep, dict) and dep.get('id') == package_id for dep in deps):
+            dependents.append(pkg_id)
+    writeLog("INFO", f"Se encontró que {len(dependents)} paquetes dependen de {package_id}")
+    return dependents
+
+_dependency_context = threading.local() # chain: paquetes que se están instalando en la cadena de dependencias del hilo actual
+
+def install_dependencies(manifest, on_hash_mismatch="abort", progress=None, notify=None):
+    """
+    Instala las dependencias de un paquete dado su manifest.
+    Las dependencias se instalan en paralelo (hasta JOBS a la vez): cada una instala antes las suyas,
+    así que sus scripts solo se ejecutan cuando sus propias dependencias ya están listas.
+    Cada hilo lleva la cadena de paquetes que se están instalando por encima de él: una dependencia que ya
+    está en esa cadena es circular y falla enseguida (esperarla en otro hilo no terminaría nunca, porque el
+    lock de cada paquete es de su hilo).
+    manifest: El manifest del paquete como un diccionario.
+    Devuelve la lista de InstallResult. Lanza DependencyError si alguna falla o hay una dependencia circular.
+    """
+    dependencies = manifest.get('dependencies', [])
+    if any(not dep.get("id") for dep in dependencies):
+        writeLog("ERROR", "Dependencia inválida, falta el ID.")
+        raise DependencyError("Dependencia inválida, falta el ID.")
+
+    # Cuanto más profunda la dependencia, antes se descarga: el paquete que la pide no puede terminar sin ella
+    priority = getattr(_transfer_context, "priority", 0) - 1
+    chain = getattr(_dependency_context, "chain", ()) + (f"{manifest.get('author')}@{manifest.get('name')}",)
+
+    def install_dependency(dep):
+        pkg_id = dep.get("id")
+        pkg_version = dep.get("version")
+        if pkg_id in chain:
+            cycle = " -> ".join(chain[chain.index(pkg_id):] + (pkg_id,))
+            writeLog("ERROR", f"Dependencia circular: {cycle}")
+            raise DependencyError(f"Dependencia circular: {cycle}")
+        if pkg_id in _installed_by_id():
+            pkg_version = None # No se cambia la versión activa de una dependencia que pueden usar otros paquetes
+        writeLog("INFO", f"Instalando dependencia: {pkg_id} (versión: {pkg_version or 'latest'})")
+        _notify(notify, f"Instalando dependencia: {pkg_id} (versión: {pkg_version or 'latest'})")
+        previous = (getattr(_transfer_context, "priority", 0), getattr(_dependency_context, "chain", ()))
+        _transfer_context.priority = priority
+        _dependency_context.chain = chain
+        try:
+            return install(pkg_id, pkg_version, on_hash_mismatch=on_hash_mismatch, progress=progress, notify=notify)
+        except KMDError as e:
+            writeLog("ERROR", f"Error al instalar dependencia: {pkg_id}")
+            raise DependencyError(f"Error al instalar dependencia {pkg_id}: {e}") from e
+        finally:
+            _transfer_context.priority, _dependency_context.chain = previous
+
+    return run_parallel(install_dependency, dependencies, JOBS)
+
+def _check_write_permission(folder):
+    """
+    Comprueba que se puede escribir en una carpeta creando un archivo temporal.
+    Lanza PermissionDeniedError si no se puede.
+    """
+    writeLog("INFO", "Creando archivo temporal para verificar permisos de admin...")
+    test_path = os.path.join(folder, f"__perm_check.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(test_path, 'w') as f:
+            f.write("test")
+        os.remove(test_path)
+    except PermissionError as e:
+        raise PermissionDeniedError(f"KMD no tiene permisos de escritura sobre {folder}: {e}") from e
+    writeLog("OK", "Archivo temporal creado exitosamente!")
+
+def get_archive_cache_path(expected_hash):
+    """
+    Devuelve la ruta de un paquete descargado por adelantado (ver prefetch) según su hash.
+    """
+    return os.path.join(CACHE_PATH, "archives", f"{expected_hash}.zip")
+
+def _take_prefetched(package_id, selected_version):
+    """
+    Si prefetch ya descargó esta versión y su hash sigue siendo el del índice, la saca de la caché
+    (se renombra, así que dos instalaciones no pueden usar la misma) y devuelve su ruta. Si no, devuelve None.
+    """
+    expected_hash = selected_version.get('hash')
+    if not expected_hash:
+        return None
+    cached_path = get_archive_cache_path(expected_hash)
+    zip_path = f"{cached_path}.{os.getpid()}.{threading.get_ident()}.installing"
+    try:
+        os.replace(cached_path, zip_path)
+    except OSError:
+        METRICS.inc("kmd_cache_requests_total", cache="archive", result="miss")
+        return None
+    if not verify_hash(zip_path, expected_hash):
+        writeLog("WARNING", f"El paquete descargado por adelantado de {package_id} está dañado. Se descarga de nuevo")
+        os.remove(zip_path)
+        METRICS.inc("kmd_cache_requests_total", cache="archive", result="miss")
+        return None
+    METRICS.inc("kmd_cache_requests_total", cache="archive", result="hit")
+    writeLog("INFO", f"Usando {package_id} {selected_version['versionName']} descargado por adelantado (prefetch)")
+    return zip_path
+
+def _download_verified(package_id, selected_version, on_hash_mismatch, progress, notify):
+    """
+    Descarga una versión de un paquete y comprueba su hash (aplicando la política on_hash_mismatch).
+    Si prefetch ya la había descargado, usa esa copia.
+    Devuelve la ruta del ZIP temporal. Lanza HashMismatchError si se aborta.
+    """
+    zip_path = _take_prefetched(package_id, selected_version)
+    if zip_path:
+        return zip_path
+    zip_path, _ = download_package(package_id, selected_version['versionName'], progress, notify)
+    writeLog("INFO", "Comparando el hash del paquete...")
+    if not verify_hash(zip_path, selected_version['hash']):
+        writeLog("WARNING", "El hash del paquete no coincide con el esperado")
+        if not _accept(on_hash_mismatch, package_id, selected_version['hash']):
+            writeLog("ERROR", "Se abortó la instalación porque el hash no coincide")
+            os.remove(zip_path)
+            raise HashMismatchError(f"El hash de {package_id} no coincide con el esperado. Abortando instalación.")
+        writeLog("WARNING", "Se continuó con la instalación aunque el hash no coincide")
+    return zip_path
+
+def _install_downloaded(package_id, zip_path, selected_version, on_hash_mismatch, progress, notify, dependents=None,
+                        fresh_store=False):
+    """
+    Instala un paquete ya descargado y verificado: dependencias, extracción, postinstall y registro.
+    Si el paquete ya estaba instalado, la nueva versión se instala al lado de las demás y pasa a ser la activa.
+    dependents: Dependientes que se conservan en el registro (por defecto, los de la versión instalada).
+    fresh_store: No reutiliza los archivos que ya estén en el almacén (ver extract_package).
+    Devuelve un InstallResult.
+    """
+    # Extraer y validar manifest
+    manifest = extract_and_validate_manifest(zip_path)
+    version = manifest.get('version') or selected_version['versionName']
+
+    # Instalar dependencias
+    writeLog("INFO", "Instalando dependencias...")
+    dependencies = install_dependencies(manifest, on_hash_mismatch, progress, notify)
+
+    # Versiones ya instaladas (las del formato anterior se mueven a su carpeta de versión)
+    existing = _installed_by_id().get(package_id)
+    installed_versions = {}
+    if existing:
+        installed_versions = dict(existing.get('installedVersions') or _migrate_legacy_layout(existing))
+        if dependents is None:
+            dependents = existing.get('dependents')
+        if existing.get('version') != version:
+            manifest['previousVersion'] = existing.get('version')
+        elif existing.get('previousVersion'):
+            manifest['previousVersion'] = existing['previousVersion']
+
+    # Extraer paquete
+    writeLog("INFO", "Extrayendo paquete...")
+    package_path, files = extract_package(zip_path, manifest['name'], version, fresh_store)
+    store_objects = sorted({entry[2] for entry in files if entry[2]})
+    manifest['storeObjects'] = store_objects
+    replaced = installed_versions.get(version, {}).get('storeObjects', [])
+    release_store_objects(set(replaced) - set(store_objects))
+
+    # Ejecutar postinstall si existe (si falla y la política es abortar, no se deja el paquete a medias).
+    # Si la versión ya estaba instalada (repair) su carpeta se conserva: sus archivos ya se restauraron
+    # y, como los objetos del almacén van por contenido, su entrada del registro sigue siendo válida
+    try:
+        script_result = run_postinstall(manifest, package_path, notify)
+    except ScriptError:
+        if version not in installed_versions:
+            discard_version_folder(manifest['name'], version, store_objects)
+        raise
+    if script_result is not None:
+        manifest['scriptDurations'] = {"postInstall": script_result.duration}
+    installed_versions[version] = {"storeObjects": store_objects, "scriptDurations": manifest.get('scriptDurations', {}), "files": files}
+    if LOCAL_DIGEST != "none":
+        installed_versions[version]["localDigest"] = LOCAL_DIGEST
+    manifest['installedVersions'] = installed_versions
+    set_active_version(manifest['name'], version)
+
+    # Registrar el paquete como instalado
+    if package_id not in EXCLUDED_REGISTER_PACKAGES:
+        if dependents:
+            manifest['dependents'] = list(dependents)
+        register_package(manifest, notify)
+    else:
+        # Si el paquete está en la lista de paquetes excluidos de registro, no lo registramos
+        writeLog("INFO", f"El paquete {package_id} está en la lista de paquetes excluidos de registro. No se registrará.")
+
+    writeLog("OK", f"El paquete {package_id} se ha instalado correctamente!")
+    _notify(notify, f"Paquete {package_id} v{selected_version['versionName']} instalado con éxito")
+    return InstallResult(package_id, selected_version['versionName'], package_path, "installed", dependencies)
+
+@record_operation("install")
+@with_package_lock
+def install(package_id, version=None, on_hash_mismatch="abort", progress=None, notify=None, include_excluded=False):
+    """
+    Instala un paquete dado su ID (formato: Author@PackageName) y una versión opcional, junto con sus dependencias.
+    version: Versión específica a instalar. Si es None, instala la última versión.
+    on_hash_mismatch: Política si el hash no coincide (ver la sección API). Recibe (package_id, esperado).
+    include_excluded: Permite instalar paquetes de EXCLUDED_PACKAGES (lo usa update_kmd).
+    Devuelve un InstallResult. Lanza KMDError si algo falla.
+    """
+    author, pkg_name = parse_package_id(package_id)
+    installed_pkg = _installed_by_id().get(package_id)
+    if installed_pkg and (not version or version == installed_pkg.get('version')):
+        writeLog("OK", f"El paquete {package_id} ya está instalado. Omitiendo instalación")
+        _notify(notify, f"El paquete {package_id} ya está instalado. Omitiendo instalación.")
+        return InstallResult(package_id, installed_pkg.get('version'), get_active_folder(installed_pkg), "already-installed")
+    if installed_pkg and _has_version(installed_pkg, version):
+        return activate_version(package_id, version, on_hash_mismatch, progress, notify)
+
+    zip_path = None
+    try:
+        writeLog("INFO", "Creando carpeta de paquetes (Si no existe ya)")
+        os.makedirs(INSTALL_PATH, exist_ok=True)
+
+        # Verificar si KMD tiene permisos de admin
+        if PLATFORM.is_admin():
+            writeLog("OK", "KMD tiene permisos de admin")
+        else:
+            writeLog("WARNING", "KMD no tiene permisos de admin. Esto podría ocasionar errores.")
+        _check_write_permission(INSTALL_PATH)
+
+        # Buscar el paquete y elegir la versión
+        writeLog("INFO", "Buscando paquete en el index...")
+        entry = get_package_entry(package_id, include_excluded)
+        writeLog("INFO", f"Instalando versión {version}..." if version else "No se especificó una versión. Instalando latest...")
+        selected_version = select_version(entry, package_id, version)
+
+        # Descargar paquete y validar hash contra la versión correcta
+        zip_path = _download_verified(package_id, selected_version, on_hash_mismatch, progress, notify)
+        return _install_downloaded(package_id, zip_path, selected_version, on_hash_mismatch, progress, notify)
+
+    except KMDError as e:
+        writeLog("ERROR", f"Error durante la instalación de {package_id}: {e}")
+        raise
+    except PermissionError as e:
+        writeLog("ERROR", f"KMD no tiene permisos para instalar {package_id}: {e}")
+        raise PermissionDeniedError(str(e)) from e
+    except Exception as e:
+        writeLog("ERROR", f"Error durante la instalación de {package_id}: {e}")
+        raise KMDError(str(e)) from e
+
+    finally:
+        if zip_path and os.path.exists(zip_path):
+            writeLog("INFO", "Eliminando archivos temporales...")
+            os.remove(zip_path)
+
+def _has_version(pkg, version):
+    """
+    Indica si una versión de un paquete del registro está instalada (y sigue en disco).
+    """
+    return version in pkg.get('installedVersions', {}) and os.path.isdir(get_version_folder(pkg['name'], version))
+
+@with_package_lock
+def activate_version(package_id, version, on_hash_mismatch="abort", progress=None, notify=None):
+    """
+    Cambia la versión activa de un paquete a otra que ya está instalada en paralelo, sin descargar
+    ni extraer nada (solo se instalan las dependencias de esa versión que falten).
+    Devuelve un InstallResult con status "switched". Lanza NotInstalledError si esa versión no está instalada.
+    """
+    installed_pkg = _installed_by_id().get(package_id)
+    if not installed_pkg or not _has_version(installed_pkg, version):
+        writeLog("ERROR", f"La versión {version} de {package_id} no está instalada")
+        raise NotInstalledError(f"La versión {version} de {package_id} no está instalada")
+
+    version_folder = get_version_folder(installed_pkg['name'], version)
+    try:
+        with open(os.path.join(version_folder, 'manifest.json'), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        writeLog("ERROR", f"No se pudo leer el manifest de {package_id} {version}: {e}")
+        raise KMDError(f"No se pudo leer el manifest de {package_id} {version}: {e}") from e
+
+    previous = installed_pkg.get('version')
+    writeLog("INFO", f"Cambiando {package_id} de la versión {previous} a {version}...")
+    dependencies = install_dependencies(manifest, on_hash_mismatch, progress, notify)
+
+    saved = installed_pkg['installedVersions'][version]
+    manifest['version'] = version
+    manifest['storeObjects'] = saved.get('storeObjects', [])
+    manifest['scriptDurations'] = saved.get('scriptDurations', {})
+    manifest['installedVersions'] = installed_pkg['installedVersions']
+    manifest['previousVersion'] = previous
+    manifest['dependents'] = installed_pkg.get('dependents', [])
+    set_active_version(installed_pkg['name'], version)
+    register_package(manifest)
+
+    writeLog("OK", f"Versión activa de {package_id}: {version}")
+    _notify(notify, f"Versión activa de {package_id}: {version} (antes: {previous})")
+    return InstallResult(package_id, version, version_folder, "switched", dependencies)
+
+@with_package_lock
+def rollback(package_id, on_hash_mismatch="abort", progress=None, notify=None):
+    """
+    Vuelve a activar la versión de un paquete que estaba activa antes de la actual (ver activate_version).
+    Devuelve un InstallResult. Lanza NotInstalledError si no hay versión anterior instalada.
+    """
+    installed_pkg = _installed_by_id().get(package_id)
+    if not installed_pkg:
+        writeLog("ERROR", f"El paquete {package_id} no está instalado.")
+        raise NotInstalledError(f"El paquete {package_id} no está instalado.")
+    previous = installed_pkg.get('previousVersion')
+    if not previous or not _has_version(installed_pkg, previous):
+        writeLog("ERROR", f"{package_id} no tiene una versión anterior instalada")
+        raise NotInstalledError(f"{package_id} no tiene una versión anterior instalada (puede que la borrara gc)")
+    return activate_version(package_id, previous, on_hash_mismatch, progress, notify)
+
+@record_operation("uninstall")
+@with_package_lock
+def uninstall(package_id, on_dependents="abort", notify=None):
+    """
+    Desinstala un paquete dado su ID (formato: Author@PackageName).
+    Solo se borran los archivos que instaló el paquete (ver remove_package_files); si quedan otros,
+    su carpeta se conserva.
+    on_dependents: Política si otros paquetes dependen de este (ver la sección API). Recibe (package_id, dependientes).
+    Devuelve un UninstallResult. Lanza NotInstalledError, HasDependentsError, RegistryError o PermissionDeniedError.
+    """
+    import shutil
+    writeLog("INFO", f"Desinstalando {package_id}")
+    parse_package_id(package_id)
+
+    if PLATFORM.is_admin():
+        writeLog("OK", "KMD tiene permisos de admin")
+    else:
+        writeLog("WARNING", "KMD no tiene permisos de admin. Esto podría ocasionar errores.")
+
+    writeLog("INFO", "Buscando paquete en el registro...")
+    package = _installed_by_id().get(package_id)
+    if not package:
+        writeLog("ERROR", f"No se encontró el paquete '{package_id}' en el registro.")
+        raise NotInstalledError(f"No se encontró el paquete con ID '{package_id}' para desinstalar.")
+
+    # Verificar si alguien más depende de este paquete
+    dependents = find_dependents(package_id)
+    if dependents:
+        writeLog("WARNING", f"{', '.join(dependents)} depende(n) de {package_id}")
+        if not _accept(on_dependents, package_id, dependents):
+            writeLog("INFO", "Se canceló la desinstalación.")
+            raise HasDependentsError(package_id, dependents)
+        writeLog("WARNING", "Se continuó con la desinstalación. Esto puede ocasionar errores.")
+
+    package_folder = get_package_folder(package['name'])
+    active_folder = get_active_folder(package)
+    if os.path.isdir(package_folder) and not os.access(package_folder, os.W_OK):
+        raise PermissionDeniedError(f"KMD no tiene permisos de escritura sobre {package_folder}")
+
+    # El registro guarda el manifest de la versión activa, así que no hace falta leerlo del disco
+    writeLog("INFO", "Verificando si hay script de desinstalación")
+    if (package.get('uninstallScript') or '').strip():
+        try:
+            run_uninstall(package, active_folder, notify)
+        except ScriptError:
+            raise
+        except Exception as e:
+            writeLog("ERROR", f"Error al ejecutar script de desinstalación: {e}")
+            _notify(notify, f"Error al ejecutar script de desinstalación: {e}")
+    else:
+        writeLog("INFO", "No se especificó un script de desinstalación en el manifiesto")
+
+    writeLog("INFO", "Eliminando archivos del paquete")
+    try:
+        if 'installedVersions' in package:
+            kept = [version for version, saved in package['installedVersions'].items()
+                    if not remove_version_folder(package['name'], version, saved)]
+            _remove_link(os.path.join(package_folder, ACTIVE_LINK))
+            _remove_link(os.path.join(package_folder, ACTIVE_FILE))
+            try:
+                os.rmdir(package_folder)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                kept = kept or [package_folder]
+            if kept:
+                writeLog("WARNING", f"Se conserva {package_folder}: contiene archivos que no instaló el paquete")
+                _notify(notify, f"Se conserva {package_folder}: contiene archivos que no instaló el paquete")
+        elif os.path.exists(package_folder):
+            shutil.rmtree(package_folder)
+    except PermissionError as e:
+        writeLog("ERROR", f"KMD no tiene permisos para borrar los archivos de {package_id}: {e}")
+        raise PermissionDeniedError(f"KMD no tiene permisos para borrar los archivos de {package_id}: {e}") from e
+    except OSError as e:
+        writeLog("ERROR", f"Ha ocurrido un error durante la desinstalación: {e}")
+        _notify(notify, f"Ha ocurrido un error durante la desinstalación: {e}")
+
+    # Liberar del almacén los archivos (de todas sus versiones) que ya no usa ningún otro paquete
+    store_objects = set(package.get('storeObjects', []))
+    for saved in package.get('installedVersions', {}).values():
+        store_objects.update(saved.get('storeObjects', []))
+    removed, freed = release_store_objects(store_objects)
+    if removed:
+        writeLog("INFO", f"Se liberaron {removed} archivos del almacén ({freed} bytes)")
+
+    unregister_package(package_id)
+    writeLog("OK", f"Paquete '{package_id}' desinstalado.")
+    return UninstallResult(package_id, package.get('version'))
+
+@record_operation("repair")
+@with_package_lock
+def repair(package_id, on_hash_mismatch="abort", progress=None, notify=None):
     """
-    os.makedirs(INSTALL_PATH, exist_ok=True)
-    installed_file = os.path.join(INSTALL_PATH, 'installed.json')
+    Reinstala un paquete en su versión actual: la descarga otra vez y vuelve a enlazar en su carpeta
+    todos los archivos del paquete, escribiéndolos de nuevo en el almacén (así también se arreglan los
+    que se hubieran editado a través de otro paquete que los comparte), y ejecuta su postinstall.
+    No se desinstala nada: las demás versiones instaladas (para rollback) no se tocan y, si algo falla,
+    el paquete sigue instalado.
+    Devuelve el InstallResult de la reinstalación. Lanza NotInstalledError si no está instalado.
+    """
+    entry = get_package_entry(package_id)
+    installed_pkg = _installed_by_id().get(package_id)
+    if not installed_pkg:
+        writeLog("ERROR", f"El paquete {package_id} no está instalado.")
+        raise NotInstalledError(f"El paquete {package_id} no está instalado.")
 
-    if os.path.exists(installed_file):
-        try:
-            with open(installed_file, 'r') as f:
-                installed = json.load(f)
-        except json.JSONDecodeError:
-            writeLog("ERROR", "El archivo installed.json está corrupto o malformado")
-            print(f"Error: Ha ocurrido un error mientras se instalaba {manifest['author']}@{manifest['name']}.")
-            return "ERROR"
+    current_version = installed_pkg.get('version', '')
+    writeLog("INFO", f"Reinstalando {package_id} en su versión actual: {current_version}...")
+    _notify(notify, f"Reinstalando {package_id} en su versión actual: {current_version}...")
+    zip_path = None
+    try:
+        _check_write_permission(INSTALL_PATH)
+        selected_version = select_version(entry, package_id, current_version)
+        zip_path = _download_verified(package_id, selected_version, on_hash_mismatch, progress, notify)
+        result = _install_downloaded(package_id, zip_path, selected_version, on_hash_mismatch, progress, notify,
+                                     fresh_store=True)
+    except KMDError as e:
+        writeLog("ERROR", f"Error durante la reparación de {package_id}: {e}")
+        raise
+    except PermissionError as e:
+        writeLog("ERROR", f"KMD no tiene permisos para reparar {package_id}: {e}")
+        raise PermissionDeniedError(str(e)) from e
+    except Exception as e:
+        writeLog("ERROR", f"Error durante la reparación de {package_id}: {e}")
+        raise KMDError(str(e)) from e
+    finally:
+        if zip_path and os.path.exists(zip_path):
+            os.remove(zip_path)
+    writeLog("OK", f"Paquete {package_id} reparado (versión {current_version}).")
+    return result
+
+@record_operation("update")
+@with_package_lock
+def update(package_id, on_hash_mismatch="abort", progress=None, notify=None):
+    """
+    Actualiza un paquete a su última versión disponible.
+    Si el paquete no está instalado, lo instala en su última versión.
+    La nueva versión se instala al lado de la actual y solo entonces pasa a ser la activa, así que si algo
+    falla el paquete instalado no se toca. La versión anterior queda instalada (para rollback) hasta el
+    próximo gc. Si la nueva versión ya estaba instalada, solo se activa.
+    Devuelve un UpdateResult con status "updated", "installed" o "up-to-date".
+    """
+    entry = get_package_entry(package_id)
+    latest_version = select_version(entry, package_id)
+    latest_version_name = latest_version.get('versionName', latest_version.get('vName', ''))
+
+    installed_pkg = _installed_by_id().get(package_id)
+    current_version = installed_pkg.get('version', '') if installed_pkg else None
+    if installed_pkg:
+        if not is_newer_version(latest_version_name, current_version):
+            writeLog("OK", f"{package_id} ya está actualizado a la versión {current_version}.")
+            return UpdateResult(package_id, current_version, current_version, "up-to-date")
+        writeLog("INFO", f"Actualizando {package_id} de {current_version} a {latest_version_name}...")
+        _notify(notify, f"Actualizando {package_id} de {current_version} a {latest_version_name}...")
     else:
-        installed = {"installed": []}
+        writeLog("INFO", f"{package_id} no está instalado, instalando versión {latest_version_name}...")
+        _notify(notify, f"{package_id} no está instalado, instalando versión {latest_version_name}...")
 
-    # Construir el ID del paquete
-    package_id = f"{manifest['author']}@{manifest['name']}"
+    zip_path = None
+    try:
+        _check_write_permission(INSTALL_PATH)
+        if installed_pkg and _has_version(installed_pkg, latest_version_name):
+            activate_version(package_id, latest_version_name, on_hash_mismatch, progress, notify)
+        else:
+            zip_path = _download_verified(package_id, latest_version, on_hash_mismatch, progress, notify)
+            _install_downloaded(package_id, zip_path, latest_version, on_hash_mismatch, progress, notify)
+    except KMDError as e:
+        writeLog("ERROR", f"Error durante la actualización de {package_id}: {e}")
+        raise
+    except PermissionError as e:
+        writeLog("ERROR", f"KMD no tiene permisos para actualizar {package_id}: {e}")
+        raise PermissionDeniedError(str(e)) from e
+    except Exception as e:
+        writeLog("ERROR", f"Error durante la actualización de {package_id}: {e}")
+        raise KMDError(str(e)) from e
+    finally:
+        if zip_path and os.path.exists(zip_path):
+            os.remove(zip_path)
 
-    # Actualizar dependents en cada dependencia (si existen)
-    if 'dependencies' in manifest:
-        for dep in manifest['dependencies']:
-            dep_id = dep['id']  # El ID de la dependencia, tipo "CeccPro@testLib"
-            for pkg in installed['installed']:
-                pkg_id = f"{pkg['author']}@{pkg['name']}"
-                if pkg_id == dep_id:
-                    if 'dependents' not in pkg:
-                        pkg['dependents'] = []
-                    if package_id not in pkg['dependents']:
-                        pkg['dependents'].append(package_id)
-
-    # Asegurar que el paquete tenga al menos el campo dependents vacío
-    if 'dependents' not in manifest:
-        manifest['dependents'] = []
-
-    # Reemplazar si ya estaba
-    installed['installed'] = [p for p in installed['installed'] if f"{p['author']}@{p['name']}" != package_id]
-    installed['installed'].append(manifest)
-
-    # Guardar cambios
-    with open(installed_file, 'w') as f:
-        json.dump(installed, f, indent=4)
+    writeLog("OK", f"Paquete {package_id} actualizado a {latest_version_name}.")
+    return UpdateResult(package_id, current_version, latest_version_name, "updated" if installed_pkg else "installed")
 
-    writeLog("OK", f"El paquete {package_id} se registró correctamente")
-    print(f"Paquete {package_id} registrado correctamente")
-    return "OK"
+def list_outdated():
+    """
+    Compara en una sola pasada los paquetes instalados con el índice.
+    Devuelve una lista de OutdatedPackage (ordenada por ID) con los que tienen una versión más reciente.
+    Lanza RegistryError si el registro está corrupto.
+    """
+    installed = _installed_by_id()
+    latest_versions = installed_latest_versions(installed)
+    return [
+        OutdatedPackage(package_id, pkg.get('version', ''), latest_versions[package_id])
+        for package_id, pkg in sorted(installed.items())
+        if latest_versions.get(package_id) and is_newer_version(latest_versions[package_id], pkg.get('version', ''))
+    ]
 
-def list_all_packages():
+def whats_new():
     """
-    Lista todos los paquetes disponibles en el índice, excluyendo los paquetes definidos en EXCLUDED_PACKAGES.
-    Muestra el ID del paquete y su descripción.
+    Devuelve el último CatalogDiff guardado (los cambios del índice en su última actualización),
+    o None si todavía no se vio cambiar. Solo lee la caché: no descarga nada.
     """
-    index = get_index()
-    print("Paquetes disponibles:")
-    for p in index:
-        package_id = f"{p['author']}@{p['name']}"
-        if package_id in EXCLUDED_PACKAGES:
-            continue
-        desc = p.get('description', 'Sin descripción')
-        print(f"{package_id}: {desc}")
-    print("\n")
+    diffs = read_catalog_diffs()
+    return diffs[-1] if diffs else None
 
-def install_package(package_id, version=None, installExcludedPackages=False, KMDautoupdate=False):
+def plan_updates(package_ids, installed):
     """
-    Instala un paquete dado su ID (formato: Author@PackageName) y una versión opcional.
-    package_id: ID del paquete en formato "Autor@Nombre".
-    version: Versión específica a instalar, si se desea. Si es None, instala la última versión.
-    Devuelve "OK" si la instalación fue exitosa, o "ERROR" en caso de fallo.
+    Agrupa actualizaciones en lotes: cada paquete va en un lote posterior a los de sus dependencias
+    (según el registro) que también se actualizan. Los paquetes de un mismo lote no dependen entre sí,
+    así que se pueden actualizar en paralelo.
+    installed: Los paquetes instalados por ID (ver _installed_by_id).
+    Devuelve una lista de lotes (listas de IDs).
+    """
+    pending = set(package_ids)
+    batches = []
+    while pending:
+        batch = sorted(
+            package_id for package_id in pending
+            if not any(dep.get('id') in pending and dep.get('id') != package_id
+                       for dep in installed.get(package_id, {}).get('dependencies', []))
+        )
+        if not batch:
+            # Dependencias circulares: se actualiza el resto de una vez
+            batch = sorted(pending)
+        batches.append(batch)
+        pending.difference_update(batch)
+    return batches
+
+def _thread_context():
+    """
+    Captura lo que un hilo trabajador tiene que heredar del hilo actual (en el daemon: a qué cliente
+    se envía la salida y a quién se le hacen las preguntas).
+    Devuelve una función que lo aplica en el hilo que la llame.
+    """
+    ask = getattr(_prompt_handler, "ask", None)
+    sinks = [(stream, getattr(stream.local, "sink", None))
+             for stream in (sys.stdout, sys.stderr) if isinstance(stream, _ThreadOutput)]
+
+    def apply():
+        _prompt_handler.ask = ask
+        for stream, sink in sinks:
+            stream.local.sink = sink
+    return apply
+
+def run_parallel(func, items, workers):
+    """
+    Ejecuta func(item) para cada item en un pool de hasta workers hilos que heredan el contexto
+    del hilo actual (ver _thread_context).
+    Devuelve los resultados en el mismo orden que items.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    apply = _thread_context()
+
+    def run(item):
+        apply()
+        return func(item)
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as pool:
+        return list(pool.map(run, items))
+
+def update_all(on_hash_mismatch="abort", progress=None, notify=None, workers=None):
+    """
+    Actualiza todos los paquetes instalados a su última versión disponible.
+    Las versiones se comparan con el índice en una sola pasada y solo se actualizan los paquetes
+    desactualizados, por lotes (ver plan_updates) y en paralelo dentro de cada lote.
+    Los paquetes que no están en el índice o no tienen versión 'latest' se omiten ("skipped"),
+    y los que fallan se devuelven con status "failed" sin detener al resto.
+    workers: Actualizaciones simultáneas (JOBS por defecto).
+    Devuelve una lista de UpdateResult, ordenada por ID.
     """
-    installed_file = os.path.join(INSTALL_PATH, 'installed.json')
-    if os.path.exists(installed_file):
-        writeLog("OK", "La lista de paquetes instalados existe.")
+    results = []
+    installed = _installed_by_id()
+    latest_versions = installed_latest_versions(installed)
+    outdated = {}
+    for package_id, pkg in installed.items():
+        current_version = pkg.get('version', '')
+
+        # Buscar paquete en el índice
+        if package_id not in latest_versions:
+            writeLog("WARNING", f"No se encontró el paquete {package_id} en el índice, saltando...")
+            _notify(notify, f"No se encontró el paquete {package_id} en el índice, saltando...")
+            results.append(UpdateResult(package_id, current_version, None, "skipped", "No está en el índice"))
+            continue
+
+        # Buscar la versión latest
+        latest_version_name = latest_versions[package_id]
+        if not latest_version_name:
+            writeLog("WARNING", f"No hay versión 'latest' para {package_id}, saltando...")
+            _notify(notify, f"No hay versión 'latest' para {package_id}, saltando...")
+            results.append(UpdateResult(package_id, current_version, None, "skipped", "No tiene versión 'latest'"))
+            continue
+
+        if not is_newer_version(latest_version_name, current_version):
+            writeLog("OK", f"{package_id} ya está en la última versión ({current_version}).")
+            _notify(notify, f"{package_id} ya está en la última versión ({current_version}).")
+            results.append(UpdateResult(package_id, current_version, current_version, "up-to-date"))
+            continue
+        outdated[package_id] = (current_version, latest_version_name)
+
+    def update_one(package_id):
         try:
-            with open(installed_file, 'r') as f:
-                installed = json.load(f).get('installed', [])
-        except json.JSONDecodeError:
-            writeLog("ERROR", "El archivo installed.json está corrupto o malformado. Abortando instalación...")
-            print(f"Error: Ha ocurrido un error mientras se instalaba {package_id}.")
-            return "ERROR"
-        if any(f"{p['author']}@{p['name']}" == package_id for p in installed):
-            writeLog("OK", f"El paquete {package_id} ya está instalado. Omitiendo instalación")
-            print(f"El paquete {package_id} ya está instalado. Omitiendo instalación.")
-            return "OK"
+            return update(package_id, on_hash_mismatch=on_hash_mismatch, progress=progress, notify=notify)
+        except KMDError as e:
+            current_version, latest_version_name = outdated[package_id]
+            writeLog("ERROR", f"Error al actualizar {package_id}: {e}")
+            _notify(notify, f"Error al actualizar {package_id}: {e}")
+            return UpdateResult(package_id, current_version, latest_version_name, "failed", str(e))
+
+    batches = plan_updates(outdated, installed)
+    if batches:
+        writeLog("INFO", f"Plan de actualización: {len(outdated)} paquete(s) en {len(batches)} lote(s)")
+    for batch in batches:
+        results.extend(run_parallel(update_one, batch, workers or JOBS))
+    return sorted(results, key=lambda r: r.id)
+
+def autoremove(notify=None):
+    """
+    Elimina paquetes huérfanos que no tienen dependientes.
+    Un paquete se considera huérfano si lo instalaron otros paquetes (tiene dependents), pero ninguno de ellos sigue instalado.
+    Devuelve la lista de IDs eliminados.
+    """
+    removed = []
+    changes = True  # Para seguir limpiando en cascada
+    while changes:
+        installed = _installed_by_id()
+        to_remove = [
+            pkg_id for pkg_id, pkg in installed.items()
+            if pkg.get('dependents') and all(dep not in installed for dep in pkg['dependents'])
+        ]
+        changes = bool(to_remove)
+        for pkg_id in to_remove:
+            uninstall(pkg_id, on_dependents="continue", notify=notify)
+            writeLog("INFO", f"Se eliminó el paquete huérfano: {pkg_id}")
+            _notify(notify, f"Se eliminó el paquete huérfano: {pkg_id}")
+            removed.append(pkg_id)
+    if not removed:
+        writeLog("INFO", "No hay paquetes huérfanos para eliminar.")
+    return removed
 
-    zip_path = None
+def gc(keep_previous=False, notify=None):
+    """
+    Borra las versiones inactivas de los paquetes instalados y libera del almacén los archivos que ya no usa nadie.
+    keep_previous: Conserva la versión anterior de cada paquete (la que usaría rollback).
+    Devuelve la lista de CollectedVersion borradas.
+    """
+    collected = []
+    for package_id in sorted(_installed_by_id()):
+        with package_lock(package_id):
+            pkg = _installed_by_id().get(package_id)
+            if not pkg or 'installedVersions' not in pkg:
+                continue
+            pkg = dict(pkg, installedVersions=dict(pkg['installedVersions']))
+            keep = {pkg.get('version')}
+            if keep_previous:
+                keep.add(pkg.get('previousVersion'))
+            inactive = [v for v in pkg['installedVersions'] if v not in keep]
+            if not inactive:
+                continue
+            for version in inactive:
+                try:
+                    if not remove_version_folder(pkg['name'], version, pkg['installedVersions'][version]):
+                        writeLog("WARNING", f"Se conserva la carpeta de {package_id} {version}: contiene archivos que no instaló el paquete")
+                except OSError as e:
+                    writeLog("ERROR", f"No se pudo borrar {package_id} {version}: {e}")
+                    continue
+                saved = pkg['installedVersions'].pop(version)
+                _, freed = release_store_objects(saved.get('storeObjects', []))
+                writeLog("INFO", f"Versión inactiva borrada: {package_id} {version} ({freed} bytes liberados)")
+                _notify(notify, f"Versión inactiva borrada: {package_id} {version}")
+                collected.append(CollectedVersion(package_id, version, freed))
+            if pkg.get('previousVersion') not in pkg['installedVersions']:
+                pkg.pop('previousVersion', None)
+            register_package(pkg)
+    if not collected:
+        writeLog("INFO", "No hay versiones inactivas para borrar.")
+    return collected
+
+def verify(package_ids=None, full=False, notify=None):
+    """
+    Comprueba que los archivos de la versión activa de los paquetes instalados siguen como se instalaron
+    (la lista que guardó extract_package). Primero se compara el tamaño y, si coincide, el hash; los
+    archivos de todos los paquetes se hashean juntos en JOBS hilos.
+    Si el paquete guardó una huella rápida (localDigest) se usa esa; si no, o con full, SHA-256.
+    package_ids: IDs a comprobar (por defecto, todos los instalados).
+    Devuelve una lista de VerifyResult. Lanza NotInstalledError si algún ID no está instalado.
+    """
+    installed = _installed_by_id()
+    if package_ids is None:
+        package_ids = sorted(installed)
+    for package_id in package_ids:
+        if package_id not in installed:
+            raise NotInstalledError(f"El paquete {package_id} no está instalado.")
+
+    results = []
+    checks = []
+    for package_id in package_ids:
+        pkg = installed[package_id]
+        version = pkg.get('version')
+        saved = (pkg.get('installedVersions') or {}).get(version) or {}
+        if 'files' not in saved:
+            results.append(VerifyResult(package_id, version, "unverifiable"))
+            continue
+        algorithm = None if full else saved.get('localDigest')
+        if algorithm:
+            try:
+                new_hasher(algorithm)
+            except ImportError:
+                writeLog("WARNING", f"No se puede calcular la huella {algorithm} de {package_id}: se usa SHA-256")
+                algorithm = None
+        result = VerifyResult(package_id, version, "ok", algorithm or "sha256")
+        results.append(result)
+        folder = get_version_folder(pkg['name'], version)
+        for entry in saved['files']:
+            if entry[0].endswith("/"):
+                continue
+            result.files += 1
+            result.size += entry[1]
+            expected = (algorithm, entry[3]) if algorithm and len(entry) > 3 else ("sha256", entry[2])
+            checks.append((result, entry[0], _member_path(folder, entry[0]), entry[1], expected))
+
+    def check(item):
+        _, _, path, size, (algorithm, expected) = item
+        try:
+            if os.path.getsize(path) != size:
+                return "modified"
+            return "ok" if hash_file(path, algorithm) == expected else "modified"
+        except FileNotFoundError:
+            return "missing"
+        except OSError as e:
+            writeLog("WARNING", f"No se pudo leer {path}: {e}")
+            return "modified"
+
+    for (result, relative, _, _, _), status in zip(checks, run_parallel(check, checks, JOBS)):
+        if status == "missing":
+            result.missing.append(relative)
+        elif status == "modified":
+            result.modified.append(relative)
+
+    for result in results:
+        if result.missing or result.modified:
+            result.status = "modified"
+            writeLog("WARNING", f"{result.id} {result.version}: {len(result.modified)} archivos modificados, {len(result.missing)} faltan")
+            _notify(notify, f"{result.id}: {len(result.modified)} archivos modificados, {len(result.missing)} faltan")
+        elif result.status == "ok":
+            writeLog("INFO", f"{result.id} {result.version}: {result.files} archivos correctos ({result.algorithm})")
+    return results
+
+def _mirror_name(text):
+    return "".join(c if c.isalnum() or c in "-_.+@" else "_" for c in str(text)).strip(".") or "_"
+
+def _mirror_archive(url, expected_hash, path):
+    """
+    Copia un paquete al mirror, salvo que ya esté con el hash esperado.
+    Devuelve los bytes descargados (0 si ya estaba). Lanza HashMismatchError o KMDError.
+    """
+    import hashlib
+    if os.path.exists(path) and hash_file(path) == expected_hash:
+        return 0
+
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = f"{path}.download"
+    with Transfer(url, url) as transfer:
+        response = get_http_session().get(url, stream=True, timeout=30)
+        if response.status_code != 200:
+            raise KMDError(f"No se pudo descargar {url} (HTTP {response.status_code})")
+
+        def chunks():
+            nonlocal size
+            for chunk in response.iter_content(INDEX_CHUNK_SIZE):
+                digest.update(chunk)
+                size += len(chunk)
+                transfer.add(len(chunk))
+                yield chunk
+
+        write_file_atomic(tmp_path, chunks())
+    if digest.hexdigest() != expected_hash:
+        os.remove(tmp_path)
+        raise HashMismatchError(f"El hash de {url} no coincide con el del índice")
+    os.replace(tmp_path, path)
+    return size
+
+def read_lock_file(path):
+    """
+    Lee una lista de paquetes con versión fija para prefetch. Cada línea es "Autor@Nombre [versión]"
+    o un objeto JSON con "id" y "version" (p. ej. la salida de kmd list-installed --json de otra máquina).
+    Las líneas vacías y las que empiezan por # se ignoran.
+    Devuelve una lista de (ID, versión o None). Lanza KMDError si el archivo no se puede leer.
+    """
+    entries = []
     try:
-        writeLog("INFO", "Creando carpeta de paquetes (Si no existe ya)")
-        os.makedirs(INSTALL_PATH, exist_ok=True)
-        author, pkg_name = package_id.split('@')
-        index = get_index()
+        with open(path, 'r', encoding='utf-8') as f:
+            for number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                if line.startswith("{"):
+                    item = json.loads(line)
+                    entries.append((item["id"], item.get("version")))
+                else:
+                    parts = line.split()
+                    entries.append((parts[0], parts[1] if len(parts) > 1 else None))
+    except (OSError, ValueError, KeyError) as e:
+        raise KMDError(f"No se pudo leer la lista de paquetes {path}: {e}") from e
+    return entries
 
-        # Verificar si KMD tiene permisos de admin
-        if ctypes.windll.shell32.IsUserAnAdmin() == 1:
-            writeLog("OK", "KMD tiene permisos de admin")
+def prefetch(package_ids=None, outdated=False, lock_entries=None, notify=None):
+    """
+    Descarga por adelantado, sin extraer ni registrar nada, los paquetes que necesitarían install o update-all,
+    para que la instalación de verdad no tenga que esperar a la red (ver _take_prefetched).
+    Los paquetes se guardan verificados en la caché (ver get_archive_cache_path), junto con las dependencias
+    que les falten, y sus descargas ceden el turno a las de otras operaciones (PREFETCH_PRIORITY).
+    package_ids: IDs a descargar en su última versión.
+    outdated: Descarga también la última versión de los paquetes desactualizados.
+    lock_entries: Lista de (ID, versión) (ver read_lock_file).
+    Devuelve una lista de PrefetchResult.
+    """
+    import shutil
+    installed = _installed_by_id()
+    targets = [(package_id, None) for package_id in package_ids or []]
+    if outdated:
+        targets += [(p.id, p.latest_version) for p in list_outdated()]
+    targets += list(lock_entries or [])
+
+    def fetch(target):
+        package_id, version = target
+        try:
+            selected = select_version(get_package_entry(package_id), package_id, version)
+            version = selected['versionName']
+            pkg = installed.get(package_id)
+            if pkg and (pkg.get('version') == version or _has_version(pkg, version)):
+                return PrefetchResult(package_id, version, "installed"), []
+
+            cached_path = get_archive_cache_path(selected['hash'])
+            if os.path.exists(cached_path) and verify_hash(cached_path, selected['hash']):
+                status = "cached"
+            else:
+                previous = getattr(_transfer_context, "priority", 0)
+                _transfer_context.priority = PREFETCH_PRIORITY
+                try:
+                    zip_path = _download_verified(package_id, selected, "abort", None, notify)
+                finally:
+                    _transfer_context.priority = previous
+                os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+                shutil.move(zip_path, cached_path)
+                status = "downloaded"
+            manifest = extract_and_validate_manifest(cached_path)
+        except KMDError as e:
+            writeLog("ERROR", f"No se pudo descargar por adelantado {package_id} {version or ''}: {e}")
+            return PrefetchResult(package_id, version, "failed", error=str(e)), []
+        writeLog("OK", f"{package_id} {version} listo en la caché ({status})")
+        _notify(notify, f"{package_id} {version}: {'descargado' if status == 'downloaded' else 'ya estaba descargado'}")
+        # Las dependencias ya instaladas no se descargan al instalar (ver install_dependencies)
+        dependencies = [(dep.get('id'), dep.get('version')) for dep in manifest.get('dependencies', [])
+                        if dep.get('id') not in installed]
+        return PrefetchResult(package_id, version, status, os.path.getsize(cached_path)), dependencies
+
+    results = []
+    seen = set()
+    while targets:
+        level = []
+        for target in targets:
+            if target not in seen:
+                seen.add(target)
+                level.append(target)
+        targets = []
+        for result, dependencies in run_parallel(fetch, level, JOBS):
+            results.append(result)
+            targets += dependencies
+    return results
+
+def mirror(dest, package_ids=None, all_versions=False, notify=None):
+    """
+    Crea o actualiza un mirror local del índice en la carpeta dest: copia los paquetes y escribe un
+    index.json que apunta a ellos con rutas relativas. Después, KMD puede usar la carpeta (o su index.json,
+    o servirla por HTTP) como índice, sin acceso a internet.
+    Solo se descargan los paquetes que faltan o cuyo hash no coincide con el del índice.
+    package_ids: Paquetes a copiar (por defecto, todos). Se añaden también sus dependencias y KMD.
+    all_versions: Copia todas las versiones, no solo la última (y las que pidan las dependencias).
+    Devuelve un MirrorResult.
+    """
+    from urllib.parse import quote
+    dest = os.path.abspath(dest)
+    if package_ids:
+        # KMD también se copia, para que las comprobaciones de actualización funcionen desde el mirror
+        package_ids = list(dict.fromkeys([*package_ids, *(p for p in EXCLUDED_PACKAGES if find_index_entry(p))]))
+        for package_id in package_ids:
+            parse_package_id(package_id)
+        entries = find_index_entries(package_ids)
+        missing = [p for p in package_ids if p not in entries]
+        if missing:
+            writeLog("ERROR", f"Paquetes no encontrados en el índice: {', '.join(missing)}")
+            raise PackageNotFoundError(f"Paquetes no encontrados en el índice: {', '.join(missing)}")
+    else:
+        entries = {f"{p['author']}@{p['name']}": p for p in get_catalog().packages}
+
+    # (ID, versión) -> entrada de la versión; se completa con las dependencias de cada paquete copiado
+    wanted = {}
+    def want(package_id, version_entry):
+        key = (package_id, version_entry.get('versionName'))
+        if key in wanted:
+            return False
+        wanted[key] = version_entry
+        return True
+
+    pending = []
+    for package_id, entry in entries.items():
+        for version_entry in (entry['versions'] if all_versions else [select_version(entry, package_id)]):
+            if want(package_id, version_entry):
+                pending.append((package_id, version_entry))
+
+    mirrored = {}
+    failed = []
+    downloaded = skipped = downloaded_bytes = 0
+
+    def copy(item):
+        package_id, version_entry = item
+        author, name = parse_package_id(package_id)
+        version_name = version_entry['versionName']
+        relative = f"packages/{_mirror_name(author)}/{_mirror_name(name)}/{_mirror_name(version_name)}.zip"
+        path = os.path.join(dest, *relative.split("/"))
+        try:
+            size = _mirror_archive(resolve_download_url(version_entry['downloadURL']), version_entry.get('hash'), path)
+            manifest = extract_and_validate_manifest(path)
+        except KMDError as e:
+            writeLog("ERROR", f"No se pudo copiar {package_id} {version_name} al mirror: {e}")
+            _notify(notify, f"Error al copiar {package_id} {version_name}: {e}")
+            return item, None, e, 0
+        if size:
+            writeLog("INFO", f"Copiado al mirror: {package_id} {version_name} ({size} bytes)")
+            _notify(notify, f"Descargado {package_id} {version_name}")
+        return item, (quote(relative), manifest), None, size
+
+    while pending:
+        dependencies = []
+        for (package_id, version_entry), copied, error, size in run_parallel(copy, pending, JOBS):
+            if error is not None:
+                failed.append((package_id, version_entry['versionName'], str(error)))
+                continue
+            relative, manifest = copied
+            mirrored[(package_id, version_entry['versionName'])] = relative
+            if size:
+                downloaded += 1
+                downloaded_bytes += size
+            else:
+                skipped += 1
+            dependencies.extend(dep for dep in manifest.get('dependencies', []) if dep.get('id'))
+
+        # Las dependencias que falten se copian en la siguiente ronda
+        pending = []
+        missing = sorted({dep['id'] for dep in dependencies} - set(entries))
+        entries.update(find_index_entries(missing) if missing else {})
+        for dep in dependencies:
+            entry = entries.get(dep['id'])
+            if entry is None:
+                failed.append((dep['id'], dep.get('version'), "no está en el índice"))
+                continue
+            try:
+                version_entry = select_version(entry, dep['id'], dep.get('version'))
+            except KMDError as e:
+                failed.append((dep['id'], dep.get('version'), str(e)))
+                continue
+            if want(dep['id'], version_entry):
+                pending.append((dep['id'], version_entry))
+
+    # Índice del mirror: solo los paquetes y versiones copiados, con URLs relativas
+    index = []
+    for package_id in sorted(entries):
+        entry = entries[package_id]
+        versions = [
+            dict(v, downloadURL=mirrored[(package_id, v.get('versionName'))])
+            for v in entry['versions'] if (package_id, v.get('versionName')) in mirrored
+        ]
+        if versions:
+            index.append(dict(entry, versions=versions))
+    write_file_atomic(os.path.join(dest, "index.json"), json.dumps(index, ensure_ascii=False, indent=1))
+    writeLog("OK", f"Mirror actualizado en {dest}: {len(index)} paquetes, {downloaded} descargados, {skipped} sin cambios")
+    return MirrorResult(dest, len(index), len(mirrored), downloaded, skipped, downloaded_bytes, failed)
+
+def cache_stats():
+    """
+    Calcula el estado de la caché de descargas (CACHE_PATH) y del almacén de archivos.
+    Devuelve un CacheStats.
+    """
+    objects = references = stored = saved = orphaned = orphaned_bytes = 0
+    for _, size, refs in iter_store_objects():
+        objects += 1
+        references += refs
+        stored += size
+        if refs:
+            saved += size * (refs - 1)
         else:
-            writeLog("WARNING", "KMD no tiene permisos de admin. Esto podría ocasionar errores.")
+            orphaned += 1
+            orphaned_bytes += size
 
-        # Archivo temporal para verificar si se necesitan permisos de admin
-        writeLog("INFO", "Creando archivo temporal para verificar permisos de admin...")
-        test_path = os.path.join(INSTALL_PATH, "__perm_check.tmp")
-        with open(test_path, 'w') as f:
-            f.write("test")
-        if os.path.exists(test_path):
-            writeLog("OK", "Archivo temporal creado exitosamente!")
-        os.remove(test_path)
+    cache_bytes = 0
+    for folder, _, files in os.walk(CACHE_PATH):
+        for file in files:
+            try:
+                cache_bytes += os.path.getsize(os.path.join(folder, file))
+            except OSError:
+                pass
+    return CacheStats(objects, references, stored, saved, orphaned, orphaned_bytes, cache_bytes)
 
-        # Buscar el paquete
-        writeLog("INFO", "Buscando paquete en el index...")
-        entry = next((p for p in index if p['author'] == author and p['name'] == pkg_name), None)
-        if not entry or (not installExcludedPackages and f"{entry['author']}@{entry['name']}" in EXCLUDED_PACKAGES):
-            writeLog("ERROR", f"Paquete {package_id} no encontrado en el índice")
-            raise Exception(f"Paquete {package_id} no encontrado en el índice")
-
-        # Elegir versión según el parámetro
-        if version:
-            writeLog("INFO", f"Instalando versión {version}...")
-            selected_version = next((v for v in entry['versions'] if v['versionName'] == version), None)
-            if not selected_version:
-                writeLog("ERROR", f"La versión '{version}' de {package_id} no existe.")
-                raise Exception(f"La versión '{version}' de {package_id} no existe.")
-        else:
-            writeLog("INFO", "No se especificó una versión. Instalando latest...")
-            selected_version = next((v for v in entry['versions'] if v.get('latest', False)), None)
-            if not selected_version:
-                writeLog("ERROR", f"No se encontró una versión latest para {package_id}")
-                raise Exception(f"No se encontró una versión latest para {package_id}")
-
-        # Descargar paquete (usa el parámetro version, aunque sea None)
-        zip_path, _ = download_package(package_id, version)
-
-        # Validar hash contra la versión correcta
-        writeLog("INFO", "Comparando el hash del paquete...")
-        if not verify_hash(zip_path, selected_version['hash']):
-            print("El hash no coincide con el esperado.")
-            writeLog("WARNING", "El hash del paquete no coincide con el esperado")
-            userInput = input("¿Deseas continuar con la instalación? (S/N) > ")
-            if userInput.lower() not in ["s", "y"]:
-                writeLog("ERROR", "El usuario ha decidido abortar la instalación")
-                raise Exception("Abortando instalación.")
-
-        # Extraer y validar manifest
-        manifest = extract_and_validate_manifest(zip_path)
-        if manifest == "ERROR":
-            writeLog("ERROR", f"Ha ocurrido un error mientras se instalaba {package_id}. Abortando...")
-            raise Exception(f"Ha ocurrido un error mientras se instalaba {package_id}. Abortando...")
-
-        # Instalar dependencias
-        writeLog("INFO", "Instalando dependencias...")
-        returnCode = install_dependencies(manifest)
-        if returnCode != "OK":
-            writeLog("ERROR", "Error al instalar dependencias. Abortando instalación.")
-            raise Exception("Error al instalar dependencias. Abortando instalación.")
-
-        # Extraer paquete
-        writeLog("INFO", "Extrayendo paquete...")
-        package_path = extract_package(zip_path, manifest['name'])
-
-        # Ejecutar postinstall si existe
-        run_postinstall(manifest, package_path)
-
-        # Registrar el paquete como instalado
-        if not package_id in EXCLUDED_REGISTER_PACKAGES:
-            regCode = register_package(manifest)
-            if regCode != "OK":
-                writeLog("ERROR", "Ha ocurrido un error mientras se registraba el paquete")
-                print(f"Ha ocurrido un error mientras se instalaba {package_id}")
-        else:
-            # Si el paquete está en la lista de paquetes excluidos de registro, no lo registramos
-            writeLog("INFO", f"El paquete {package_id} está en la lista de paquetes excluidos de registro. No se registrará.")
+def prune_store(notify=None):
+    """
+    Borra del almacén los objetos que ya no usa ningún paquete y los temporales que hayan quedado.
+    Devuelve (objetos borrados, bytes liberados).
+    """
+    orphans = [digest for digest, _, refs in iter_store_objects() if not refs]
+    removed, freed = release_store_objects(orphans)
+    remove_tree(os.path.join(get_store_path(), "tmp"))
+    writeLog("INFO", f"Almacén limpiado: {removed} objetos borrados ({freed} bytes)")
+    _notify(notify, f"Se borraron {removed} archivos sin usar del almacén")
+    return removed, freed
 
-        writeLog("OK", f"El paquete {package_id} se ha instalado correctamente!")
-        print(f"Paquete {package_id} v{selected_version['versionName']} instalado con éxito")
+# -- CLI --
+# Las funciones de esta sección envuelven la API: imprimen los resultados, preguntan al usuario
+# cuando hace falta y convierten los errores en mensajes.
 
-    except PermissionError as e:
-        writeLog("WARNING", f"KMD no tiene permisos de admin. Error obtenido: {e}. (Relanzando...)")
-        # Verificar y ejecutar como admin
-        isadmin = run_as_admin()
-        if not isadmin:
-            writeLog("ERROR", "No se pudo ejecutar KMD con permisos de administrador")
-            raise Exception("No se pudo ejecutar KMD con permisos de administrador")
-        
-    except KeyboardInterrupt:
-        writeLog("ERROR", f"El usuario interrumpió la instalación con KeyboardInterrupt")
-        print("Abortando instalalción...")
+_prompt_handler = threading.local() # Permite que el daemon redirija las preguntas a cada cliente
+_prompt_lock = threading.Lock() # Una sola pregunta a la vez (p. ej. durante un update-all en paralelo)
 
-    except Exception as e:
-        writeLog("ERROR", f"Error durante la instalación de {package_id}: {e}")
-        print(f"Error durante la instalación de {package_id}: {e}")
+def ask_yes_no(question):
+    """
+    Pregunta algo al usuario. Devuelve True si responde "s" o "y".
+    Sin terminal (p. ej. en el daemon), la respuesta es "no".
+    """
+    try:
+        ask = getattr(_prompt_handler, "ask", None) # En el daemon, la pregunta se le hace al cliente
+        with _prompt_lock:
+            userInput = ask(question) if ask else input(question)
+    except EOFError:
+        writeLog("WARNING", "No hay terminal para preguntar al usuario. Se asume 'no'")
+        return False
+    return userInput.strip().lower() in ["s", "y"]
 
-    finally:
-        if zip_path and os.path.exists(zip_path):
-            writeLog("INFO", "Eliminando archivos temporales...")
-            os.remove(zip_path)
-    return "OK"
+def _ask_hash_mismatch(package_id, expected_hash):
+    print("El hash no coincide con el esperado.")
+    return ask_yes_no("¿Deseas continuar con la instalación? (S/N) > ")
 
-def uninstall_package(package_id):
+def _ask_dependents(package_id, dependents):
+    for depender_id in dependents:
+        print(f"Advertencia: '{depender_id}' depende de '{package_id}'. Desinstalarlo puede causar errores.")
+    print("¿Aún quieres desinstalarlo? (S/N)")
+    return ask_yes_no(">")
+
+def _print_line(message):
     """
-    Desinstala un paquete dado su ID (formato: Author@PackageName).
-    package_id: ID del paquete en formato "Autor@Nombre".
-    Muestra mensajes de progreso y advertencias si hay dependencias.
+    Como print(), pero en una sola escritura para que no se mezclen las líneas de varios hilos.
     """
-    writeLog("INFO", f"Desinstalando {package_id}")
+    sys.stdout.write(f"{message}\n")
+    sys.stdout.flush()
 
-    if ctypes.windll.shell32.IsUserAnAdmin() == 1:
-        writeLog("OK", "KMD tiene permisos de admin")
-    else:
-        writeLog("WARNING", "KMD no tiene permisos de admin. Esto podría ocasionar errores.")
+OUTPUT_FORMATS = ["text", "ndjson"] # Formatos de salida de los comandos de consulta (READ_ONLY_COMMANDS)
 
-    installed_file = os.path.join(INSTALL_PATH, 'installed.json')
-    if not os.path.exists(installed_file):
-        writeLog("WARNING", "No se encontró el archivo del registro")
-        print("No hay paquetes instalados.")
-        return
+def _emit(record):
+    """
+    Escribe un resultado como una línea de JSON (formato ndjson), en cuanto se tiene.
+    """
+    if isinstance(record, Record):
+        record = record.to_dict()
+    _print_line(json.dumps(record, ensure_ascii=False))
+
+def _emit_error(message):
+    """
+    Escribe un error en formato ndjson: una línea {"error": mensaje}.
+    """
+    _emit({"error": str(message)})
+
+def cli_progress():
+    """
+    Devuelve un callback de progreso que dibuja una barra de tqdm por descarga.
+    """
+    bars = {}
+
+    def progress(package_id, version, downloaded, total, finished):
+        from tqdm import tqdm
+        key = (package_id, version)
+        bar = bars.get(key)
+        if bar is None:
+            bar = bars[key] = tqdm(
+                total=total, unit='B', unit_scale=True,
+                desc=f"{package_id.split('@')[-1]}-{version}",
+                ncols=70
+            )
+        bar.update(downloaded - bar.n)
+        if finished:
+            bar.close()
+            del bars[key]
+
+    return progress
+
+def check_for_updates(silent=True):
+    """
+    Busca si hay una versión más reciente de KMD en el índice.
+    Si silent=False, muestra mensajes al usuario.
+    Devuelve: (hay_update: bool, latest_version: str, download_url: str)
+    """
     try:
-        with open(installed_file, 'r') as f:
-            installed_data = json.load(f)
-    except json.JSONDecodeError:
-            writeLog("ERROR", "El archivo installed.json está corrupto o malformado. Abortando instalación...")
-            print(f"Error: Ha ocurrido un error mientras se leía el registro")
-            return
-    installed = installed_data['installed']
+        result = check_kmd_update()
+    except Exception as e:
+        writeLog("ERROR", f"Error al buscar actualizaciones: {e}")
+        if not silent:
+            print(f"Error al buscar actualizaciones: {e}")
+        return False, None, None
+    if result.available and not silent:
+        print(f"¡Nueva versión de KMD disponible ({result.latest_version})! (actual: {KMD_VERSION})")
+    return result.available, result.latest_version, result.download_url
 
-    writeLog("INFO", "Buscando paquete en el registro...")
-    package = next((p for p in installed if f"{p['author']}@{p['name']}" == package_id), None)
-    if not package:
-        writeLog("ERROR", f"No se encontró el paquete '{package_id}' en el registro.")
-        print(f"No se encontró el paquete con ID '{package_id}' para desinstalar.")
+def show_update_notice():
+    """
+    Muestra el aviso de versión nueva de KMD según la última búsqueda guardada (sin esperar a la red)
+    y, si toca (ver update_check_due), lanza en segundo plano otra búsqueda para la próxima vez.
+    """
+    import subprocess
+    if not UPDATE_CHECK_INTERVAL:
         return
+    cached = cached_update_check()
+    if cached and cached.available:
+        print(f"¡Nueva versión de KMD disponible ({cached.latest_version})! (actual: {KMD_VERSION})")
+    if not update_check_due():
+        return
+    save_update_state({"attemptedAt": time.time()})
+    # La búsqueda usa la misma configuración, rutas e índices (con su nombre y prioridad) que este comando,
+    # aunque vinieran de flags
+    env = dict(os.environ, KMD_CACHE_PATH=CACHE_PATH, KMD_LOG_PATH=LOG_PATH, KMD_INSTALL_PATH=INSTALL_PATH,
+               KMD_INDEX_URL=INDEX_URL, KMD_INDEX_SOURCES=json.dumps(INDEX_SOURCES))
+    if CONFIG_FILE:
+        env["KMD_CONFIG"] = CONFIG_FILE
+    try:
+        subprocess.Popen(
+            kmd_command() + ["check-update", "--no-daemon"], env=env,
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            **PLATFORM.background_popen_kwargs()
+        )
+    except OSError as e:
+        writeLog("WARNING", f"No se pudo lanzar la búsqueda de actualizaciones en segundo plano: {e}")
 
-    # Verificar si alguien más depende de este paquete
-    for p in installed:
-        deps = p.get('dependencies', [])
-        for dep in deps:
-            if dep.get('id') == package_id:
-                depender_id = f"{p['author']}@{p['name']}"
-                writeLog("WARNING", f"{depender_id} depende de {package_id}. Mostrando advertencia...")
-                print(f"Advertencia: '{depender_id}' depende de '{package_id}'. Desinstalarlo puede causar errores.")
-                print("¿Aún quieres desinstalarlo? (S/N)")
-                userInput = input(">")
-                if not userInput.lower() in ['s', 'y']:
-                    writeLog("INFO", "Se canceló la desinstalación.")
-                    print("Se canceló la desinstalación.")
-                    return
-                else:
-                    writeLog("WARNING", "Se continuó con la desinstalación. Esto puede ocasionar errores.")
-                break
+def search_packages(query, mode="ranked", limit=None, output_format="text"):
+    """
+    Busca paquetes en el índice por autor, nombre y descripción y muestra los resultados encontrados,
+    de más a menos relevante.
+    output_format: "text" o "ndjson" (un PackageSummary en JSON por línea).
+    Devuelve una lista de PackageSummary.
+    """
+    matches = search(query, mode, limit)
+    if output_format == "ndjson":
+        for p in matches:
+            _emit(p)
+        return matches
+    if not matches:
+        print(f"No se encontraron paquetes que coincidan con '{query}'")
+        return []
+
+    print(f"Coincidencias encontradas para '{query}':\n")
+    for p in matches:
+        print(f"{p.id}: {p.description or 'Sin descripción'}")
+    return matches
 
-    package_folder = os.path.join(INSTALL_PATH, package['name'])
+def list_all_packages(output_format="text"):
+    """
+    Lista todos los paquetes disponibles en el índice, excluyendo los paquetes definidos en EXCLUDED_PACKAGES.
+    Muestra el ID del paquete y su descripción.
+    output_format: "text" o "ndjson" (un PackageSummary en JSON por línea, según se lee el índice).
+    """
+    if output_format == "ndjson":
+        for p in iter_packages():
+            _emit(p)
+        return True
+    print("Paquetes disponibles:")
+    for p in iter_packages():
+        print(f"{p.id}: {p.description or 'Sin descripción'}")
+    print("\n")
+    return True
 
+def list_installed_packages(output_format="text"):
+    """
+    Lista todos los paquetes instalados.
+    Muestra el ID del paquete, su versión y su descripción.
+    output_format: "text" o "ndjson" (un InstalledPackage en JSON por línea).
+    Devuelve False si el registro está corrupto.
+    """
     try:
-        test_path = os.path.join(package_folder, "__perm_check.tmp")
-        with open(test_path, 'w') as f:
-            f.write("test")
-        os.remove(test_path)
+        installed = list_installed()
+    except RegistryError:
+        if output_format == "ndjson":
+            _emit_error("Ha ocurrido un error mientras se leía el registro")
+        else:
+            print("Error: Ha ocurrido un error mientras se leía el registro.")
+        return False
 
-    except PermissionError:
-        writeLog("WARNING", "KMD no tiene permisos de admin. Relanzando...")
-        isadmin = run_as_admin()
-        if not isadmin:
-            writeLog("ERROR", "No se pudo ejecutar KMD con permisos de administrador")
-            raise Exception("No se pudo ejecutar KMD con permisos de administrador")
+    if output_format == "ndjson":
+        for pkg in installed:
+            _emit(pkg)
+        return True
 
-    writeLog("INFO", "Verificando si hay script de desinstalación")
-    manifest_path = os.path.join(package_folder, 'manifest.json')
-    if os.path.exists(manifest_path):
-        try:
-            with open(manifest_path, 'r') as mf:
-                manifest = json.load(mf)
-        except json.JSONDecodeError:
-            writeLog("ERROR", "El archivo manifest.json está corrupto o malformado. Abortando instalación...")
-            print(f"Error: Ha ocurrido un error mientras se instalaba {package_id}.")
-        if 'uninstallScript' in manifest and manifest['uninstallScript'].strip():
-            writeLog("INFO", f"Ejecutando script de desinstalación: {manifest['uninstallScript']}")
-            print(f"Ejecutando script de desinstalación: {manifest['uninstallScript']}")
-            try:
-                run_uninstall(manifest, package_folder)
-            except Exception as e:
-                writeLog("ERROR", f"Error al ejecutar script de desinstalación: {e}")
-                print(f"Error al ejecutar script de desinstalación: {e}")
+    if not installed:
+        writeLog("WARNING", "No hay paquetes en el registro")
+        print("No hay paquetes instalados aún.")
+        return True
+
+    print("Paquetes instalados:\n")
+    for pkg in installed:
+        print(f"- {pkg.id} ({pkg.version or '¿versión?'})")
+        others = [v for v in pkg.versions if v != pkg.version]
+        if others:
+            print(f"Otras versiones instaladas: {', '.join(others)}")
+        if "postInstall" in pkg.script_durations:
+            print(f"Script de instalación: {pkg.script_durations['postInstall']:.2f} s")
+        print(f"Descripción: {pkg.description or 'Sin descripción'}\n")
+    return True
+
+def list_outdated_packages(output_format="text"):
+    """
+    Lista los paquetes instalados que tienen una versión más reciente en el índice.
+    output_format: "text" o "ndjson" (un OutdatedPackage en JSON por línea).
+    Devuelve False si el registro está corrupto.
+    """
+    try:
+        outdated = list_outdated()
+    except KMDError as e:
+        if output_format == "ndjson":
+            _emit_error(e)
+        else:
+            print(f"Error: {e}")
+        return False
+
+    if output_format == "ndjson":
+        for p in outdated:
+            _emit(p)
+        return True
+
+    if not outdated:
+        print("Todos los paquetes están actualizados.")
+        return True
+
+    width = max(len("Paquete"), *(len(p.id) for p in outdated))
+    print(f"{'Paquete':<{width}}  {'Instalada':<12} Disponible")
+    for p in outdated:
+        print(f"{p.id:<{width}}  {p.current_version or '?':<12} {p.latest_version}")
+    return True
+
+def _format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+def cache_command(action):
+    """
+    Ejecuta un subcomando de cache: "stats" muestra el estado de la caché y del almacén de archivos,
+    "prune" borra los archivos del almacén que ya no usa ningún paquete.
+    Devuelve False si el subcomando no existe.
+    """
+    if action == "prune":
+        removed, freed = prune_store()
+        print(f"Se borraron {removed} archivos sin usar del almacén ({_format_size(freed)})")
+        return True
+    if action != "stats":
+        print("Uso: kmd cache stats | kmd cache prune")
+        return False
+
+    stats = cache_stats()
+    print(f"Caché de descargas: {_format_size(stats.cache_bytes)} ({CACHE_PATH})")
+    print(f"Almacén de archivos: {stats.objects} archivos, {_format_size(stats.stored_bytes)} ({get_store_path()})")
+    print(f"Referencias desde paquetes: {stats.references}")
+    print(f"Espacio ahorrado por deduplicación: {_format_size(stats.saved_bytes)}")
+    if stats.orphaned_objects:
+        print(f"Sin usar: {stats.orphaned_objects} archivos, {_format_size(stats.orphaned_bytes)} (kmd cache prune los borra)")
+    return True
+
+def list_package_versions(package_id, output_format="text"):
+    """
+    Lista todas las versiones disponibles de un paquete dado su ID (formato: Author@PackageName).
+    Muestra las versiones disponibles y cuál es la última.
+    output_format: "text" o "ndjson" (un VersionInfo en JSON por línea).
+    Devuelve False si el paquete no se encuentra en el índice.
+    """
+    try:
+        versions = list_versions(package_id)
+    except InvalidPackageIdError:
+        message = "El ID del paquete debe tener el formato 'Autor@Nombre'"
+    except PackageNotFoundError:
+        message = f"No se encontró el paquete {package_id} en el índice."
+    else:
+        message = None
+    if message:
+        if output_format == "ndjson":
+            _emit_error(message)
         else:
-            writeLog("INFO", "No se especificó un script de desinstalación en el manifiesto")
+            print(message)
+        return False
+
+    if output_format == "ndjson":
+        for v in versions:
+            _emit(v)
+        return True
+
+    print(f"Versiones disponibles para {package_id}:")
+    for v in versions:
+        tag = " (latest)" if v.latest else ""
+        print(f"- {v.name}{tag}")
+    return True
+
+def who_depends(package_id, silent=False, output_format="text"):
+    """
+    Busca y muestra los paquetes que dependen de un paquete dado por su ID.
+    package_id: ID del paquete en formato "autor@nombre"
+    silent: Si es True, no muestra mensajes al usuario, solo registra en el log.
+    output_format: "text" o "ndjson" (una línea {"package": ..., "dependent": ...} por dependiente).
+    Devuelve una lista de paquetes que dependen del paquete dado, o None si no se pudo consultar.
+    """
+    try:
+        dependents = find_dependents(package_id)
+    except InvalidPackageIdError:
+        message = "El ID del paquete debe ser una cadena válida en formato 'autor@nombre'."
+    except RegistryError as e:
+        message = f"{e}. No se puede continuar."
     else:
-        writeLog("WARNING", "No se encontró el manifiesto del paquete a desinstalar")
+        message = None
+    if message:
+        if output_format == "ndjson":
+            _emit_error(message)
+        elif not silent:
+            print(f"Error: {message}")
+        return None
+
+    if output_format == "ndjson":
+        for d in dependents:
+            _emit({"package": package_id, "dependent": d})
+        return dependents
 
-    writeLog("INFO", "Eliminando carpeta del paquete")
-    if os.path.exists(package_folder):
-        try:
-            shutil.rmtree(package_folder)
-        except Exception as e:
-            print(f"Ha ocurrido un error durante la desinstalación: {e}")
+    if not silent:
+        if dependents:
+            print(f"Los siguientes paquetes dependen de '{package_id}':")
+            for d in dependents:
+                print(f"  - {d}")
+        else:
+            print(f"Ningún paquete depende de '{package_id}'.")
+    return dependents
 
-    installed_data['installed'] = [p for p in installed if f"{p['author']}@{p['name']}" != package_id]
-    with open(installed_file, 'w') as f:
-        json.dump(installed_data, f, indent=4)
-    writeLog("OK", f"Paquete '{package_id}' desinstalado.")
-    print(f"Paquete '{package['name']}' (ID: {package_id}) desinstalado")
+def _relaunch_as_admin(e):
+    writeLog("WARNING", f"KMD no tiene permisos de admin. Error obtenido: {e}. (Relanzando...)")
+    isadmin = run_as_admin()
+    if not isadmin:
+        writeLog("ERROR", "No se pudo ejecutar KMD con permisos de administrador")
+        raise KMDError("No se pudo ejecutar KMD con permisos de administrador")
 
-def repair_package(package_id):
+def install_package(package_id, version=None, installExcludedPackages=False, KMDautoupdate=False):
     """
-    Reinstala un paquete dado su ID (formato: Author@PackageName).
+    Instala un paquete dado su ID (formato: Author@PackageName) y una versión opcional, mostrando el progreso.
     package_id: ID del paquete en formato "Autor@Nombre".
-    Muestra mensajes de progreso y verifica si el paquete está instalado.
-    Si el paquete no está instalado, muestra un mensaje de error.
+    version: Versión específica a instalar, si se desea. Si es None, instala la última versión.
+    Devuelve "OK" si la instalación fue exitosa, o "ERROR" en caso de fallo.
     """
-    index = get_index()
-
-    # Validación del formato author@pkgName
-    if '@' not in package_id:
-        writeLog("ERROR", f"Formato inválido de package_id: {package_id}")
-        print(f"Formato inválido de package_id: {package_id}")
-        return
-
-    author, pkg_name = package_id.split('@', 1)
-
-    # Buscar en el índice
-    base_pkg = next((p for p in index if p['author'] == author and p['name'] == pkg_name), None)
-    if not base_pkg:
-        writeLog("ERROR", f"No se encontró el paquete {package_id} en el índice")
-        print(f"No se encontró el paquete {package_id} en el índice.")
-        return
+    try:
+        install(package_id, version, on_hash_mismatch=_ask_hash_mismatch, progress=cli_progress(),
+                notify=print, include_excluded=installExcludedPackages)
+        return "OK"
+    except PermissionDeniedError as e:
+        _relaunch_as_admin(e)
+    except KeyboardInterrupt:
+        writeLog("ERROR", "El usuario interrumpió la instalación con KeyboardInterrupt")
+        print("Abortando instalalción...")
+    except KMDError as e:
+        print(f"Error durante la instalación de {package_id}: {e}")
+    return "ERROR"
 
-    # Buscar paquete instalado
-    installed = get_installed_packages()
-    if installed == "ERROR":
-        writeLog("ERROR", "get_installed_packages devolvió un flag de error.")
-        print("Error: Ha ocurrido un error. Abortando...")
-        return
-    installed_pkg = next((p for p in installed if p['author'] == author and p['name'] == pkg_name), None)
+def uninstall_package(package_id):
+    """
+    Desinstala un paquete dado su ID (formato: Author@PackageName).
+    Muestra mensajes de progreso y pregunta antes de desinstalar si otros paquetes dependen de él.
+    Devuelve True si se desinstaló.
+    """
+    try:
+        result = uninstall(package_id, on_dependents=_ask_dependents, notify=print)
+    except NotInstalledError as e:
+        print(e)
+        return False
+    except HasDependentsError:
+        print("Se canceló la desinstalación.")
+        return False
+    except PermissionDeniedError as e:
+        _relaunch_as_admin(e)
+        return False
+    except KMDError as e:
+        print(f"Error: {e}")
+        return False
+    print(f"Paquete '{package_id.split('@')[1]}' (ID: {result.id}) desinstalado")
+    return True
 
-    if installed_pkg:
-        current_version = installed_pkg.get('version', '')
-        writeLog("INFO", f"Reinstalando {package_id} en su versión actual: {current_version}...")
-        print(f"Reinstalando {package_id} en su versión actual: {current_version}...")
-        uninstall_package(package_id)
-        install_package(package_id, current_version)
-        writeLog("OK", f"Paquete {package_id} reparado (versión {current_version}).")
-        print(f"Paquete {package_id} reparado (versión {current_version}).")
-    else:
-        writeLog("ERROR", f"El paquete {package_id} no está instalado.")
-        print(f"El paquete {package_id} no está instalado.")
-        return
+def repair_package(package_id):
+    """
+    Reinstala un paquete dado su ID (formato: Author@PackageName) en su versión actual.
+    Si el paquete no está instalado, muestra un mensaje de error.
+    Devuelve True si se reparó.
+    """
+    try:
+        result = repair(package_id, on_hash_mismatch=_ask_hash_mismatch, progress=cli_progress(), notify=print)
+    except PermissionDeniedError as e:
+        _relaunch_as_admin(e)
+        return False
+    except KMDError as e:
+        print(f"Error: {e}")
+        return False
+    print(f"Paquete {package_id} reparado (versión {result.version}).")
+    return True
 
 def update_package(package_id):
     """
     Actualiza un paquete a su última versión disponible.
-    package_id: ID del paquete en formato "Autor@Nombre".
-    Muestra mensajes de progreso y verifica si el paquete está instalado.
     Si el paquete no está instalado, lo instala en su última versión.
     Si ya está actualizado, muestra un mensaje informativo.
+    Devuelve True si no hubo errores.
     """
-    index = get_index()
-
-    # Validación del formato author@pkgName
-    if '@' not in package_id:
-        writeLog("ERROR", f"Formato inválido de package_id: {package_id}")
-        print(f"Formato inválido de package_id: {package_id}")
-        return
-
-    author, pkg_name = package_id.split('@', 1)
-
-    # Buscar en el índice
-    base_pkg = next((p for p in index if p['author'] == author and p['name'] == pkg_name), None)
-    if not base_pkg:
-        writeLog("ERROR", f"No se encontró el paquete {package_id} en el índice")
-        print(f"No se encontró el paquete {package_id} en el índice.")
-        return
-
-    # Buscar paquete instalado (usamos author y name)
-    installed = get_installed_packages()
-    if installed == "ERROR":
-        writeLog("ERROR", "get_installed_packages devolvió un flag de error.")
-        print("Error: Ha ocurrido un error. Abortando...")
-        return
-    installed_pkg = next((p for p in installed if p['author'] == author and p['name'] == pkg_name), None)
-
-    # Obtener versión más reciente
-    latest_version = next((v for v in base_pkg['versions'] if v.get('latest', False)), None)
-    if not latest_version:
-        writeLog("ERROR", f"No se encontró versión marcada como 'latest' para {package_id}")
-        print(f"No se encontró versión marcada como 'latest' para {package_id}")
-        return
-
-    latest_version_name = latest_version.get('versionName', latest_version.get('vName', ''))
-
-    if installed_pkg:
-        current_version = installed_pkg.get('version', '')
-        if current_version == latest_version_name:
-            writeLog("OK", f"{package_id} ya está actualizado a la versión {current_version}.")
-            print(f"{package_id} ya está actualizado a la versión {current_version}.")
-            return
-        else:
-            writeLog("INFO", f"Actualizando {package_id} de {current_version} a {latest_version_name}...")
-            print(f"Actualizando {package_id} de {current_version} a {latest_version_name}...")
-            uninstall_package(package_id)
+    try:
+        result = update(package_id, on_hash_mismatch=_ask_hash_mismatch, progress=cli_progress(), notify=print)
+    except PermissionDeniedError as e:
+        _relaunch_as_admin(e)
+        return False
+    except KMDError as e:
+        print(f"Error: {e}")
+        return False
+    if result.status == "up-to-date":
+        print(f"{package_id} ya está actualizado a la versión {result.to_version}.")
     else:
-        writeLog("INFO", f"{package_id} no está instalado, instalando versión {latest_version_name}...")
-        print(f"{package_id} no está instalado, instalando versión {latest_version_name}...")
-
-    install_package(package_id)
-    writeLog("OK", f"Paquete {package_id} actualizado a {latest_version_name}.")
-    print(f"Paquete {package_id} actualizado a {latest_version_name}.")
+        print(f"Paquete {package_id} actualizado a {result.to_version}.")
+    return True
 
 def update_all_packages():
     """
     Actualiza todos los paquetes instalados a su última versión disponible.
-    Revisa el archivo installed.json para obtener la lista de paquetes instalados.
-    Si un paquete no tiene una versión 'latest' en el índice, se omite.
-    Si un paquete ya está actualizado, se muestra un mensaje informativo.
     Si no hay paquetes instalados, muestra un mensaje informativo.
+    Devuelve True si ningún paquete falló.
     """
-    installed_file = os.path.join(INSTALL_PATH, 'installed.json')
-    if not os.path.exists(installed_file):
-        writeLog("ERROR", "No se encotrnó el archivo de registro.")
-        print("No hay paquetes instalados para actualizar.")
-        return
-
     try:
-        with open(installed_file, 'r') as f:
-            installed_data = json.load(f)
-    except json.JSONDecodeError:
-        writeLog("ERROR", "El archivo installed.json está corrupto o malformado. Abortando instalación...")
-        print(f"Error: Ha ocurrido un error mientras se instalaba {package_id}.")
-        return
+        if not _installed_by_id():
+            writeLog("ERROR", "No hay paquetes instalados para actualizar.")
+            print("No hay paquetes instalados para actualizar.")
+            return True
+        results = update_all(on_hash_mismatch=_ask_hash_mismatch, progress=cli_progress(), notify=_print_line)
+    except KMDError as e:
+        print(f"Error: {e}")
+        return False
 
-    installed_list = installed_data.get('installed', [])
-    if not installed_list:
-        writeLog("ERROR", "No hay paquetes instalados para actualizar.")
-        print("No hay paquetes instalados para actualizar.")
-        return
+    for r in results:
+        if r.status in ["updated", "installed"]:
+            print(f"Paquete {r.id} actualizado a {r.to_version}.")
+    if not any(r.status in ["updated", "installed", "failed"] for r in results):
+        writeLog("OK", "Todos los paquetes ya están actualizados.")
+        print("Todos los paquetes ya están actualizados.")
+    return not any(r.status == "failed" for r in results)
 
-    index = get_index()
-    updated_any = False
+def autoremove_unused_packages():
+    """
+    Elimina paquetes huérfanos (ver autoremove) mostrando cuáles se eliminaron.
+    Devuelve True si no hubo errores.
+    """
+    try:
+        removed = autoremove(notify=print)
+    except KMDError as e:
+        print(f"Error: {e}")
+        return False
+    if not removed:
+        print("No hay paquetes huérfanos para eliminar.")
+    return True
 
-    for pkg in installed_list:
-        package_id = pkg['author'] + '@' + pkg['name']
-        current_version = pkg.get('version', '')
+def rollback_package(package_id):
+    """
+    Vuelve a la versión anterior de un paquete (ver rollback).
+    Devuelve True si se cambió de versión.
+    """
+    try:
+        rollback(package_id, on_hash_mismatch=_ask_hash_mismatch, progress=cli_progress(), notify=print)
+    except PermissionDeniedError as e:
+        _relaunch_as_admin(e)
+        return False
+    except KMDError as e:
+        print(f"Error: {e}")
+        return False
+    return True
 
-        # Buscar paquete en el índice
-        base_pkg = next((p for p in index if p['author'] == pkg['author'] and p['name'] == pkg['name']), None)
-        if not base_pkg:
-            writeLog("WARNING", f"No se encontró el paquete {package_id} en el índice, saltando...")
-            print(f"No se encontró el paquete {package_id} en el índice, saltando...")
-            continue
+def gc_packages(keep_previous=False):
+    """
+    Borra las versiones inactivas de los paquetes (ver gc) mostrando cuánto espacio se liberó.
+    Devuelve True si no hubo errores.
+    """
+    try:
+        collected = gc(keep_previous, notify=print)
+    except KMDError as e:
+        print(f"Error: {e}")
+        return False
+    if not collected:
+        print("No hay versiones inactivas para borrar.")
+    else:
+        print(f"Se borraron {len(collected)} versiones inactivas ({_format_size(sum(c.freed_bytes for c in collected))} liberados)")
+    return True
 
-        # Buscar la versión latest
-        latest_version_entry = next((v for v in base_pkg['versions'] if v.get('latest')), None)
-        if not latest_version_entry:
-            writeLog("WARNING", f"No hay versión 'latest' para {package_id}, saltando...")
-            print(f"No hay versión 'latest' para {package_id}, saltando...")
-            continue
+def verify_packages(package_id=None, verify_all=False, full=False, output_format="text"):
+    """
+    Comprueba los archivos de un paquete instalado, o de todos con verify_all (ver verify),
+    y muestra los que faltan o cambiaron.
+    output_format: "text" o "ndjson" (un VerifyResult en JSON por línea).
+    Devuelve False si falta o cambió algún archivo.
+    """
+    message = None
+    if not package_id and not verify_all:
+        message = "Uso: kmd verify <ID> | kmd verify --all"
+    else:
+        start = time.monotonic()
+        try:
+            results = verify([package_id] if package_id else None, full)
+        except KMDError as e:
+            message = f"Error: {e}"
+    if message:
+        if output_format == "ndjson":
+            _emit_error(message)
+        else:
+            print(message)
+        return False
 
-        latest_version_name = latest_version_entry.get('versionName')
-        if current_version != latest_version_name:
-            writeLog("INFO", f"Actualizando {package_id} de {current_version} a {latest_version_name}...")
-            print(f"Actualizando {package_id} de {current_version} a {latest_version_name}...")
-            uninstall_package(package_id)
-            install_package(package_id)
-            updated_any = True
+    ok = not any(r.status == "modified" for r in results)
+    if output_format == "ndjson":
+        for r in results:
+            _emit(r)
+        return ok
+
+    for r in results:
+        if r.status == "unverifiable":
+            print(f"?  {r.id} {r.version}: no se puede comprobar (se instaló con una versión anterior de KMD; reinstálalo)")
+        elif r.status == "ok":
+            print(f"OK {r.id} {r.version}: {r.files} archivos, {_format_size(r.size)} ({r.algorithm})")
         else:
-            writeLog("OK", f"{package_id} ya está en la última versión ({current_version}).")
-            print(f"{package_id} ya está en la última versión ({current_version}).")
+            print(f"!! {r.id} {r.version}: {len(r.modified)} archivos modificados, {len(r.missing)} faltan")
+            for path in r.modified:
+                print(f"   modificado  {path}")
+            for path in r.missing:
+                print(f"   falta       {path}")
+    elapsed = time.monotonic() - start
+    print(f"{len(results)} paquetes comprobados ({_format_size(sum(r.size for r in results))} en {elapsed:.1f} s)")
+    return ok
+
+def whats_new_command(output_format="text"):
+    """
+    Muestra qué cambió en el índice en su última actualización (ver whats_new), marcando los paquetes instalados.
+    output_format: "text" o "ndjson" (el CatalogDiff en JSON).
+    Devuelve False si el registro está corrupto.
+    """
+    diff = whats_new()
+    if output_format == "ndjson":
+        if diff is not None:
+            _emit(diff)
+        return True
+    if diff is None:
+        print("Todavía no hay cambios del índice registrados: aparecerán cuando el índice cambie entre dos consultas.")
+        return True
+    try:
+        installed = _installed_by_id()
+    except KMDError as e:
+        print(f"Error: {e}")
+        return False
 
-    if not updated_any:
-        writeLog("OK", "Todos los paquetes ya están actualizados.")
-        print("Todos los paquetes ya están actualizados.")
+    def mark(package_id):
+        pkg = installed.get(package_id)
+        return f"  [instalado: {pkg.get('version', '')}]" if pkg else ""
+
+    when = datetime.fromtimestamp(diff.computed_at).strftime("%d/%m/%Y %H:%M")
+    print(f"Cambios del índice ({when}, revisión {diff.from_revision} -> {diff.to_revision}):")
+    if not (diff.added or diff.removed or diff.new_versions or diff.removed_versions or diff.latest_changed):
+        print("  Sin cambios en los paquetes ni en sus versiones.")
+    if diff.added:
+        print(f"\nPaquetes nuevos ({len(diff.added)}):")
+        for package_id in diff.added:
+            print(f"  + {package_id}")
+    if diff.latest_changed:
+        print(f"\nNuevas versiones latest ({len(diff.latest_changed)}):")
+        for package_id, (old, new) in diff.latest_changed.items():
+            print(f"  * {package_id}: {old or '-'} -> {new or '-'}{mark(package_id)}")
+    others = {p: v for p, v in diff.new_versions.items() if p not in diff.latest_changed}
+    if others:
+        print(f"\nOtras versiones publicadas ({len(others)}):")
+        for package_id, versions in others.items():
+            print(f"  * {package_id}: {', '.join(versions)}{mark(package_id)}")
+    if diff.removed_versions:
+        print(f"\nVersiones retiradas ({len(diff.removed_versions)}):")
+        for package_id, versions in diff.removed_versions.items():
+            print(f"  - {package_id}: {', '.join(versions)}{mark(package_id)}")
+    if diff.removed:
+        print(f"\nPaquetes retirados ({len(diff.removed)}):")
+        for package_id in diff.removed:
+            print(f"  - {package_id}{mark(package_id)}")
+    return True
+
+def mirror_packages(dest, package_ids=None, all_versions=False):
+    """
+    Crea o actualiza un mirror local del índice (ver mirror) mostrando el progreso.
+    package_ids: Texto con IDs separados por comas (por defecto, todos los paquetes).
+    Devuelve True si todos los paquetes se copiaron.
+    """
+    ids = [p.strip() for p in package_ids.split(",") if p.strip()] if package_ids else None
+    print(f"Actualizando mirror en {dest}...")
+    try:
+        result = mirror(dest, ids, all_versions, notify=_print_line)
+    except KMDError as e:
+        print(f"Error: {e}")
+        return False
+    print(f"Mirror listo: {result.packages} paquetes, {result.archives} versiones "
+          f"({result.downloaded} descargadas, {_format_size(result.downloaded_bytes)}; {result.skipped} sin cambios)")
+    for package_id, version, error in result.failed:
+        print(f"No se pudo copiar {package_id} {version or ''}: {error}")
+    print(f"Para usarlo: kmd --index-url {os.path.join(result.path, 'index.json')} install ...")
+    return not result.failed
+
+def kmd_command():
+    """
+    Devuelve el comando con el que se está ejecutando KMD (para lanzar otro proceso de KMD).
+    """
+    script = os.path.abspath(sys.argv[0])
+    return [sys.executable, script] if script.lower().endswith(".py") else [script]
+
+def prefetch_packages(package_ids=None, outdated=False, lock_file=None, foreground=False):
+    """
+    Descarga por adelantado los paquetes indicados (ver prefetch).
+    Salvo con foreground, se relanza en segundo plano con prioridad baja y vuelve enseguida.
+    package_ids: Texto con IDs separados por comas.
+    Devuelve True si se descargó (o se lanzó) todo.
+    """
+    import subprocess
+    ids = [p.strip() for p in package_ids.split(",") if p.strip()] if package_ids else []
+    if not ids and not outdated and not lock_file:
+        print("Uso: kmd prefetch [IDs] | kmd prefetch --outdated | kmd prefetch --lock [Archivo]")
+        return False
+
+    if not foreground:
+        process = subprocess.Popen(
+            kmd_command() + sys.argv[1:] + ["--foreground"],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            **PLATFORM.background_popen_kwargs()
+        )
+        writeLog("INFO", f"Prefetch lanzado en segundo plano (PID {process.pid})")
+        print(f"Descargando en segundo plano (PID {process.pid}). El progreso queda en el log: {LOG_PATH}")
+        return True
+
+    try:
+        lock_entries = read_lock_file(lock_file) if lock_file else None
+        results = prefetch(ids, outdated, lock_entries, notify=_print_line)
+    except KMDError as e:
+        print(f"Error: {e}")
+        return False
+    downloaded = [r for r in results if r.status == "downloaded"]
+    failed = [r for r in results if r.status == "failed"]
+    print(f"Prefetch terminado: {len(downloaded)} descargados ({_format_size(sum(r.size for r in downloaded))}), "
+          f"{sum(r.status == 'cached' for r in results)} ya en caché, {sum(r.status == 'installed' for r in results)} ya instalados")
+    for r in failed:
+        print(f"No se pudo descargar {r.id} {r.version or ''}: {r.error}")
+    return not failed
 
 def get_installed_packages():
     """
@@ -1032,17 +5479,11 @@ def get_installed_packages():
     Si el archivo no existe, devuelve una lista vacía.
     Si el archivo está corrupto o malformado, devuelve "ERROR".
     """
-    installed_file = os.path.join(INSTALL_PATH, 'installed.json')
-    if os.path.exists(installed_file):
-        try:
-            with open(installed_file, 'r') as f:
-                data = json.load(f)
-        except json.JSONDecodeError:
-            writeLog("ERROR", "El archivo installed.json está corrupto o malformado. Abortando instalación...")
-            print(f"Error: Ha ocurrido un error mientras se leía el registro.")
-            return "ERROR"
-        return data.get('installed', [])
-    return []
+    try:
+        return list(_installed_by_id().values())
+    except RegistryError:
+        print("Error: Ha ocurrido un error mientras se leía el registro.")
+        return "ERROR"
 
 def success_kmdupdate_message(version):
     """
@@ -1054,76 +5495,12 @@ def success_kmdupdate_message(version):
     print("¡Gracias por usar KMD! Si te gusta, considera seguirme en GitHub:")
     print(MY_GITHUB)
 
-def list_installed_packages():
-    """
-    Lista todos los paquetes instalados desde el archivo installed.json.
-    Muestra el ID del paquete, su versión, descripción y autor.
-    Si el archivo no existe o está vacío, muestra un mensaje informativo.
-    Si el archivo está corrupto o malformado, muestra un mensaje de error.
-    """
-    installed_file = os.path.join(INSTALL_PATH, 'installed.json')
-    if not os.path.exists(installed_file):
-        writeLog("WARNING", "No se encontró el  del registro")
-        print("No hay< paquetes instalados aún.")
-        return
-
-    try:
-        with open(installed_file, 'r') as f:
-            installed_data = json.load(f)
-    except json.JSONDecodeError:
-            writeLog("ERROR", "El archivo installed.json está corrupto o malformado. Abortando instalación...")
-            print(f"Error: Ha ocurrido un error mientras se leía el registro.")
-            return "ERROR"
-
-    installed = installed_data.get('installed', [])
-    if not installed:
-        writeLog("WARNING", "El archivo del registro está vacío")
-        print("No hay paquetes instalados aún.")
-        return
-
-    print("Paquetes instalados:\n")
-    for pkg in installed:
-        author = pkg.get('author', 'Desconocido')
-        pkg_name = pkg.get('name', 'SinNombre')
-        version = pkg.get('version', '¿versión?')
-        description = pkg.get('description', 'Sin descripción')
-        package_id = f"{author}@{pkg_name}"
-
-        print(f"- {package_id} ({version})")
-        print(f"Descripción: {description}\n")
-
-def list_package_versions(package_id):
-    """
-    Lista todas las versiones disponibles de un paquete dado su ID (formato: Author@PackageName).
-    package_id: ID del paquete en formato "Autor@Nombre".
-    Muestra las versiones disponibles y cuál es la última.
-    Si el paquete no se encuentra en el índice, muestra un mensaje de error.
-    """
-    try:
-        author, name = package_id.split('@')
-    except ValueError:
-        writeLog("ERROR", "El ID del paquete debe tener el formato 'Autor@Nombre'")
-        print("El ID del paquete debe tener el formato 'Autor@Nombre'")
-        return
-
-    index = get_index()
-    entry = next((p for p in index if p['author'] == author and p['name'] == name), None)
-
-    if not entry:
-        print(f"No se encontró el paquete {package_id} en el índice.")
-        writeLog("ERROR", f"No se encontró el paquete {package_id} en el índice.")
-        return
-
-    print(f"Versiones disponibles para {package_id}:")
-    for v in entry['versions']:
-        tag = " (latest)" if v.get('latest') else ""
-        print(f"- {v['versionName']}{tag}")
-
 def update_kmd():
     """
     Actualiza KMD a la última versión disponible.
     Descarga el último release de KMD desde GitHub y lo instala.
     Si no hay una nueva versión, muestra un mensaje informativo.
+    Devuelve True si no hubo errores.
     """
     writeLog("INFO", "Comenzando actualización de KMD...")
     updateAvaliable, latest_version, _ = check_for_updates(True)
@@ -1134,10 +5511,10 @@ def update_kmd():
     if not updateAvaliable:
         writeLog("OK", "KMD ya está actualizado a la última versión.")
         print("KMD ya está actualizado a la última versión.")
-        return
+        return True
 
     writeLog("INFO", f"Actualizando KMD de {KMD_VERSION} a {latest_version}...")
-    install_package("CeccPro@KMD-Win64", None, installExcludedPackages=True, KMDautoupdate=True)
+    return install_package("CeccPro@KMD-Win64", None, installExcludedPackages=True, KMDautoupdate=True) == "OK"
 
 def get_kmdVersion():
     """
@@ -1153,106 +5530,610 @@ def get_usage():
     Devuelve un string con la lista de comandos disponibles y su descripción.
     """
     return '''Comandos disponibles:
-    install [ID] [Versión]  - Instala un paquete
-    search [Nombre]         - Busca paquetes
+    install [ID] [Versión]  - Instala un paquete (si esa versión ya está instalada al lado de otra, solo la activa)
+    search [Texto]          - Busca paquetes por autor, nombre y descripción (ordenados por relevancia)
+        --prefix            - Solo paquetes cuyos términos empiecen por el texto buscado
+        --fuzzy             - Incluye coincidencias aproximadas (p. ej. con erratas)
+        --limit [N]         - Muestra como mucho N resultados
     list-versions [ID]      - Lista las versiones disponibles de un paquete
     list-all                - Lista todos los paquetes
     uninstall [ID]          - Desinstala un paquete
     remove [ID]             - Alias para uninstall
-    update-all              - Actualiza todos los paquetes
+    update-all              - Actualiza todos los paquetes desactualizados (en paralelo)
+    outdated                - Lista los paquetes que tienen una versión más reciente
+    whats-new               - Muestra qué cambió en el índice en su última actualización (sin usar la red)
     update [ID]             - Actualiza un paquete
     repair [ID]             - Repara reinstalando un paquete
+    rollback [ID]           - Vuelve a activar la versión anterior de un paquete (sin descargar nada)
+    gc                      - Borra las versiones inactivas de los paquetes
+        --keep-previous     - Conserva la versión anterior de cada paquete (para rollback)
+    verify [ID]             - Comprueba que los archivos instalados de un paquete no faltan ni cambiaron
+        --all               - Comprueba todos los paquetes instalados
+        --full              - Compara siempre con SHA-256, aunque el paquete tenga huella rápida
+    mirror [Carpeta]        - Copia el índice y los paquetes a una carpeta para instalar sin internet (solo descarga lo que cambió)
+        --packages [IDs]    - Solo esos paquetes (separados por comas) y sus dependencias
+        --all-versions      - Copia todas las versiones, no solo la última
+    prefetch [IDs]          - Descarga y verifica por adelantado (en segundo plano) los paquetes indicados (separados por comas)
+                              y las dependencias que falten, sin instalarlos: la instalación después no espera a la red
+        --outdated          - Descarga las actualizaciones que instalaría update-all
+        --lock [Archivo]    - Descarga los paquetes y versiones de un archivo (líneas "ID versión" o la salida de list-installed --json)
+        --foreground        - Espera a que termine y muestra el resultado
     list-installed          - Lista todos los paquetes instalados
     help                    - Muestra este dialogo de ayuda
     version                 - Muestra la versión instalada de KMD
     autoremove              - Elimina las dependencias huerfanas
     who-depends [ID]        - Muestra cuantos paquetes dependen de otro paquete
     update-kmd              - Actualiza KMD a la última versión
+    check-update            - Busca ahora si hay una versión nueva de KMD (los demás comandos lo hacen en segundo plano)
+    metrics                 - Muestra las métricas acumuladas (descargas, cachés, duración de instalaciones, fallos...)
+                              en el formato de texto de Prometheus
+    config                  - Muestra la configuración activa (rutas, índice y plataforma)
+    cache [stats|prune]     - Muestra el tamaño de la caché y el espacio ahorrado por el almacén de archivos, o borra los archivos que ya no usa ningún paquete
+    daemon [start|stop|status] - Inicia, detiene o consulta el daemon de KMD (mantiene el índice y el registro en memoria)
     whoami                  - Muestra información del autor de KMD (A nadie le importa, pero bueno...)
+
+Opciones globales (también se pueden definir con variables de entorno o en el archivo de configuración):
+    --install-path [Ruta]   - Ruta de instalación de paquetes (KMD_INSTALL_PATH / installPath)
+    --log-path [Ruta]       - Carpeta del log (KMD_LOG_PATH / logPath)
+    --cache-path [Ruta]     - Carpeta de la caché (KMD_CACHE_PATH / cachePath)
+    --index-url [URL]       - URL del índice de paquetes: http(s)://, file:// o una ruta local, p. ej. un mirror (KMD_INDEX_URL / indexURL)
+    --index-source [URL]    - Fuente extra del índice, con prioridad sobre --index-url; se puede repetir (KMD_INDEX_SOURCES / indexSources)
+    --platform [Nombre]     - Plataforma: windows, posix o generic (KMD_PLATFORM / platform)
+    --lock-timeout [Seg]    - Espera máxima por el lock de un paquete usado por otro proceso (KMD_LOCK_TIMEOUT / lockTimeout)
+    --script-timeout [Seg]  - Tiempo máximo de los scripts de instalación/desinstalación (KMD_SCRIPT_TIMEOUT / scriptTimeout)
+    --script-errors [Modo]  - Si un script falla: continue (por defecto) o abort (KMD_SCRIPT_ERRORS / scriptErrors)
+    --jobs [N]              - Paquetes independientes que se instalan/actualizan a la vez (KMD_JOBS / jobs)
+    --max-bandwidth [Tasa]  - Límite de descarga entre todas las descargas, p. ej. 500K o 2M por segundo; 0 = sin límite (KMD_MAX_BANDWIDTH / maxBandwidth)
+    --max-connections-per-host [N] - Descargas simultáneas contra un mismo servidor (KMD_MAX_CONNECTIONS_PER_HOST / maxConnectionsPerHost)
+    --update-check-interval [Seg] - Cada cuánto se busca en segundo plano una versión nueva de KMD; 0 = no buscar ni avisar (KMD_UPDATE_CHECK_INTERVAL / updateCheckInterval)
+    --local-digest [Algoritmo] - Huella rápida que se guarda de cada archivo al instalar para verify: none (por defecto),
+                              blake2b o xxh3 (necesita el paquete xxhash) (KMD_LOCAL_DIGEST / localDigest)
+    --metrics-path [Ruta]   - Archivo .prom donde se escriben las métricas al terminar cada comando, p. ej. para el
+                              textfile collector de node_exporter (KMD_METRICS_PATH / metricsPath)
+    --config [Ruta]         - Archivo de configuración JSON (KMD_CONFIG)
+    --no-daemon             - Ejecuta el comando localmente aunque el daemon esté corriendo
+    --format [text|ndjson]  - Salida de search, list-all, list-installed, list-versions, who-depends, outdated, verify y whats-new:
+                              texto o un objeto JSON por línea (los errores, como {"error": ...}; el código de salida es 1)
+    --json                  - Igual que --format ndjson
     '''
 
-def main():
+# -- Daemon --
+DAEMON_CATALOG_MAX_AGE = 300 # Cada cuántos segundos revalida el daemon el índice
+DAEMON_CONNECT_TIMEOUT = 0.5 # Segundos que espera la CLI al conectar con el daemon
+READ_ONLY_COMMANDS = ["search", "list-all", "list-installed", "list-versions", "who-depends", "outdated", "verify", "whats-new"] # Se atienden en paralelo
+GLOBAL_COMMANDS = ["update-all", "autoremove", "update-kmd", "gc"] # Tocan muchos paquetes: se ejecutan en exclusiva
+
+class ReadWriteLock:
     """
-    Función principal que maneja los comandos de KMD.
-    Analiza los argumentos de la línea de comandos y ejecuta la acción correspondiente.
+    Lock de lectura/escritura sencillo: varias operaciones compartidas a la vez,
+    o una sola operación exclusiva.
     """
-    writeLog("INFO", f"KMD {KMD_VERSION} running.", True)
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+
+    def acquire_shared(self):
+        with self._cond:
+            while self._writer:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_shared(self):
+        with self._cond:
+            self._readers -= 1
+            self._cond.notify_all()
+
+    def acquire_exclusive(self):
+        with self._cond:
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writer = True
+
+    def release_exclusive(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+class IPCTransport:
+    """
+    Transporte local entre la CLI y el daemon.
+    Las implementaciones deben crear el servidor (create_server) y conectarse a él (connect).
+    """
+    def create_server(self, handler_class):
+        raise NotImplementedError
+
+    def connect(self, timeout):
+        """
+        Devuelve (socket, token) conectado al daemon, o None si el daemon no está corriendo.
+        """
+        raise NotImplementedError
+
+    def cleanup(self):
+        pass
+
+class UnixSocketTransport(IPCTransport):
+    """
+    Socket Unix en la carpeta de caché. Solo el usuario dueño de la caché puede conectarse.
+    """
+    def __init__(self, cache_path):
+        self.path = os.path.join(cache_path, "kmd.sock")
+
+    def create_server(self, handler_class):
+        import socketserver
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if os.path.exists(self.path):
+            os.remove(self.path) # Socket huérfano de un daemon anterior
+        server = socketserver.ThreadingUnixStreamServer(self.path, handler_class)
+        os.chmod(self.path, 0o600)
+        return server
+
+    def connect(self, timeout):
+        import socket
+        if not os.path.exists(self.path):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            return None
+        sock.settimeout(None)
+        return sock, None
+
+    def cleanup(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class LoopbackTransport(IPCTransport):
+    """
+    TCP en 127.0.0.1 con un puerto efímero. El puerto y un token aleatorio se guardan en
+    la carpeta de caché, así que solo quien puede leer la caché puede hablar con el daemon.
+    Sirve en sistemas sin sockets Unix (Windows).
+    """
+    def __init__(self, cache_path):
+        self.path = os.path.join(cache_path, "kmd.daemon.json")
+
+    def create_server(self, handler_class):
+        import secrets
+        import socketserver
+        server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), handler_class)
+        server.token = secrets.token_hex(16)
+        write_file_atomic(self.path, json.dumps({"port": server.server_address[1], "token": server.token, "pid": os.getpid()}))
+        return server
+
+    def connect(self, timeout):
+        import socket
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                info = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        try:
+            sock = socket.create_connection(("127.0.0.1", info["port"]), timeout=timeout)
+        except OSError:
+            return None
+        sock.settimeout(None)
+        return sock, info.get("token")
+
+    def cleanup(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def get_ipc_transport():
+    """
+    Devuelve el transporte IPC para la carpeta de caché activa, según la plataforma.
+    """
+    return PLATFORM.ipc_transport(CACHE_PATH)
+
+class _ThreadOutput:
+    """
+    Sustituto de sys.stdout/sys.stderr en el daemon: lo que imprime cada hilo se envía
+    al cliente que lo pidió en lugar de a la consola del daemon.
+    """
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.local = threading.local()
+
+    def write(self, data):
+        sink = getattr(self.local, "sink", None)
+        if sink is None:
+            return self.fallback.write(data)
+        sink(data)
+        return len(data)
+
+    def flush(self):
+        if getattr(self.local, "sink", None) is None:
+            self.fallback.flush()
+
+    def isatty(self):
+        return False
+
+    def __getattr__(self, name):
+        return getattr(self.fallback, name)
+
+def get_daemon_identity():
+    """
+    Devuelve las rutas, el índice, las fuentes, la política de scripts, los límites (descargas, hilos, locks)
+    la huella rápida y el archivo de métricas activos. La CLI solo reenvía comandos a un daemon que use exactamente la misma configuración:
+    es global del proceso, así que el daemon no puede cambiarla para un solo comando.
+    """
+    return {
+        "installPath": INSTALL_PATH, "logPath": LOG_PATH, "cachePath": CACHE_PATH, "indexURL": INDEX_URL,
+        "indexSources": INDEX_SOURCES, "scriptTimeout": SCRIPT_TIMEOUT, "scriptErrors": SCRIPT_ERRORS,
+        "maxBandwidth": MAX_BANDWIDTH, "maxConnectionsPerHost": MAX_CONNECTIONS_PER_HOST, "jobs": JOBS,
+        "lockTimeout": LOCK_TIMEOUT, "localDigest": LOCAL_DIGEST, "metricsPath": METRICS_PATH,
+    }
+
+def _send_message(wfile, message):
+    wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+    wfile.flush()
+
+def forward_to_daemon(argv, config):
+    """
+    Reenvía un comando al daemon si está corriendo y muestra su salida.
+    argv: Los argumentos de la línea de comandos (sin el nombre del programa).
+    config: La configuración activa; si no coincide con la del daemon, no se reenvía.
+    Devuelve el código de salida del comando, o None si hay que ejecutarlo localmente.
+    """
+    connection = get_ipc_transport().connect(DAEMON_CONNECT_TIMEOUT)
+    if connection is None:
+        return None
+    sock, token = connection
+    writeLog("INFO", f"Reenviando comando al daemon: {' '.join(argv)}")
+    started = False
+    with sock, sock.makefile('rb') as rfile, sock.makefile('wb', buffering=0) as wfile:
+        try:
+            _send_message(wfile, {
+                "token": token,
+                "argv": argv,
+                "config": get_daemon_identity(),
+            })
+            for line in rfile:
+                message = json.loads(line)
+                started = True
+                if "out" in message:
+                    sys.stdout.write(message["out"])
+                    sys.stdout.flush()
+                elif "ask" in message:
+                    try:
+                        answer = input(message["ask"])
+                    except EOFError:
+                        answer = ""
+                    _send_message(wfile, {"answer": answer})
+                elif "exit" in message:
+                    return message["exit"]
+                elif message.get("reject"):
+                    writeLog("INFO", f"El daemon rechazó el comando ({message['reject']}). Ejecutando localmente")
+                    return None
+        except (OSError, ValueError) as e:
+            if not started:
+                # El daemon se estaba deteniendo: el comando no llegó a ejecutarse
+                writeLog("WARNING", f"No se pudo hablar con el daemon ({e}). Ejecutando localmente")
+                return None
+            writeLog("ERROR", f"Se perdió la conexión con el daemon: {e}")
+            print(f"Error: Se perdió la conexión con el daemon: {e}")
+            return 1
+    if not started:
+        writeLog("WARNING", "El daemon cerró la conexión sin responder. Ejecutando localmente")
+        return None
+    writeLog("ERROR", "El daemon cerró la conexión sin devolver un código de salida")
+    print("Error: El daemon cerró la conexión sin devolver un código de salida")
+    return 1
+
+def run_daemon(config):
+    """
+    Ejecuta el daemon de KMD en primer plano.
+    Mantiene el catálogo, el registro y el pool HTTP en memoria y atiende los comandos
+    que le reenvía la CLI. Las consultas de solo lectura se atienden en paralelo; las
+    operaciones se serializan por paquete, y las que tocan muchos paquetes van en exclusiva.
+    """
+    import io
+    import socketserver
+    global CATALOG_MAX_AGE
+
+    transport = get_ipc_transport()
+    if transport.connect(DAEMON_CONNECT_TIMEOUT) is not None:
+        print("El daemon de KMD ya está corriendo.")
+        return 1
+
+    CATALOG_MAX_AGE = DAEMON_CATALOG_MAX_AGE
+    operations = ReadWriteLock()
+    stats = {"startedAt": time.time(), "requests": 0}
+    expected_config = get_daemon_identity()
+
+    # Precalentar el catálogo y el registro
+    try:
+        # Con un índice fragmentado basta con la raíz: los fragmentos se cargan según se usan
+        if get_index_root() is None:
+            get_catalog()
+    except Exception as e:
+        writeLog("WARNING", f"El daemon no pudo cargar el catálogo al iniciar: {e}")
+    try:
+        load_registry()
+    except json.JSONDecodeError:
+        writeLog("WARNING", "El archivo installed.json está corrupto o malformado")
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            try:
+                request = json.loads(self.rfile.readline())
+            except ValueError:
+                return
+            if getattr(self.server, "token", None) != request.get("token"):
+                _send_message(self.wfile, {"reject": "token"})
+                return
+            if request.get("config") != expected_config:
+                _send_message(self.wfile, {"reject": "config"})
+                return
+            try:
+                args = build_parser().parse_args(request.get("argv", []))
+            except SystemExit:
+                _send_message(self.wfile, {"reject": "argv"})
+                return
+
+            if args.command == 'daemon':
+                if args.value == 'stop':
+                    _send_message(self.wfile, {"out": "Deteniendo el daemon de KMD...\n"})
+                    _send_message(self.wfile, {"exit": 0})
+                    threading.Thread(target=self.server.shutdown, daemon=True).start()
+                else:
+                    uptime = int(time.time() - stats["startedAt"])
+                    revision = _catalog.revision if _catalog is not None else None
+                    _send_message(self.wfile, {"out": f"Daemon de KMD corriendo (PID {os.getpid()}, {uptime} s, {stats['requests']} comandos atendidos, revisión del índice: {revision})\n"})
+                    _send_message(self.wfile, {"exit": 0})
+                return
+
+            stats["requests"] += 1
+            writeLog("INFO", f"Daemon: ejecutando '{' '.join(request.get('argv', []))}'")
+            wfile, rfile = self.wfile, self.rfile
+
+            def ask(question):
+                _send_message(wfile, {"ask": question})
+                line = rfile.readline()
+                if not line:
+                    raise EOFError
+                return json.loads(line).get("answer", "")
+
+            output.local.sink = lambda data: _send_message(wfile, {"out": data})
+            errors.local.sink = output.local.sink
+            _prompt_handler.ask = ask
+            try:
+                if args.command in GLOBAL_COMMANDS:
+                    operations.acquire_exclusive()
+                    release = operations.release_exclusive
+                elif args.command in READ_ONLY_COMMANDS:
+                    release = None
+                else:
+                    operations.acquire_shared()
+                    release = operations.release_shared
+                try:
+                    code = run_command(args, config)
+                finally:
+                    if release:
+                        release()
+                _send_message(wfile, {"exit": code})
+            except OSError:
+                writeLog("WARNING", "El cliente se desconectó antes de terminar el comando")
+            finally:
+                output.local.sink = None
+                errors.local.sink = None
+                _prompt_handler.ask = None
+
+    server = transport.create_server(Handler)
+    server.daemon_threads = True
+
+    # La salida de cada hilo va a su cliente y las preguntas se le hacen al cliente (ver ask_yes_no).
+    # input() directo no tiene terminal: recibe EOF.
+    output = _ThreadOutput(sys.stdout)
+    errors = _ThreadOutput(sys.stderr)
+    sys.stdout, sys.stderr, sys.stdin = output, errors, io.StringIO("")
+
+    writeLog("OK", f"Daemon de KMD iniciado (PID {os.getpid()})")
+    print(f"Daemon de KMD escuchando (PID {os.getpid()}). Ctrl+C para detenerlo.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        transport.cleanup()
+        sys.stdout, sys.stderr = output.fallback, errors.fallback
+        writeLog("OK", "Daemon de KMD detenido")
+        print("Daemon de KMD detenido.")
+    return 0
+
+def daemon_command(action, config):
+    """
+    Maneja "kmd daemon [start|stop|status]".
+    Devuelve el código de salida.
+    """
+    if action == 'start':
+        return run_daemon(config)
+    if action not in ['stop', 'status']:
+        print("Uso: kmd daemon [start|stop|status]")
+        return 1
+    code = forward_to_daemon(['daemon', action], config)
+    if code is None:
+        print("El daemon de KMD no está corriendo.")
+        return 1
+    return code
+
+def build_parser():
+    """
+    Construye el parser de argumentos de la línea de comandos.
+    """
+    import argparse
     parser = argparse.ArgumentParser(description='KMD - Gestor de paquetes')
     parser.add_argument('command', help='Comando: install, search, list-all, uninstall, remove, update, etc (Ejecuta "kmd help" para verlos completos)')
     parser.add_argument('value', nargs='?', help='ID del paquete')
     parser.add_argument('extraArgs', nargs='?', help='Argumentos extra (Si son necesarios)')
-    args = parser.parse_args()
-
-    # Añadir 1% de probabilidad de mostrar mensaje existencial
-    if random.random() < 0.01:
-        print("\n" + get_existential_message() + "\n")
-
+    parser.add_argument('--install-path', dest='installPath', help='Ruta de instalación de paquetes (KMD_INSTALL_PATH)')
+    parser.add_argument('--log-path', dest='logPath', help='Carpeta del log (KMD_LOG_PATH)')
+    parser.add_argument('--cache-path', dest='cachePath', help='Carpeta de la caché (KMD_CACHE_PATH)')
+    parser.add_argument('--index-url', dest='indexURL', help='URL del índice de paquetes (KMD_INDEX_URL)')
+    parser.add_argument('--index-source', dest='indexSources', action='append', help='Fuente extra del índice, se puede repetir (KMD_INDEX_SOURCES)')
+    parser.add_argument('--platform', dest='platform', choices=sorted(PLATFORMS), help='Plataforma a usar (KMD_PLATFORM)')
+    parser.add_argument('--lock-timeout', dest='lockTimeout', help='Segundos máximos de espera por el lock de un paquete (KMD_LOCK_TIMEOUT)')
+    parser.add_argument('--script-timeout', dest='scriptTimeout', help='Segundos máximos que puede tardar un script de un paquete (KMD_SCRIPT_TIMEOUT)')
+    parser.add_argument('--script-errors', dest='scriptErrors', choices=SCRIPT_ERROR_POLICIES, help='Qué hacer si un script falla (KMD_SCRIPT_ERRORS)')
+    parser.add_argument('--max-bandwidth', dest='maxBandwidth', help='Bytes por segundo entre todas las descargas, p. ej. 500K o 2M (KMD_MAX_BANDWIDTH)')
+    parser.add_argument('--max-connections-per-host', dest='maxConnectionsPerHost', help='Descargas simultáneas contra un mismo servidor (KMD_MAX_CONNECTIONS_PER_HOST)')
+    parser.add_argument('--update-check-interval', dest='updateCheckInterval', help='Segundos entre búsquedas de versiones nuevas de KMD; 0 = nunca (KMD_UPDATE_CHECK_INTERVAL)')
+    parser.add_argument('--local-digest', dest='localDigest', choices=LOCAL_DIGESTS, help='Huella rápida que se guarda de cada archivo para verify (KMD_LOCAL_DIGEST)')
+    parser.add_argument('--metrics-path', dest='metricsPath', help='Archivo .prom donde se escriben las métricas (KMD_METRICS_PATH)')
+    parser.add_argument('--jobs', dest='jobs', help='Paquetes independientes que se instalan/actualizan a la vez (KMD_JOBS)')
+    parser.add_argument('--config', dest='configFile', help='Archivo de configuración (KMD_CONFIG)')
+    parser.add_argument('--prefix', dest='searchMode', action='store_const', const='prefix', default='ranked', help='search: solo coincidencias por prefijo')
+    parser.add_argument('--fuzzy', dest='searchMode', action='store_const', const='fuzzy', help='search: incluye coincidencias aproximadas')
+    parser.add_argument('--limit', dest='limit', type=int, help='search: número máximo de resultados')
+    parser.add_argument('--packages', dest='packages', help='mirror: IDs de los paquetes a copiar, separados por comas')
+    parser.add_argument('--all-versions', dest='allVersions', action='store_true', help='mirror: copia todas las versiones')
+    parser.add_argument('--outdated', dest='outdated', action='store_true', help='prefetch: descarga las actualizaciones pendientes')
+    parser.add_argument('--lock', dest='lockFile', help='prefetch: archivo con los paquetes y versiones a descargar')
+    parser.add_argument('--foreground', dest='foreground', action='store_true', help='prefetch: no pasa a segundo plano')
+    parser.add_argument('--all', dest='verifyAll', action='store_true', help='verify: comprueba todos los paquetes instalados')
+    parser.add_argument('--full', dest='fullVerify', action='store_true', help='verify: usa SHA-256 aunque haya huella rápida')
+    parser.add_argument('--keep-previous', dest='keepPrevious', action='store_true', help='gc: conserva la versión anterior de cada paquete')
+    parser.add_argument('--format', dest='outputFormat', choices=OUTPUT_FORMATS, default='text', help='Formato de salida de los comandos de consulta')
+    parser.add_argument('--json', dest='outputFormat', action='store_const', const='ndjson', help='Igual que --format ndjson')
+    parser.add_argument('--no-daemon', dest='noDaemon', action='store_true', help='No reenviar el comando al daemon aunque esté corriendo')
+    return parser
+
+def run_command(args, config):
+    """
+    Ejecuta un comando ya analizado por build_parser().
+    args: Los argumentos del comando.
+    config: La configuración activa (ver load_config).
+    Devuelve el código de salida (0 si no hubo errores).
+    """
+    ok = True
+    output_format = getattr(args, "outputFormat", "text")
+    start = time.monotonic()
     try:
         # Instalar paquete (Con versión)
         if args.command == 'install' and args.value and args.extraArgs:
             writeLog("INFO", f"Iniciando instalación de {args.value} versión {args.extraArgs}")
-            install_package(args.value, args.extraArgs)
+            ok = install_package(args.value, args.extraArgs)
 
         # Instalar paquete
         elif args.command == 'install' and args.value:
             writeLog("INFO", f"Iniciando instalación de {args.value}...")
-            install_package(args.value)
+            ok = install_package(args.value)
 
         # Buscar paquete
         elif args.command == 'search' and args.value:
             writeLog("INFO", f"Buscando paquete '{args.value}'...")
-            search_packages(args.value)
+            ok = search_packages(args.value, args.searchMode, args.limit, output_format)
 
         elif args.command == 'list-all':
-            writeLog("INFO", f"Listando todos los paquetes...")
-            list_all_packages()
+            writeLog("INFO", "Listando todos los paquetes...")
+            ok = list_all_packages(output_format)
 
         elif args.command == 'repair' and args.value:
             writeLog("INFO", f"Reparando instalación de {args.value}")
-            repair_package(args.value)
+            ok = repair_package(args.value)
 
         elif args.command == 'who-depends' and args.value:
             writeLog("INFO", f"Verificando paquetes que dependen de {args.value}")
-            who_depends(args.value)
+            ok = who_depends(args.value, output_format=output_format) is not None
 
         elif args.command == 'autoremove':
-            writeLog("INFO", f"Eliminando dependencias huerfanas...")
-            autoremove_unused_packages()
+            writeLog("INFO", "Eliminando dependencias huerfanas...")
+            ok = autoremove_unused_packages()
 
         elif args.command == 'list-installed':
-            writeLog("INFO", f"Listando paquetes instalados...")
-            list_installed_packages()
+            writeLog("INFO", "Listando paquetes instalados...")
+            ok = list_installed_packages(output_format)
 
         elif args.command in ['uninstall', 'remove'] and args.value:
             writeLog("INFO", f"Desinstalando paquete '{args.value}'...")
-            uninstall_package(args.value)
+            ok = uninstall_package(args.value)
 
         elif args.command == 'update' and args.value:
             writeLog("INFO", f"Actualizando paquete '{args.value}'...")
-            update_package(args.value)
+            ok = update_package(args.value)
 
         elif args.command == 'update-all':
-            writeLog("INFO", f"Actualizando todos los paquetes...")
-            update_all_packages()
+            writeLog("INFO", "Actualizando todos los paquetes...")
+            ok = update_all_packages()
+
+        elif args.command == 'outdated':
+            writeLog("INFO", "Buscando paquetes desactualizados...")
+            ok = list_outdated_packages(output_format)
+
+        elif args.command == 'rollback' and args.value:
+            writeLog("INFO", f"Volviendo a la versión anterior de {args.value}...")
+            ok = rollback_package(args.value)
+
+        elif args.command == 'mirror' and args.value:
+            writeLog("INFO", f"Actualizando mirror en {args.value}...")
+            ok = mirror_packages(args.value, args.packages, args.allVersions)
+
+        elif args.command == 'prefetch':
+            writeLog("INFO", "Descargando paquetes por adelantado...")
+            ok = prefetch_packages(args.value, args.outdated, args.lockFile, args.foreground)
+
+        elif args.command == 'gc':
+            writeLog("INFO", "Borrando versiones inactivas...")
+            ok = gc_packages(args.keepPrevious)
+
+        elif args.command == 'verify':
+            writeLog("INFO", f"Comprobando archivos de {args.value or 'todos los paquetes'}...")
+            ok = verify_packages(args.value, args.verifyAll, args.fullVerify, output_format)
+
+        elif args.command == 'whats-new':
+            writeLog("INFO", "Mostrando los cambios del índice...")
+            ok = whats_new_command(output_format)
+
+        elif args.command == 'cache':
+            writeLog("INFO", f"Ejecutando cache {args.value or 'stats'}...")
+            ok = cache_command(args.value or "stats")
 
         elif args.command == 'list-versions' and args.value:
             writeLog("INFO", f"Listando versiones del paquete '{args.value}'...")
-            list_package_versions(args.value)
+            ok = list_package_versions(args.value, output_format)
 
         elif args.command in ['help', 'usage']:
-            writeLog("INFO", f"Imprimiendo ayuda...")
+            writeLog("INFO", "Imprimiendo ayuda...")
             print(get_usage())
 
         elif args.command in ['version', '-v', '--version']:
-            writeLog("INFO", f"Mostrando versión de KMD...")
+            writeLog("INFO", "Mostrando versión de KMD...")
             print(get_kmdVersion())
 
+        elif args.command == 'check-update':
+            writeLog("INFO", "Buscando actualizaciones de KMD...")
+            available, latest_version, _ = check_for_updates(False)
+            if latest_version and not available:
+                print(f"KMD está actualizado ({KMD_VERSION}).")
+            ok = latest_version is not None
+
         elif args.command == 'update-kmd':
-            writeLog("INFO", f"Actualizando KMD a la última versión...")
-            update_kmd()
+            writeLog("INFO", "Actualizando KMD a la última versión...")
+            ok = update_kmd()
+
+        elif args.command == 'daemon':
+            writeLog("INFO", f"Comando del daemon: {args.value or 'start'}")
+            return daemon_command(args.value or 'start', config)
+
+        elif args.command == 'config':
+            writeLog("INFO", "Mostrando configuración...")
+            for key, value in config.items():
+                if key != "indexSources":
+                    print(f"{key}: {value}")
+            if len(INDEX_SOURCES) > 1:
+                print("Fuentes del índice (de mayor a menor prioridad):")
+                for source in INDEX_SOURCES:
+                    print(f"  {source['priority']:>4}  {source['name']}: {source['url']}")
+
+        elif args.command == 'metrics':
+            writeLog("INFO", "Mostrando métricas...")
+            print(render_metrics(read_metrics()), end="")
 
         elif args.command == 'whoami':
-            writeLog("INFO", f"Mostrando información del autor...")
+            writeLog("INFO", "Mostrando información del autor...")
             print(f"Autor: CeccPro\nGitHub: {MY_GITHUB}\nVersión de KMD: {KMD_VERSION}")
 
         elif args.command == 'meaning-of-life':
@@ -1262,11 +6143,64 @@ def main():
         else:
             writeLog("ERROR", f"Comando '{args.command} {args.value} {args.extraArgs}' no reconocido. Imprimiendo ayuda")
             print("Uso inválido.", get_usage())
+            ok = False
+
+    except Exception as e:
+        if output_format == "ndjson":
+            _emit_error(e)
+        else:
+            print(f"Error: {e}")
+        ok = False
+
+    # search devuelve una lista (vacía si no hubo coincidencias): eso no es un error
+    code = 1 if ok is False or ok == "ERROR" else 0
+    if args.command not in CHEAP_COMMANDS and args.command != 'daemon':
+        METRICS.observe("kmd_command_duration_seconds", time.monotonic() - start, command=args.command)
+        METRICS.inc("kmd_commands_total", command=args.command, result="ok" if code == 0 else "error")
+        flush_metrics()
+    return code
+
+
+def main():
+    """
+    Función principal que maneja los comandos de KMD.
+    Analiza los argumentos de la línea de comandos y ejecuta la acción correspondiente.
+    Si el daemon de KMD está corriendo, le reenvía el comando.
+    Devuelve (argumentos analizados, código de salida).
+    """
+    import random
+    args = build_parser().parse_args()
 
+    try:
+        config = configure({key: getattr(args, key) for key in CONFIG_KEYS}, args.configFile)
     except Exception as e:
         print(f"Error: {e}")
+        sys.exit(1)
+    writeLog("INFO", f"KMD {KMD_VERSION} running.", True)
 
-if __name__ == '__main__':
-    main() # Ejecutar la función principal
+    # Reenviar al daemon si está corriendo (los comandos baratos no lo necesitan, y prefetch se relanza en segundo plano)
+    if args.command not in CHEAP_COMMANDS and args.command not in ('daemon', 'prefetch') and not args.noDaemon:
+        code = forward_to_daemon(sys.argv[1:], config)
+        if code is not None:
+            sys.exit(code)
+
+    # Añadir 1% de probabilidad de mostrar mensaje existencial (no en la salida para máquinas)
+    if random.random() < 0.01 and args.outputFormat == "text":
+        print("\n" + get_existential_message() + "\n")
+
+    return args, run_command(args, config)
+
+def run():
+    """
+    Punto de entrada de la línea de comandos (lo usan kmd.py y `python source.py`).
+    Ejecuta main, revisa el tamaño del log, avisa de actualizaciones y sale con el código del comando.
+    """
+    args, exit_code = main() # Ejecutar la función principal
     check_log_size() # Verificar el tamaño del log al finalizar
-    check_for_updates(False) # Comprobar si hay actualizaciones al finalizar
\ No newline at end of file
+    if args.command not in CHEAP_COMMANDS and args.command not in ('daemon', 'check-update') and args.outputFormat == "text":
+        show_update_notice() # Avisar si hay actualizaciones (sin esperar a la red)
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    run()